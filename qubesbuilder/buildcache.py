@@ -0,0 +1,229 @@
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2026 agent <agent@local>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import urllib.error
+import urllib.request
+from pathlib import Path, PurePosixPath
+from typing import Dict, Optional
+
+from qubesbuilder.exc import QubesBuilderError
+from qubesbuilder.log import QubesBuilderLogger
+
+# Digests of plugins directories, they do not change during a run
+_directories_digests: Dict[str, str] = {}
+
+
+class BuildCacheError(QubesBuilderError):
+    """
+    Build cache exception
+    """
+
+
+def get_directory_digest(directory: Path) -> str:
+    """
+    Digest of names and content of every file of a directory.
+    """
+    key = str(directory)
+    if key not in _directories_digests:
+        digest = hashlib.sha256()
+        for path in sorted(directory.rglob("*")):
+            if "__pycache__" in path.parts or not path.is_file():
+                continue
+            digest.update(str(path.relative_to(directory)).encode() + b"\0")
+            digest.update(hashlib.sha256(path.read_bytes()).digest())
+        _directories_digests[key] = digest.hexdigest()
+    return _directories_digests[key]
+
+
+def get_build_fingerprint(inputs: Dict) -> str:
+    """
+    Key of a build in the cache, from every input of the build.
+    """
+    return hashlib.sha256(
+        json.dumps(inputs, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class BuildCache:
+    """
+    Store of build stage artifacts directories, as tar archives, shared
+    between builders.
+    """
+
+    def __init__(self, read_only: bool = False):
+        self.read_only = read_only
+        self.log = QubesBuilderLogger.getChild("buildcache")
+
+    def _get(self, key: str, archive: Path) -> bool:
+        raise NotImplementedError
+
+    def _put(self, key: str, archive: Path):
+        raise NotImplementedError
+
+    @staticmethod
+    def _check_member(member: tarfile.TarInfo):
+        path = PurePosixPath(member.name)
+        if (
+            path.is_absolute()
+            or ".." in path.parts
+            or not (member.isfile() or member.isdir())
+        ):
+            raise BuildCacheError(f"Invalid archive member '{member.name}'.")
+
+    @staticmethod
+    def _add_directory(tar: tarfile.TarFile, directory: Path):
+        # Artifacts are often hard linked to each other: store them as
+        # regular files only.
+        for path in sorted(directory.rglob("*")):
+            info = tarfile.TarInfo(str(path.relative_to(directory)))
+            st = path.stat()
+            info.mode = st.st_mode & 0o7777
+            info.mtime = int(st.st_mtime)
+            if path.is_dir():
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+            elif path.is_file():
+                info.size = st.st_size
+                with open(path, "rb") as f:
+                    tar.addfile(info, f)
+
+    def get(self, key: str, artifacts_dir: Path) -> bool:
+        """
+        Extract artifacts built with the given key into 'artifacts_dir'.
+        Return whether they were found.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            archive = Path(temp_dir) / f"{key}.tar"
+            try:
+                if not self._get(key, archive):
+                    return False
+                with tarfile.open(archive) as tar:
+                    members = tar.getmembers()
+                    for member in members:
+                        self._check_member(member)
+                    extract_dir = Path(temp_dir) / "artifacts"
+                    tar.extractall(extract_dir, members=members)
+            except (
+                OSError,
+                tarfile.TarError,
+                urllib.error.URLError,
+                BuildCacheError,
+            ) as e:
+                self.log.warning(f"Cannot get '{key}' from cache: {str(e)}")
+                return False
+            if artifacts_dir.exists():
+                shutil.rmtree(artifacts_dir)
+            artifacts_dir.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(extract_dir, artifacts_dir)
+        return True
+
+    def put(self, key: str, artifacts_dir: Path):
+        if self.read_only:
+            return
+        with tempfile.TemporaryDirectory() as temp_dir:
+            archive = Path(temp_dir) / f"{key}.tar"
+            try:
+                with tarfile.open(archive, "w") as tar:
+                    self._add_directory(tar, artifacts_dir)
+                self._put(key, archive)
+            except (OSError, tarfile.TarError, urllib.error.URLError) as e:
+                self.log.warning(f"Cannot put '{key}' into cache: {str(e)}")
+
+
+class DirectoryBuildCache(BuildCache):
+    """
+    Build cache in a local or network mounted directory.
+    """
+
+    def __init__(self, directory: Path, read_only: bool = False):
+        super().__init__(read_only=read_only)
+        self.directory = directory
+
+    def _get(self, key: str, archive: Path) -> bool:
+        cached = self.directory / f"{key}.tar"
+        if not cached.exists():
+            return False
+        shutil.copyfile(cached, archive)
+        return True
+
+    def _put(self, key: str, archive: Path):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.directory, delete=False) as f:
+            with open(archive, "rb") as source:
+                shutil.copyfileobj(source, f)
+        os.replace(f.name, self.directory / f"{key}.tar")
+
+
+class HTTPBuildCache(BuildCache):
+    """
+    Build cache served over HTTP: archives are downloaded with GET and
+    uploaded with PUT requests on '<url>/<key>.tar'.
+    """
+
+    def __init__(self, url: str, read_only: bool = False, timeout: int = 60):
+        super().__init__(read_only=read_only)
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _get(self, key: str, archive: Path) -> bool:
+        try:
+            with urllib.request.urlopen(
+                f"{self.url}/{key}.tar", timeout=self.timeout
+            ) as response, open(archive, "wb") as f:
+                shutil.copyfileobj(response, f)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return False
+            raise
+        return True
+
+    def _put(self, key: str, archive: Path):
+        with open(archive, "rb") as f:
+            request = urllib.request.Request(
+                f"{self.url}/{key}.tar",
+                data=f,
+                method="PUT",
+                headers={
+                    "Content-Type": "application/x-tar",
+                    "Content-Length": str(archive.stat().st_size),
+                },
+            )
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                pass
+
+
+def get_build_cache(options: Optional[Dict]) -> Optional[BuildCache]:
+    if not options:
+        return None
+    read_only = bool(options.get("read-only", False))
+    if options.get("url", None):
+        return HTTPBuildCache(options["url"], read_only=read_only)
+    if options.get("directory", None):
+        return DirectoryBuildCache(
+            Path(options["directory"]).expanduser().resolve(),
+            read_only=read_only,
+        )
+    raise BuildCacheError(
+        "Build cache requires either 'directory' or 'url' option."
+    )
@@ -0,0 +1,105 @@
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2026 agent <agent@local>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+import hashlib
+import os
+import shutil
+from pathlib import Path
+from typing import Union
+
+from qubesbuilder.log import QubesBuilderLogger
+
+# Size of reads when hashing artifacts
+DIGEST_BUFFER_SIZE = 1024 * 1024
+
+
+def get_file_digest(path: Union[Path, str]) -> str:
+    digest = hashlib.sha256()
+    buffer = bytearray(DIGEST_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            digest.update(view[:size])
+    return digest.hexdigest()
+
+
+class ArtifactsStore:
+    """
+    Content-addressed store of artifacts. Every file is stored once as
+    '<path>/<sha256>' and hard linked to the stage directories using it.
+
+    Objects are shared by all their links: a file of the store must be
+    unshared before being modified in place, e.g. when signing it.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.log = QubesBuilderLogger.getChild("cas")
+
+    def get_path(self, digest: str) -> Path:
+        return self.path / digest
+
+    def contains(self, digest: str) -> bool:
+        return self.get_path(digest).exists()
+
+    def add(self, path: Path) -> str:
+        """
+        Store the file and replace it by a link to the stored object if
+        the same content was already there. Return its digest.
+        """
+        digest = get_file_digest(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        try:
+            self.link(digest, path)
+        except FileNotFoundError:
+            try:
+                os.link(path, self.get_path(digest))
+            except FileExistsError:
+                # Stored at the same time by another job
+                self.link(digest, path)
+        except OSError as e:
+            # Keep the file as it is, e.g. on another filesystem
+            self.log.debug(f"Cannot link '{path}' to the store: {str(e)}")
+        return digest
+
+    def link(self, digest: str, target: Path):
+        """
+        Link the object 'digest' to 'target', replacing it if it exists.
+        """
+        obj = self.get_path(digest)
+        if target.exists() and os.path.samefile(obj, target):
+            return
+        temp_target = target.with_name(f".{target.name}.cas")
+        if temp_target.exists():
+            temp_target.unlink()
+        os.link(obj, temp_target)
+        os.replace(temp_target, target)
+
+    @staticmethod
+    def unshare(path: Path):
+        """
+        Replace a file having several links by a copy of its own.
+        """
+        if not path.exists() or path.stat().st_nlink == 1:
+            return
+        temp_path = path.with_name(f".{path.name}.unshare")
+        shutil.copy2(path, temp_path)
+        os.replace(temp_path, path)
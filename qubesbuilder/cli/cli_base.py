@@ -20,18 +20,22 @@
 """
 QubesBuilder command-line interface - base module.
 """
+
 import asyncio
 import signal
 import sys
 import traceback
-from typing import Callable, List
+from typing import Callable, Dict, List, Optional
 
 import click
 
 from qubesbuilder.component import QubesComponent
 from qubesbuilder.config import Config
 from qubesbuilder.distribution import QubesDistribution
+from qubesbuilder.executors.qubes import DispVMReaper
 from qubesbuilder.log import QubesBuilderLogger
+from qubesbuilder.plugins import Plugin
+from qubesbuilder.scheduler import JobScheduler, JobsHistory
 from qubesbuilder.template import QubesTemplate
 
 
@@ -76,6 +80,8 @@ class AliasedGroup(click.Group):
                     formatted_tb = "".join(traceback.format_exception(e))
                     QubesBuilderLogger.error("\n" + formatted_tb.rstrip("\n"))
                 QubesBuilderLogger.error(f"Cleanup callback failed: {e}")
+        # Disposable qubes of finished jobs may still be being removed
+        DispVMReaper.drain_all()
 
     def invoke(self, ctx):
         """
@@ -180,3 +186,41 @@ def aliased_group(name=None, **kwargs) -> Callable[[Callable], AliasedGroup]:
         return click.group(name, cls=AliasedGroup, **kwargs)(f)
 
     return decorator
+
+
+def run_jobs(
+    config: Config,
+    graph: Dict[Plugin, List[Plugin]],
+    on_job_done: Optional[
+        Callable[[Plugin], Dict[Plugin, List[Plugin]]]
+    ] = None,
+    **kwargs,
+):
+    """
+    Run jobs of a dependency graph with the configured number of workers.
+    See JobScheduler for 'on_job_done'.
+    """
+    try:
+        ctx = click.get_current_context()
+    except RuntimeError:
+        root_group = None
+    else:
+        root_group = ctx.find_root().command
+
+    def add_cleanup(job: Plugin):
+        if (
+            hasattr(job, "executor")
+            and hasattr(job.executor, "cleanup")
+            and root_group
+        ):
+            root_group.add_cleanup(job.executor.cleanup)
+
+    scheduler = JobScheduler(
+        graph,
+        jobs=config.jobs,
+        on_job_start=add_cleanup,
+        get_job_resources=config.get_job_resources,
+        history=JobsHistory(config.artifacts_dir / "jobs-history.yml"),
+        on_job_done=on_job_done,
+    )
+    scheduler.run(**kwargs)
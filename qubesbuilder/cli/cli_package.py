@@ -1,14 +1,15 @@
 import subprocess
-from typing import List
+from typing import Dict, List, Set
 
 import click
 
-from qubesbuilder.cli.cli_base import aliased_group, ContextObj
+from qubesbuilder.cli.cli_base import aliased_group, ContextObj, run_jobs
 from qubesbuilder.common import STAGES_ALIAS
 from qubesbuilder.component import QubesComponent
 from qubesbuilder.config import Config
 from qubesbuilder.distribution import QubesDistribution
 from qubesbuilder.log import QubesBuilderLogger
+from qubesbuilder.plugins import JobReference, Plugin
 
 
 @aliased_group("package", chain=True)
@@ -30,49 +31,115 @@ def _component_stage(
     """
     QubesBuilderLogger.info(f"Running stages: {', '.join(stages)}")
 
-    try:
-        ctx = click.get_current_context()
-    except RuntimeError:
-        root_group = None
-    else:
-        root_group = ctx.find_root().command
-
     # Mark whether 'fetch' was explicitly requested on the CLI.
     # This lets the Plugin distinguish "explicit fetch"
     # from "fetch only because of a dependency (e.g. prep)".
     if config.get("skip-git-fetch", "default") == "default":
         config.set("skip-git-fetch", "fetch" not in stages)
 
-    for job in config.get_jobs(
-        components=components,
-        distributions=distributions,
-        templates=[],
-        stages=["fetch"],
-    ):
-        if (
-            hasattr(job, "executor")
-            and hasattr(job.executor, "cleanup")
-            and root_group
-        ):
-            root_group.add_cleanup(job.executor.cleanup)
-        job.run(**kwargs)
-
     if "fetch" in stages:
         stages.remove("fetch")
 
-    for job in config.get_jobs(
+    jobs_by_ref: Dict[JobReference, Plugin] = {}
+    fetch_graph = config.get_jobs_graph(
         components=components,
         distributions=distributions,
         templates=[],
-        stages=stages,
-    ):
-        if (
-            hasattr(job, "executor")
-            and hasattr(job.executor, "cleanup")
-            and root_group
-        ):
-            root_group.add_cleanup(job.executor.cleanup)
-        job.run(**kwargs)
+        stages=["fetch"],
+        jobs_by_ref=jobs_by_ref,
+    )
+
+    if config.jobs == 1 or not stages:
+        run_jobs(config, fetch_graph, **kwargs)
+        run_jobs(
+            config,
+            config.get_jobs_graph(
+                components=components,
+                distributions=distributions,
+                templates=[],
+                stages=stages,
+            ),
+            **kwargs,
+        )
+        return
+
+    # With parallel jobs, the other stages of a component are planned as
+    # soon as its sources and the ones it needs are fetched, while other
+    # components are still being fetched. Plugin components are needed
+    # by everyone as they provide plugins instantiating the jobs.
+    required = _get_required_fetches(config, components, distributions, stages)
+    unplanned = list(components)
+    # Components without fetch job are considered as already fetched
+    fetched = {c.name for c in components} - {
+        getattr(job, "component").name
+        for job in fetch_graph
+        if getattr(job, "component", None) is not None
+    }
+
+    def plan():
+        ready = [c for c in unplanned if required[c.name].issubset(fetched)]
+        if not ready:
+            return {}
+        for c in ready:
+            unplanned.remove(c)
+        return config.get_jobs_graph(
+            components=ready,
+            distributions=distributions,
+            templates=[],
+            stages=stages,
+            jobs_by_ref=jobs_by_ref,
+        )
+
+    def on_job_done(job: Plugin):
+        component = getattr(job, "component", None)
+        if job.stage != "fetch" or component is None:
+            return {}
+        fetched.add(component.name)
+        return plan()
+
+    run_jobs(
+        config, {**fetch_graph, **plan()}, on_job_done=on_job_done, **kwargs
+    )
+
+
+def _get_required_fetches(
+    config: Config,
+    components: List[QubesComponent],
+    distributions: List[QubesDistribution],
+    stages: List[str],
+) -> Dict[str, Set[str]]:
+    """
+    For every component, names of the selected components to be fetched
+    before planning its stages: itself, plugin components and components
+    from its 'needs', recursively.
+    """
+    selected = {c.name for c in components}
+    plugins = {c.name for c in components if c.is_plugin}
+    # Needs of each component are resolved only once
+    direct_needs: Dict[str, List[QubesComponent]] = {}
+
+    def get_direct_needs(component: QubesComponent) -> List[QubesComponent]:
+        if component.name not in direct_needs:
+            direct_needs[component.name] = [
+                need.reference.component
+                for dist in distributions
+                for stage in stages
+                for need in config.get_needs(component, dist, stage)
+            ]
+        return direct_needs[component.name]
+
+    required = {}
+    for component in components:
+        names = {component.name} | plugins
+        queue = [component]
+        while queue:
+            current = queue.pop()
+            for dep in get_direct_needs(current):
+                if dep.name not in names:
+                    names.add(dep.name)
+                    queue.append(dep)
+        required[component.name] = names & selected
+    return required
 
 
 @click.command(name="all", short_help="Run all package stages.")
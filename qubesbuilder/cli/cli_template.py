@@ -2,7 +2,7 @@ from typing import List, Optional
 
 import click
 
-from qubesbuilder.cli.cli_base import aliased_group, ContextObj
+from qubesbuilder.cli.cli_base import aliased_group, ContextObj, run_jobs
 from qubesbuilder.common import STAGES, STAGES_ALIAS
 from qubesbuilder.config import Config
 from qubesbuilder.template import QubesTemplate
@@ -31,25 +31,14 @@ def _template_stage(
     # from "prep only because of a dependency (e.g. build)".
     config.set("force-template-prep", "prep" in stages)
 
-    try:
-        ctx = click.get_current_context()
-    except RuntimeError:
-        root_group = None
-    else:
-        root_group = ctx.find_root().command
-
     # Qubes templates
-    jobs = config.get_jobs(
-        templates=templates, components=[], distributions=[], stages=stages
+    run_jobs(
+        config,
+        config.get_jobs_graph(
+            templates=templates, components=[], distributions=[], stages=stages
+        ),
+        template_timestamp=template_timestamp,
     )
-    for job in jobs:
-        if (
-            hasattr(job, "executor")
-            and hasattr(job.executor, "cleanup")
-            and root_group
-        ):
-            root_group.add_cleanup(job.executor.cleanup)
-        job.run(template_timestamp=template_timestamp)
 
 
 @click.command(name="all", short_help="Run all template stages.")
@@ -18,10 +18,14 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import hashlib
+import json
+import os
 import re
 import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Union, List, TYPE_CHECKING
+from typing import Dict, Union, List, Optional, TYPE_CHECKING
 
 if TYPE_CHECKING:
     try:
@@ -38,6 +42,57 @@ from packaging.version import Version, InvalidVersion, VERSION_PATTERN, _Version
 from qubesbuilder.common import sanitize_line, deep_check, VerificationMode
 from qubesbuilder.exc import ComponentError, NoQubesBuilderFileError
 
+# Size of reads when hashing source files
+HASH_BUFFER_SIZE = 1024 * 1024
+HASH_BATCH_SIZE = 64
+
+# Compiled ignore files, with the metadata of the file they were read from
+_IGNORE_SPECS: Dict[str, tuple] = {}
+
+
+def _get_ignore_spec(path: str) -> Optional[pathspec.PathSpec]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (st.st_size, st.st_mtime_ns, st.st_ino)
+    cached = _IGNORE_SPECS.get(path, None)
+    if cached and cached[0] == key:
+        return cached[1]
+    try:
+        with open(path, errors="replace") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    spec = pathspec.PathSpec.from_lines("gitwildmatch", lines)
+    _IGNORE_SPECS[path] = (key, spec)
+    return spec
+
+
+def _get_git_exclude_file(directory: str) -> str:
+    git = os.path.join(directory, ".git")
+    if os.path.isfile(git):
+        # Worktrees and submodules point to their git directory
+        with open(git, errors="replace") as f:
+            content = f.read().strip()
+        if content.startswith("gitdir:"):
+            git = os.path.join(directory, content[len("gitdir:") :].strip())
+    return os.path.join(git, "info", "exclude")
+
+
+def _is_ignored(rules: list, relative_path: str, is_dir: bool) -> bool:
+    """
+    Apply ignore rules as git does: rules of the deepest directory take
+    precedence and, in a given file, the last matching pattern wins.
+    """
+    for base, spec in reversed(rules):
+        path = relative_path[len(base) :] + ("/" if is_dir else "")
+        for pattern in reversed(spec.patterns):
+            if pattern.include is not None and pattern.match_file(path):
+                return pattern.include
+    return False
+
+
 # allow fractional post-release (like 1.0-0.1)
 VERSION_PATTERN_REL = r"(?:(?P<post_frac>\.[0-9]+))?"
 
@@ -85,6 +140,8 @@ class QubesComponent:
         is_plugin: bool = False,
         has_packages: bool = True,
         min_distinct_maintainers: int = 1,
+        source_hash_cache: Path = None,
+        source_hash_mode: str = "walk",
         **kwargs,
     ):
         self.source_dir: Path = (
@@ -104,6 +161,12 @@ class QubesComponent:
         self.is_plugin = is_plugin
         self.has_packages = has_packages
         self._source_hash = ""
+        self._source_hash_cache = source_hash_cache
+        if source_hash_mode not in ("walk", "parallel", "git"):
+            raise ComponentError(
+                f"Unknown source hash mode '{source_hash_mode}'."
+            )
+        self.source_hash_mode = source_hash_mode
         self._devel_path = devel_path
         self.kwargs = kwargs
 
@@ -255,40 +318,284 @@ class QubesComponent:
 
     @staticmethod
     def _update_hash_from_file(filename: Path, hash: "HASH"):
-        with open(str(filename), "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash.update(chunk)
+        with open(str(filename), "rb", buffering=0) as f:
+            if os.fstat(f.fileno()).st_size < HASH_BUFFER_SIZE:
+                hash.update(f.readall())
+                return hash
+            # hashlib releases the GIL while hashing large buffers
+            buffer = bytearray(HASH_BUFFER_SIZE)
+            view = memoryview(buffer)
+            while True:
+                size = f.readinto(buffer)
+                if not size:
+                    break
+                hash.update(view[:size])
         return hash
 
-    def _update_hash_from_dir(self, directory: Path, hash: "HASH"):
+    @classmethod
+    def _get_file_digest(cls, filename: Path) -> str:
+        return cls._update_hash_from_file(
+            filename, hashlib.sha512()
+        ).hexdigest()
+
+    def _walk_source_dir(self, directory: Path):
+        """
+        Yield path, name and whether content is hashed of every entry of a
+        source directory to hash, in a deterministic order.
+        """
         if not directory.exists() or not directory.is_dir():
             raise ComponentError(f"Cannot find '{directory}'.")
-        paths = [name for name in Path(directory).iterdir()]
-        excluded_paths = [directory / ".git"]
-        # We ignore .git and content defined by .gitignore
-        if (directory / ".gitignore").exists():
-            lines = (directory / ".gitignore").read_text().splitlines()
-            spec = pathspec.PathSpec.from_lines("gitwildmatch", lines)
-            excluded_paths += [
-                name for name in paths if spec.match_file(str(name))
+        rules = []
+        exclude_spec = _get_ignore_spec(_get_git_exclude_file(str(directory)))
+        if exclude_spec:
+            rules.append(("", exclude_spec))
+        yield from self._scan_source_dir(str(directory), "", rules)
+
+    def _scan_source_dir(self, directory: str, relative: str, rules: list):
+        # Rules of parent directories apply with the ones of this directory
+        # taking precedence
+        spec = _get_ignore_spec(os.path.join(directory, ".gitignore"))
+        if spec:
+            rules = rules + [(relative, spec)]
+        with os.scandir(directory) as it:
+            entries = [
+                entry
+                for entry in it
+                # We ignore .git and content defined by ignore rules
+                if entry.name != ".git"
+                and not _is_ignored(
+                    rules, relative + entry.name, entry.is_dir()
+                )
             ]
-        sorted_paths = [path for path in paths if path not in excluded_paths]
         # We ensure to compute hash always in a sorted order
-        sorted_paths = sorted(sorted_paths, key=lambda p: str(p).lower())
-        for path in sorted_paths:
-            hash.update(path.name.encode())
-            if path.is_file():
+        entries.sort(key=lambda e: e.name.lower())
+        for entry in entries:
+            if entry.is_file():
+                yield entry.path, entry.name, True
+            elif entry.is_dir():
+                yield entry.path, entry.name, False
+                # Ignored directories are never entered
+                yield from self._scan_source_dir(
+                    entry.path, relative + entry.name + "/", rules
+                )
+            else:
+                yield entry.path, entry.name, False
+
+    def _update_hash_from_dir(self, directory: Path, hash: "HASH"):
+        for path, name, is_file in self._walk_source_dir(directory):
+            hash.update(name.encode())
+            if is_file:
                 hash = self._update_hash_from_file(path, hash)
-            elif path.is_dir():
-                hash = self._update_hash_from_dir(path, hash)
         return hash
 
+    def _get_relative_path(self, path: str) -> str:
+        return path[len(str(self.source_dir)) + 1 :]
+
+    def _get_source_stats(self, paths) -> Dict[str, List[int]]:
+        stats = {}
+        for path, _, is_file in paths:
+            if is_file:
+                st = os.stat(path)
+                stats[self._get_relative_path(path)] = [
+                    st.st_size,
+                    st.st_mtime_ns,
+                    st.st_ctime_ns,
+                    st.st_ino,
+                ]
+        return stats
+
+    def _get_source_signature(self, paths, stats) -> str:
+        # Any added, removed, renamed or modified file changes the signature
+        signature = hashlib.sha256()
+        for path, _, is_file in paths:
+            relative_path = self._get_relative_path(path)
+            signature.update(relative_path.encode())
+            if is_file:
+                signature.update(
+                    ":".join(str(s) for s in stats[relative_path]).encode()
+                )
+            signature.update(b"\0")
+        return signature.hexdigest()
+
+    def _get_files_batch_digests(self, relative_paths: List[str]) -> List[str]:
+        return [
+            self._get_file_digest(self.source_dir / relative_path)
+            for relative_path in relative_paths
+        ]
+
+    def _get_files_digests(self, stats, previous_files) -> Dict[str, str]:
+        """
+        Digest of every file, reusing the previous ones of files whose
+        metadata is unchanged. Others are hashed by a pool of threads.
+        """
+        digests = {}
+        modified = []
+        for relative_path, stat in stats.items():
+            previous = previous_files.get(relative_path, None)
+            if previous and previous[:-1] == stat:
+                digests[relative_path] = previous[-1]
+            else:
+                modified.append(relative_path)
+        # Small files are hashed in batches to limit the threads overhead
+        batches = [
+            modified[i : i + HASH_BATCH_SIZE]
+            for i in range(0, len(modified), HASH_BATCH_SIZE)
+        ]
+        with ThreadPoolExecutor() as pool:
+            for batch, batch_digests in zip(
+                batches, pool.map(self._get_files_batch_digests, batches)
+            ):
+                digests.update(zip(batch, batch_digests))
+        return digests
+
+    def _load_source_hash_cache(self) -> dict:
+        if not self._source_hash_cache:
+            return {}
+        try:
+            with open(self._source_hash_cache) as f:
+                cache = json.load(f)
+            return cache if isinstance(cache, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_source_hash_cache(self, cache: dict):
+        if not self._source_hash_cache:
+            return
+        try:
+            self._source_hash_cache.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                "w", dir=self._source_hash_cache.parent, delete=False
+            ) as f:
+                # json.dumps uses the C encoder, unlike json.dump
+                f.write(json.dumps(cache))
+            os.replace(f.name, self._source_hash_cache)
+        except OSError:
+            pass
+
+    def _run_git(self, *args, stdin: str = None) -> str:
+        result = subprocess.run(
+            ["git", "-C", str(self.source_dir), *args],
+            input=stdin,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return result.stdout
+
+    def _get_git_source_hash(self) -> Optional[str]:
+        """
+        Fingerprint of the source tree based on git objects: tracked files
+        as recorded in the index, modified and untracked non-ignored files
+        as found in the working tree. Returns None when git cannot describe
+        the tree, e.g. not a git checkout, merge conflicts or modified
+        submodules.
+        """
+        try:
+            # Within an enclosing work tree, e.g. ignored by the builder
+            # repository, git does not describe the source directory
+            if self._run_git("rev-parse", "--show-prefix").strip():
+                return None
+            entries = {}
+            for entry in self._run_git("ls-files", "-s", "-z").split("\0"):
+                if not entry:
+                    continue
+                info, path = entry.split("\t", 1)
+                mode, blob, stage = info.split(" ")
+                if stage != "0":
+                    return None
+                entries[path] = (mode, blob)
+
+            changed = []
+            status = self._run_git(
+                "status", "--porcelain=v1", "-z", "--untracked-files=all"
+            ).split("\0")
+            while status:
+                entry = status.pop(0)
+                if not entry:
+                    continue
+                state, path = entry[:2], entry[3:]
+                if state[0] in "RC":
+                    # Renamed or copied: the original path follows
+                    status.pop(0)
+                if "U" in state or state in ("AA", "DD"):
+                    return None
+                if state[1] == "D":
+                    entries.pop(path, None)
+                elif state[1] != " ":
+                    changed.append(path)
+
+            for path in changed:
+                full_path = self.source_dir / path
+                if full_path.is_symlink() or not full_path.is_file():
+                    return None
+            if changed:
+                blobs = self._run_git(
+                    "hash-object",
+                    "--no-filters",
+                    "--stdin-paths",
+                    stdin="\n".join(changed) + "\n",
+                ).split()
+                for path, blob in zip(changed, blobs):
+                    mode = (
+                        "100755"
+                        if os.access(self.source_dir / path, os.X_OK)
+                        else "100644"
+                    )
+                    entries[path] = (mode, blob)
+        except (OSError, ValueError, subprocess.CalledProcessError):
+            return None
+
+        source_hash = hashlib.sha512()
+        for path in sorted(entries):
+            mode, blob = entries[path]
+            source_hash.update(f"{mode} {blob}\t{path}\0".encode())
+        return source_hash.hexdigest()
+
     def get_source_hash(self, force_update=True):
+        if self.source_hash_mode == "git" and (
+            not self._source_hash or force_update
+        ):
+            git_source_hash = self._get_git_source_hash()
+            if git_source_hash:
+                self._source_hash = git_source_hash
+                return self._source_hash
         if not self._source_hash or force_update:
-            source_dir_hash = self._update_hash_from_dir(
-                self.source_dir, hashlib.sha512()
-            ).hexdigest()
-            self._source_hash = str(source_dir_hash)
+            # Source files are only read when their metadata changed since
+            # the hash was last computed, possibly by a previous run.
+            mode = "parallel" if self.source_hash_mode == "parallel" else "walk"
+            paths = list(self._walk_source_dir(self.source_dir))
+            stats = self._get_source_stats(paths)
+            signature = self._get_source_signature(paths, stats)
+            cache = self._load_source_hash_cache()
+            if cache.get("mode", "walk") != mode:
+                cache = {}
+            if cache.get("signature") == signature and cache.get("hash"):
+                self._source_hash = cache["hash"]
+                return self._source_hash
+
+            previous_files = cache.get("files", {})
+            source_dir_hash = hashlib.sha512()
+            cache = {"mode": mode, "signature": signature}
+            if mode == "parallel":
+                # Digests of files are combined in the same order as the
+                # content of files in the default mode.
+                digests = self._get_files_digests(stats, previous_files)
+                for path, name, is_file in paths:
+                    source_dir_hash.update(name.encode())
+                    if is_file:
+                        relative_path = self._get_relative_path(path)
+                        source_dir_hash.update(digests[relative_path].encode())
+                cache["files"] = {
+                    p: stats[p] + [digest] for p, digest in digests.items()
+                }
+            else:
+                for path, name, is_file in paths:
+                    source_dir_hash.update(name.encode())
+                    if is_file:
+                        self._update_hash_from_file(path, source_dir_hash)
+            self._source_hash = str(source_dir_hash.hexdigest())
+            cache["hash"] = self._source_hash
+            self._save_source_hash_cache(cache)
         return self._source_hash
 
     def get_source_commit_hash(self):
@@ -20,7 +20,7 @@ import re
 from copy import deepcopy
 from graphlib import TopologicalSorter
 from pathlib import Path
-from typing import Union, List, Dict, Any
+from typing import Union, List, Dict, Any, Optional
 
 import yaml
 
@@ -46,10 +46,10 @@ from qubesbuilder.plugins import (
     JobDependency,
     Plugin,
 )
+from qubesbuilder.scheduler import JobResource
 from qubesbuilder.template import QubesTemplate
 from qubesbuilder.log import QubesBuilderLogger
 
-
 QUBES_RELEASE_RE = re.compile(r"r([1-9]\.[0-9]+).*")
 QUBES_RELEASE_DEFAULT = "r4.2"
 
@@ -101,6 +101,11 @@ class Config:
         # Qubes OS Templates
         self._templates: List[QubesTemplate] = []
 
+        # Indexes for looking up distributions, components and templates
+        self._dists_index: Optional[Dict] = None
+        self._components_index: Optional[tuple] = None
+        self._templates_index: Optional[Dict] = None
+
         # Artifacts directory location
         self._artifacts_dir: Path = None  # type: ignore
 
@@ -109,6 +114,15 @@ class Config:
             PROJECT_PATH / "qubesbuilder" / "plugins"
         ]
 
+        # Resolved executor options per stage, component and distribution
+        self._executor_options: Dict[tuple, Dict] = {}
+        self._executor_options_index: Optional[tuple] = None
+
+        # Plugin manager shared by all jobs and the plugins directories
+        # state it has been created for
+        self._plugin_manager: Optional[PluginManager] = None
+        self._plugin_manager_key: Optional[tuple] = None
+
         # Session (context object only for now)
         self._session = None
 
@@ -138,6 +152,9 @@ class Config:
     increment_devel_versions: Union[bool, property]      = property(lambda self: self.get("increment-devel-versions", False))
     automatic_upload_on_publish: Union[bool, property]   = property(lambda self: self.get("automatic-upload-on-publish", False))
     session: Union[Any, property]                        = property(lambda self: self.get("session", None))
+    jobs: Union[int, property]                           = property(lambda self: self.get("jobs", 1))
+    artifacts_cas: Union[bool, property]                 = property(lambda self: self.get("artifacts-cas", False))
+    build_cache: Union[Dict, property]                   = property(lambda self: self.get("build-cache", {}))
     # fmt: on
 
     def __repr__(self):
@@ -267,6 +284,18 @@ class Config:
 
     def set(self, key, value):
         self._conf[key] = value
+        # Objects built from the previous value are loaded again
+        if key == "distributions":
+            self._dists = []
+        elif key == "components":
+            self._components = []
+        elif key == "templates":
+            self._templates = []
+        self._executor_options = {}
+        self._executor_options_index = None
+        self._dists_index = None
+        self._components_index = None
+        self._templates_index = None
 
     def get_conf_path(self) -> Path:
         conf_file = self._conf_file
@@ -285,17 +314,26 @@ class Config:
                     dist_options = next(iter(dist.values()))
                 self._dists.append(QubesDistribution(dist_name, **dist_options))
         if filtered_distributions:
-            result = []
+            if self._dists_index is None:
+                # First distribution with a given name and its position
+                self._dists_index = {}
+                for position, d in enumerate(self._dists):
+                    self._dists_index.setdefault(d.distribution, (position, d))
             filtered_distributions = set(filtered_distributions)
-            for d in self._dists:
-                if d.distribution in filtered_distributions:
-                    result.append(d)
-                    filtered_distributions.remove(d.distribution)
-            if filtered_distributions:
-                raise ConfigError(
-                    f"No such distribution: {', '.join(filtered_distributions)}"
+            missing = filtered_distributions - self._dists_index.keys()
+            if missing:
+                raise ConfigError(f"No such distribution: {', '.join(missing)}")
+            # Keep configuration order
+            return [
+                d
+                for _, d in sorted(
+                    (
+                        self._dists_index[name]
+                        for name in filtered_distributions
+                    ),
+                    key=lambda x: x[0],
                 )
-            return result
+            ]
         return self._dists
 
     def get_templates(self, filtered_templates=None):
@@ -305,17 +343,35 @@ class Config:
                 QubesTemplate(template) for template in templates
             ]
         if filtered_templates:
+            if self._templates_index is None:
+                self._templates_index = {}
+                for t in self._templates:
+                    self._templates_index.setdefault(t.name, t)
             result = []
             for ft in filtered_templates:
-                for t in self._templates:
-                    if t.name == ft:
-                        result.append(t)
-                        break
-                else:
+                if ft not in self._templates_index:
                     raise ConfigError(f"No such template: {ft}")
+                result.append(self._templates_index[ft])
             return result
         return self._templates
 
+    def _get_components_index(self):
+        """
+        Positions of components in configuration by name and by URL
+        without git prefix.
+        """
+        if self._components_index is None:
+            prefix = self.get("git", {}).get("prefix", "QubesOS/qubes-")
+            by_name: Dict[str, List[int]] = {}
+            by_url: Dict[str, List[int]] = {}
+            for position, c in enumerate(self._components):
+                by_name.setdefault(c.name, []).append(position)
+                by_url.setdefault(c.url.partition(prefix)[2], []).append(
+                    position
+                )
+            self._components_index = (by_name, by_url)
+        return self._components_index
+
     def get_components(self, filtered_components=None, url_match=False):
         if not self._components:
             # Load available component information from config
@@ -326,30 +382,39 @@ class Config:
                 )
 
             self._components = components_from_config
+            self._components_index = None
 
         # Find if components requested would have been found from config file with
         # non default values for url, maintainer, etc.
         if filtered_components:
-            result = []
-            prefix = self.get("git", {}).get("prefix", "QubesOS/qubes-")
+            by_name, by_url = self._get_components_index()
             filtered_components = set(filtered_components)
             found_components = set()
-            for c in self._components:
-                if c.name in filtered_components:
-                    result.append(c)
-                    found_components.add(c.name)
-                elif (
-                    url_match
-                    and c.url.partition(prefix)[2] in filtered_components
-                ):
-                    result.append(c)
-                    found_components.add(c.url.partition(prefix)[2])
+            positions = set()
+            for name in filtered_components:
+                if name in by_name:
+                    positions.update(by_name[name])
+                    found_components.add(name)
+            if url_match:
+                for name in filtered_components:
+                    # A component matching by name is not matched by URL
+                    url_positions = [
+                        position
+                        for position in by_url.get(name, [])
+                        if self._components[position].name
+                        not in filtered_components
+                    ]
+                    if url_positions:
+                        positions.update(url_positions)
+                        found_components.add(name)
             filtered_components -= found_components
             if filtered_components:
                 raise ConfigError(
                     f"No such component: {', '.join(filtered_components)}"
                 )
-            return result
+            return [
+                self._components[position] for position in sorted(positions)
+            ]
         return self._components
 
     def get_component(self, component_name):
@@ -380,6 +445,10 @@ class Config:
     def cache_dir(self):
         return self.artifacts_dir / "cache"
 
+    @property
+    def cas_dir(self):
+        return self.artifacts_dir / "cas"
+
     @property
     def sources_dir(self):
         return self.artifacts_dir / "sources"
@@ -423,85 +492,82 @@ class Config:
                 plugins_dirs = plugins_dirs + [str(d_path)]
         return plugins_dirs
 
-    def get_executor_options_from_config(
+    @staticmethod
+    def _get_stages_executor_options(stages, stage_name: str) -> List[Dict]:
+        """
+        Executor options of every stage named 'stage_name' in a stages list.
+        """
+        return [
+            stage[stage_name].get("executor", {})
+            for stage in stages
+            if isinstance(stage, dict)
+            and next(iter(stage)) == stage_name
+            and isinstance(stage[stage_name], dict)
+        ]
+
+    def _get_executor_options_index(self):
+        """
+        Configured components and distributions by their identity, as
+        compared by their __eq__ method.
+        """
+        if self._executor_options_index is None:
+            components: Dict[str, List[QubesComponent]] = {}
+            for comp in self.get_components():
+                components.setdefault(repr(comp), []).append(comp)
+            distributions: Dict[str, QubesDistribution] = {}
+            for distribution in self.get_distributions():
+                distributions.setdefault(repr(distribution), distribution)
+            self._executor_options_index = (components, distributions)
+        return self._executor_options_index
+
+    def _resolve_executor_options(
         self,
         stage_name: str,
-        plugin: Union[
-            DistributionPlugin,
-            DistributionComponentPlugin,
-            ComponentPlugin,
-            TemplatePlugin,
-        ] = None,
-    ):
-        dist = None
-        component = None
+        component: Optional[QubesComponent],
+        dist: Optional[QubesDistribution],
+    ) -> Dict:
+        components, distributions = self._get_executor_options_index()
         distribution_executor_options = {}
         component_executor_options: Dict[Any, Any] = {}
         default_executor_options = self._conf.get("executor", {}) or {}
         stage_executor_options = {}
         executor_options: Dict[Any, Any] = {}
 
-        if plugin:
-            if hasattr(plugin, "component"):
-                component = plugin.component
-            if hasattr(plugin, "dist"):
-                dist = plugin.dist
-
-        if dist and isinstance(dist, QubesDistribution):
-            for distribution in self.get_distributions():
-                if dist == distribution:
-                    for stage in distribution.kwargs.get("stages", []):
-                        if (
-                            isinstance(stage, dict)
-                            and next(iter(stage)) == stage_name
-                            and isinstance(stage[stage_name], dict)
-                        ):
-                            distribution_executor_options = stage[
-                                stage_name
-                            ].get("executor", {})
-                            break
-
-        if component and isinstance(component, QubesComponent):
-            for comp in self.get_components():
-                if comp == component:
-                    distribution_stages = []
-                    package_set_stages = []
-                    if dist and dist.distribution in comp.kwargs:
-                        distribution_stages = comp.kwargs[
-                            dist.distribution
-                        ].get("stages", [])
-                    if dist and dist.package_set in comp.kwargs:
-                        package_set_stages = comp.kwargs.get(
-                            dist.package_set, {}
-                        ).get("stages", [])
-                    component_stages = comp.kwargs.get("stages", [])
-
-                    for stage in (
-                        component_stages
-                        + package_set_stages
-                        + distribution_stages
-                    ):
-                        if (
-                            isinstance(stage, dict)
-                            and next(iter(stage)) == stage_name
-                            and isinstance(stage[stage_name], dict)
-                        ):
-                            component_executor_options = deep_merge(
-                                component_executor_options,
-                                stage[stage_name].get("executor", {}),
-                            )
-
-        for stage in self._conf.get("stages", []):
-            if isinstance(stage, str):
-                continue
-            if (
-                isinstance(stage, dict)
-                and next(iter(stage)) == stage_name
-                and isinstance(stage[stage_name], dict)
+        if dist and repr(dist) in distributions:
+            for options in self._get_stages_executor_options(
+                distributions[repr(dist)].kwargs.get("stages", []), stage_name
             ):
-                stage_executor_options = stage[stage_name].get("executor", {})
+                distribution_executor_options = options
                 break
 
+        if component:
+            for comp in components.get(repr(component), []):
+                distribution_stages = []
+                package_set_stages = []
+                if dist and dist.distribution in comp.kwargs:
+                    distribution_stages = comp.kwargs[dist.distribution].get(
+                        "stages", []
+                    )
+                if dist and dist.package_set in comp.kwargs:
+                    package_set_stages = comp.kwargs.get(
+                        dist.package_set, {}
+                    ).get("stages", [])
+                component_stages = comp.kwargs.get("stages", [])
+
+                for options in self._get_stages_executor_options(
+                    component_stages + package_set_stages + distribution_stages,
+                    stage_name,
+                ):
+                    component_executor_options = deep_merge(
+                        component_executor_options, options
+                    )
+
+        for options in self._get_stages_executor_options(
+            self._conf.get("stages", []), stage_name
+        ):
+            stage_executor_options = options
+            break
+
         for options in [
             default_executor_options,
             stage_executor_options,
@@ -512,6 +578,38 @@ class Config:
 
         return executor_options
 
+    def get_executor_options_from_config(
+        self,
+        stage_name: str,
+        plugin: Union[
+            DistributionPlugin,
+            DistributionComponentPlugin,
+            ComponentPlugin,
+            TemplatePlugin,
+        ] = None,
+    ):
+        dist = None
+        component = None
+
+        if plugin:
+            if isinstance(getattr(plugin, "component", None), QubesComponent):
+                component = getattr(plugin, "component")
+            if isinstance(getattr(plugin, "dist", None), QubesDistribution):
+                dist = getattr(plugin, "dist")
+
+        # Options are resolved once per stage, component and distribution.
+        key = (
+            stage_name,
+            repr(component) if component else None,
+            (repr(dist), dist.distribution, dist.package_set) if dist else None,
+        )
+        if key not in self._executor_options:
+            self._executor_options[key] = self._resolve_executor_options(
+                stage_name, component, dist
+            )
+        # Callers may modify nested options, never share them with the cache
+        return deepcopy(self._executor_options[key])
+
     def get_executor_from_config(
         self,
         stage_name: str,
@@ -534,6 +632,57 @@ class Config:
             executor.log = plugin.log.getChild(stage_name)
         return executor
 
+    def get_job_resources(self, job: Plugin) -> List[JobResource]:
+        """
+        Resources a job needs while running concurrently with other jobs.
+        """
+        resources = []
+        concurrency = self.get("concurrency", {}) or {}
+
+        # Executor type: e.g. the number of dispvms fitting in memory
+        executor_options = self.get_executor_options_from_config(
+            job.stage, job  # type: ignore[arg-type]
+        )
+        max_concurrent = executor_options.get("options", {}).get(
+            "max-concurrent", None
+        )
+        if max_concurrent:
+            resources.append(
+                JobResource(
+                    f"executor:{executor_options.get('type')}",
+                    1,
+                    int(max_concurrent),
+                )
+            )
+
+        # Stage
+        stage_max_concurrent = concurrency.get("stages", {}).get(job.stage)
+        if stage_max_concurrent:
+            resources.append(
+                JobResource(f"stage:{job.stage}", 1, int(stage_max_concurrent))
+            )
+
+        # Generic resources like memory or CPUs weighted per component
+        component = getattr(job, "component", None)
+        weights = component.kwargs.get("weights", {}) if component else {}
+        for name, capacity in concurrency.get("resources", {}).items():
+            resources.append(
+                JobResource(
+                    f"resource:{name}", int(weights.get(name, 1)), int(capacity)
+                )
+            )
+
+        # Published repositories are shared per distribution type and
+        # cannot be updated concurrently.
+        if job.stage in ("publish", "upload"):
+            if getattr(job, "template", None):
+                repository = "rpm"
+            else:
+                repository = getattr(job, "dist").type
+            resources.append(JobResource(f"repository:{repository}", 1, 1))
+
+        return resources
+
     def get_component_from_dict_or_string(
         self, component_name: Union[str, Dict]
     ) -> QubesComponent:
@@ -579,6 +728,12 @@ class Config:
             ),
             **options,
         }
+        component_kwargs["source_hash_cache"] = (
+            self.cache_dir / "source-hash" / f"{name}.json"
+        )
+        component_kwargs["source_hash_mode"] = options.get(
+            "source-hash-mode", self.get("source-hash-mode", "walk")
+        )
         if self.increment_devel_versions:
             component_kwargs["devel_path"] = (
                 self.artifacts_dir / "components" / name / "noversion" / "devel"
@@ -647,7 +802,17 @@ class Config:
         ]
 
     def get_plugin_manager(self):
-        return PluginManager(self.get_plugins_dirs())
+        # Plugin modules are loaded only once. They are reloaded only if
+        # plugins directories change, for example when a plugin component
+        # is added or fetched.
+        plugins_dirs = self.get_plugins_dirs()
+        key = tuple(
+            (str(d), Path(d).expanduser().exists()) for d in plugins_dirs
+        )
+        if self._plugin_manager is None or key != self._plugin_manager_key:
+            self._plugin_manager = PluginManager(plugins_dirs)
+            self._plugin_manager_key = key
+        return self._plugin_manager
 
     def get_needs(
         self,
@@ -794,12 +959,45 @@ class Config:
         apply topological sorting based on defined dependencies that will
         possibly reorder jobs to satisfy dependencies.
         """
+        graph = self.get_jobs_graph(
+            components=components,
+            distributions=distributions,
+            templates=templates,
+            stages=stages,
+        )
+
+        # If we don't want dependencies, just return in collection order.
+        if not with_dependencies:
+            return list(graph)
+
+        ts = TopologicalSorter(graph)
+        jobs = list(ts.static_order())
+        return jobs
+
+    def get_jobs_graph(
+        self,
+        components: List[QubesComponent],
+        distributions: List[QubesDistribution],
+        templates: List[QubesTemplate],
+        stages: List[str],
+        jobs_by_ref: Optional[Dict[JobReference, Plugin]] = None,
+    ) -> Dict[Plugin, List[Plugin]]:
+        """
+        Collects jobs related to given constraints and returns the
+        dependency graph: every job, in collection order, mapped to the
+        jobs it depends on.
+
+        When graphs are built step by step, 'jobs_by_ref' is shared between
+        calls: jobs already collected are reused and only the new ones are
+        returned, possibly depending on previously returned jobs.
+        """
         manager = self.get_plugin_manager()
         plugins = manager.get_plugins()
         plugins_by_class = self._classify_plugins(plugins)
 
         jobs = []  # type: list[Plugin]
-        jobs_by_ref = {}  # type: dict[JobReference, Plugin]
+        if jobs_by_ref is None:
+            jobs_by_ref = {}
 
         def add_job(ref: JobReference):
             if ref in jobs_by_ref:
@@ -851,12 +1049,8 @@ class Config:
             for tmpl in templates:
                 add_job(JobReference(None, None, tmpl, stage, None))
 
-        # If we don't want dependencies, just return in collection order.
-        if not with_dependencies:
-            return jobs
-
-        # build DAG and apply topological sort
-        graph = {}
+        # build DAG
+        graph: Dict[Plugin, List[Plugin]] = {}
         for job in jobs:
             deps = []
             for dep in getattr(job, "dependencies", []):
@@ -879,7 +1073,4 @@ class Config:
                     if dep_job:
                         deps.append(dep_job)
             graph[job] = deps
-
-        ts = TopologicalSorter(graph)
-        jobs = list(ts.static_order())
-        return jobs
+        return graph
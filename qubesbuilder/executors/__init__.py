@@ -21,7 +21,7 @@ import asyncio
 import logging
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Tuple, Union
+from typing import List, Optional, Tuple, Union
 
 from qubesbuilder.common import sanitize_line, str_to_bool
 from qubesbuilder.exc import QubesBuilderError
@@ -58,6 +58,12 @@ class Executor(ABC):
             else str_to_bool(clean_on_error)
         )
 
+        self._chroot_cache = self._kwargs.get("chroot_cache", "copy")
+        if self._chroot_cache not in ("copy", "snapshot"):
+            raise ExecutorError(
+                f"Unknown chroot cache mode '{self._chroot_cache}'."
+            )
+
     def get_builder_dir(self):
         return self._builder_dir
 
@@ -94,6 +100,22 @@ class Executor(ABC):
     def run(self, *args, **kwargs):
         pass
 
+    def split_cache_copy_in(
+        self, copy_in: Optional[List], cache_copy_in: Optional[List]
+    ) -> Tuple[List, List]:
+        """
+        Chroot caches are copied-in like other files but never modified on
+        the host nor copied-out. Executors able to provide them as
+        copy-on-write snapshots get them separately when the 'snapshot'
+        chroot cache mode is set, others copy them.
+        """
+        if self._chroot_cache == "snapshot" and self.supports_snapshots():
+            return list(copy_in or []), list(cache_copy_in or [])
+        return list(copy_in or []) + list(cache_copy_in or []), []
+
+    def supports_snapshots(self) -> bool:
+        return False
+
     def get_user(self):
         raise NotImplementedError
 
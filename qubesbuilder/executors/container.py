@@ -16,14 +16,26 @@
 # with this program. If not, see <https://www.gnu.org/licenses/>.
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
-import subprocess
-import tempfile
+import atexit
+import io
+import os
+import tarfile
+import threading
 from contextlib import contextmanager
 from pathlib import Path, PurePath
 from shlex import quote
-from typing import List, Tuple, Union
+from typing import (
+    Any,
+    BinaryIO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-from qubesbuilder.common import sanitize_line
 from qubesbuilder.executors import Executor, ExecutorError
 
 try:
@@ -40,8 +52,152 @@ except ImportError:
     PodmanClient = None
     PodmanError = ExecutorError
 
+# Size of chunks of archives sent to the container client
+ARCHIVE_CHUNK_SIZE = 1024 * 1024
+
+
+def _reset_owner(info: tarfile.TarInfo) -> tarfile.TarInfo:
+    # Like 'cp' into a container, files belong to root until the builder
+    # directory is given to the executor user.
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    return info
+
+
+def write_archive(
+    fileobj: BinaryIO, copy_in: Iterable[Tuple[Path, PurePath]]
+) -> None:
+    """
+    Write a tar stream with every source copied into its destination
+    directory, including destination directories and their parents.
+    """
+    directories = set()
+    with tarfile.open(fileobj=fileobj, mode="w|") as tar:
+        for src, dst in copy_in:
+            src = src.resolve()
+            for directory in list(reversed(dst.parents)) + [dst]:
+                if directory in directories or directory == directory.parent:
+                    continue
+                directories.add(directory)
+                info = tarfile.TarInfo(directory.relative_to("/").as_posix())
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                tar.addfile(info)
+            tar.add(
+                src,
+                arcname=(dst / src.name).relative_to("/").as_posix(),
+                filter=_reset_owner,
+            )
+
+
+class ChunksReader(io.RawIOBase):
+    """
+    File object reading an iterator of chunks, like archives streamed by
+    the container client.
+    """
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buffer = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._buffer:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._buffer = memoryview(chunk)
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def extract_archive(chunks: Iterator[bytes], destination_dir: Path) -> None:
+    """
+    Extract a tar stream into the destination directory, refusing members
+    outside of it.
+    """
+    fileobj = io.BufferedReader(ChunksReader(chunks), ARCHIVE_CHUNK_SIZE)
+    with tarfile.open(fileobj=fileobj, mode="r|") as tar:
+        for member in tar:
+            # Extraction filters are only available since Python 3.11.4
+            if hasattr(tarfile, "data_filter"):
+                tar.extract(member, destination_dir, filter="tar")
+            else:
+                check_archive_member(member, destination_dir)
+                tar.extract(member, destination_dir)
+
+
+def check_archive_member(member: tarfile.TarInfo, destination_dir: Path):
+    """
+    Refuse archive members, or targets of their links, outside of the
+    destination directory as well as device files.
+    """
+    destination = os.path.realpath(destination_dir)
+    paths = [os.path.join(destination, member.name)]
+    if member.issym():
+        paths.append(
+            os.path.join(
+                destination, os.path.dirname(member.name), member.linkname
+            )
+        )
+    elif member.islnk():
+        paths.append(os.path.join(destination, member.linkname))
+    elif not (member.isfile() or member.isdir()):
+        raise tarfile.TarError(f"Refusing special file '{member.name}'.")
+    for path in paths:
+        if os.path.isabs(member.name) or (
+            os.path.commonpath([destination, os.path.realpath(path)])
+            != destination
+        ):
+            raise tarfile.TarError(
+                f"Refusing '{member.name}' outside of '{destination_dir}'."
+            )
+
+
+class ContainerPool:
+    """
+    Running containers kept between jobs, per container client and image.
+    Jobs are run in them with 'exec' instead of creating a container each.
+    """
+
+    def __init__(self):
+        self._containers: Dict[Tuple[str, str, str], List[Tuple[Any, int]]] = {}
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def acquire(self, key: Tuple[str, str, str]) -> Optional[Tuple[Any, int]]:
+        """
+        Get an idle container and the number of jobs it has already run.
+        """
+        with self._lock:
+            containers = self._containers.get(key, [])
+            return containers.pop() if containers else None
+
+    def release(self, key: Tuple[str, str, str], container, uses: int):
+        with self._lock:
+            self._containers.setdefault(key, []).append((container, uses))
+
+    def close(self):
+        with self._lock:
+            containers = [c for idle in self._containers.values() for c in idle]
+            self._containers = {}
+        for container, _ in containers:
+            try:
+                container.remove(force=True)
+            except (PodmanError, DockerException):
+                pass
+
 
 class ContainerExecutor(Executor):
+    _images: Dict[Tuple[str, str, str], str] = {}
+    _images_lock = threading.Lock()
+    _pool: Optional[ContainerPool] = None
+    _pool_lock = threading.Lock()
+
     def __init__(
         self,
         container_client,
@@ -53,39 +209,53 @@ class ContainerExecutor(Executor):
         super().__init__(**kwargs)
 
         self._container_client = container_client
+        self._image = image
         self._user = user
         self._group = group
 
         if self._container_client == "podman":
-            if PodmanClient is None:
-                raise ExecutorError(f"Cannot find 'podman' on the system.")
             self._client = PodmanClient
         elif self._container_client == "docker":
-            if DockerClient is None:
-                raise ExecutorError(f"Cannot find 'docker' on the system.")
             self._client = DockerClient
         else:
             raise ExecutorError(
                 f"Unknown container client '{self._container_client}'."
             )
-        with self.get_client() as client:
-            try:
-                # Check if we have the image locally
-                docker_image = client.images.get(image)
-            except (PodmanError, DockerException):
-                # Try to pull the image
-                try:
-                    docker_image = client.images.pull(image)
-                except (PodmanError, DockerException) as e:
-                    raise ExecutorError(f"Cannot find {image}.") from e
-
-        self._attrs = docker_image.attrs
 
         self.container: Container = None  # type: ignore
 
-    @contextmanager
-    def get_client(self):
-        kwargs = {
+        # Number of jobs a container runs before being removed
+        self._reuse = int(self._kwargs.get("reuse", 1))
+        # Jobs run by the current container, when taken from the pool
+        self._container_uses: Optional[int] = None
+
+    def get_image_id(self) -> str:
+        # The container client is only reached when the image is needed. The
+        # image found or pulled is shared by executors using the same client.
+        key = (
+            self._container_client,
+            self._image,
+            str(self._get_client_kwargs()),
+        )
+        with ContainerExecutor._images_lock:
+            if key not in ContainerExecutor._images:
+                with self.get_client() as client:
+                    try:
+                        # Check if we have the image locally
+                        docker_image = client.images.get(self._image)
+                    except (PodmanError, DockerException):
+                        # Try to pull the image
+                        try:
+                            docker_image = client.images.pull(self._image)
+                        except (PodmanError, DockerException) as e:
+                            raise ExecutorError(
+                                f"Cannot find {self._image}."
+                            ) from e
+                ContainerExecutor._images[key] = docker_image.attrs["Id"]
+            return ContainerExecutor._images[key]
+
+    def _get_client_kwargs(self):
+        return {
             k: v
             for k, v in self._kwargs.items()
             if k
@@ -97,8 +267,15 @@ class ContainerExecutor(Executor):
                 "max_pool_size",
             )
         }
+
+    @contextmanager
+    def get_client(self):
+        if self._client is None:
+            raise ExecutorError(
+                f"Cannot find '{self._container_client}' on the system."
+            )
         try:
-            yield self._client(**kwargs)
+            yield self._client(**self._get_client_kwargs())
         except (PodmanError, DockerException, ValueError) as e:
             raise ExecutorError("Cannot connect to container client.") from e
 
@@ -108,60 +285,191 @@ class ContainerExecutor(Executor):
     def get_group(self):
         return self._group
 
-    def copy_in(self, source_path: Path, destination_dir: PurePath):  # type: ignore
-        src = source_path.resolve()
-        dst = destination_dir.as_posix()
+    def put_archive(self, copy_in: List[Tuple[Path, PurePath]]):
+        """
+        Copy every source into the container with a single tar stream.
+        """
+        read_fd, write_fd = os.pipe()
+        errors: List[Exception] = []
+
+        def writer():
+            try:
+                with os.fdopen(write_fd, "wb") as f:
+                    write_archive(f, copy_in)
+            except (OSError, tarfile.TarError) as e:
+                errors.append(e)
 
+        def read_chunks():
+            while True:
+                chunk = os.read(read_fd, ARCHIVE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+        thread = threading.Thread(target=writer)
+        thread.start()
         try:
-            # docker doesn't create parent target dirs on copy (similar to `cp`), do that first
-            with tempfile.TemporaryDirectory() as empty_dir:
-                for parent in list(reversed(destination_dir.parents)) + [
-                    destination_dir
-                ]:
-                    cmd = [
-                        self._container_client,
-                        "cp",
-                        f"{empty_dir!s}/.",
-                        f"{self.container.id}:{parent}",
-                    ]
-                    self.log.debug(f"copy-in (cmd): {' '.join(cmd)}")
-                    subprocess.run(cmd, check=True, capture_output=True)
-            cmd = [
-                self._container_client,
-                "cp",
-                str(src),
-                f"{self.container.id}:{dst}",
-            ]
-            self.log.debug(f"copy-in (cmd): {' '.join(cmd)}")
-            subprocess.run(cmd, check=True, capture_output=True)
-        except subprocess.CalledProcessError as e:
-            content = sanitize_line(e.stderr.rstrip(b"\n")).rstrip()
-            msg = f"Failed to copy-in: {content}"
+            self.log.debug(f"copy-in (archive): {copy_in}")
+            if not self.container.put_archive("/", read_chunks()):
+                errors.append(ExecutorError("archive refused by container"))
+        except (PodmanError, DockerException) as e:
+            errors.append(e)
+        finally:
+            # Unblock the writer if the container client stopped reading
+            os.close(read_fd)
+            thread.join()
+        if errors:
+            msg = f"Failed to copy-in: {str(errors[0])}"
             raise ExecutorError(msg, name=self.container.id)
 
+    def copy_in(self, source_path: Path, destination_dir: PurePath):  # type: ignore
+        self.put_archive([(source_path, destination_dir)])
+
     def copy_out(self, source_path: PurePath, destination_dir: Path):  # type: ignore
-        src = source_path.as_posix()
         dst = destination_dir.resolve()
-
-        cmd = [
-            self._container_client,
-            "cp",
-            f"{self.container.id}:{src}",
-            str(dst),
-        ]
         try:
-            self.log.debug(f"copy-out (cmd): {' '.join(cmd)}")
+            self.log.debug(f"copy-out (archive): {source_path} -> {dst}")
             dst.mkdir(parents=True, exist_ok=True)
-            subprocess.run(cmd, check=True, capture_output=True)
-        except subprocess.CalledProcessError as e:
-            content = sanitize_line(e.stderr.rstrip(b"\n")).rstrip()
-            msg = f"Failed to copy-out: {content}"
+            chunks, _ = self.container.get_archive(
+                source_path.as_posix(), chunk_size=ARCHIVE_CHUNK_SIZE
+            )
+            extract_archive(iter(chunks), dst)
+        except (PodmanError, DockerException, OSError, tarfile.TarError) as e:
+            msg = f"Failed to copy-out: {str(e)}"
             raise ExecutorError(msg, name=self.container.id)
 
+    def supports_snapshots(self) -> bool:
+        return True
+
+    def get_snapshots_mounts_and_cmd(
+        self, snapshots: List[Tuple[Path, PurePath]]
+    ) -> Tuple[List[dict], List[str]]:
+        """
+        Chroot caches are bind mounted outside the builder directory and
+        provided at their destination as an overlay, its changes being kept
+        in memory. Fall back to copying them inside the container.
+        """
+        mounts = []
+        cmd = []
+        for idx, (src, dst) in enumerate(snapshots):
+            src = src.resolve()
+            lower = PurePath("/snapshots") / str(idx) / src.name
+            target = dst / src.name
+            # The cache is shared with other jobs and must stay unchanged
+            mounts.append(
+                {
+                    "type": "bind",
+                    "source": str(src),
+                    "target": str(lower),
+                    "read_only": True,
+                }
+            )
+            if not src.is_dir():
+                cmd.append(
+                    f"mkdir -p -- {quote(str(dst))} && cp -- {quote(str(lower))} {quote(str(dst))}/"
+                )
+                continue
+            overlay = quote(str(PurePath("/snapshots") / str(idx) / "overlay"))
+            options = quote(
+                f"lowerdir={lower},upperdir={overlay}/upper,workdir={overlay}/work"
+            )
+            mount_cmd = f"sudo mount -t overlay overlay {quote(str(target))} -o {options}"
+            overlay_cmd = [
+                f"sudo mkdir -p -- {overlay}",
+                f"sudo mount -t tmpfs tmpfs {overlay}",
+                f"sudo mkdir -- {overlay}/upper {overlay}/work",
+                f"{{ {mount_cmd},metacopy=on || {mount_cmd}; }}",
+            ]
+            cmd.append(
+                f"mkdir -p -- {quote(str(target))} && "
+                f"{{ {{ {' && '.join(overlay_cmd)}; }} || "
+                f"cp -a -- {quote(str(lower))}/. {quote(str(target))}/; }}"
+            )
+        return mounts, cmd
+
+    @classmethod
+    def get_pool(cls) -> ContainerPool:
+        with cls._pool_lock:
+            if cls._pool is None:
+                cls._pool = ContainerPool()
+            return cls._pool
+
+    def _get_pool_key(self) -> Tuple[str, str, str]:
+        return (
+            self._container_client,
+            self.get_image_id(),
+            str(self._get_client_kwargs()),
+        )
+
+    def acquire_container(self, client, image, mounts):
+        """
+        Take a running container from the pool or start a new one.
+        """
+        pooled = self.get_pool().acquire(self._get_pool_key())
+        if pooled:
+            self.container, self._container_uses = pooled
+            return
+        self.container = client.containers.create(
+            image,
+            ["sleep", "infinity"],
+            privileged=True,
+            mounts=mounts,
+            init=True,
+        )
+        self.container.start()
+        self._container_uses = 0
+
+    def release_container(self):
+        """
+        Give the container back to the pool with a clean builder directory,
+        or remove it once it reached its reuse limit.
+        """
+        assert self._container_uses is not None
+        uses = self._container_uses + 1
+        if uses < self._reuse:
+            # Unmount anything left under the builder directory first
+            builder_dir = quote(str(self.get_builder_dir()))
+            reset_cmd = (
+                f"grep -o ' {builder_dir}[/ ][^ ]*' /proc/mounts | sort -r | "
+                f"xargs -r umount && rm -rf --one-file-system -- {builder_dir}"
+            )
+            try:
+                exit_code, output = self.container.exec_run(
+                    ["sudo", "bash", "-c", reset_cmd]
+                )
+            except (PodmanError, DockerException) as e:
+                exit_code, output = 1, str(e)
+            if exit_code == 0:
+                self.get_pool().release(
+                    self._get_pool_key(), self.container, uses
+                )
+                self.container = None
+                self._container_uses = None
+                return
+            self.log.warning(f"Cannot reset container: {output!r}")
+        self.cleanup()
+
+    def keep_container(self):
+        """
+        Stop a long-lived container kept for inspection instead of leaving
+        it running, as it is not given back to the pool.
+        """
+        if self.container and self._container_uses is not None:
+            try:
+                self.container.stop()
+            except (PodmanError, DockerException) as e:
+                self.log.warning(f"Cannot stop container: {str(e)}")
+            self._container_uses = None
+
     def cleanup(self):
         if self.container:
-            self.container.wait()
-            self.container.remove()
+            if self._container_uses is not None:
+                # Long-lived container
+                self.container.remove(force=True)
+                self._container_uses = None
+            else:
+                self.container.wait()
+                self.container.remove()
 
     def run(  # type: ignore
         self,
@@ -171,12 +479,18 @@ class ContainerExecutor(Executor):
         files_inside_executor_with_placeholders: List[Union[Path, str]] = None,
         environment=None,
         no_fail_copy_out_allowed_patterns=None,
+        cache_copy_in: List[Tuple[Path, PurePath]] = None,
         **kwargs,
     ):
+        copy_in, snapshots = self.split_cache_copy_in(copy_in, cache_copy_in)
+        snapshots_mounts, snapshots_cmd = self.get_snapshots_mounts_and_cmd(
+            snapshots
+        )
         try:
+            image_id = self.get_image_id()
             with self.get_client() as client:
                 # prepare container for given image and command
-                image = client.images.get(self._attrs["Id"])
+                image = client.images.get(image_id)
 
                 # fix permissions and user group
                 permissions_cmd = [
@@ -197,7 +511,9 @@ class ContainerExecutor(Executor):
                         f"sed -i 's#@BUILDER_DIR@#{self.get_builder_dir()}#g' {' '.join(files)}"
                     ]
 
-                final_cmd = "&&".join(permissions_cmd + sed_cmd + cmd)
+                final_cmd = "&&".join(
+                    permissions_cmd + snapshots_cmd + sed_cmd + cmd
+                )
                 container_cmd = ["bash", "-c", final_cmd]
 
                 # FIXME: Ensure podman client can parse non str value
@@ -211,21 +527,24 @@ class ContainerExecutor(Executor):
                         "source": "/dev/loop-control",
                         "target": "/dev/loop-control",
                     },
-                ]
-                self.container = client.containers.create(
-                    image,
-                    container_cmd,
-                    privileged=True,
-                    environment=environment,
-                    mounts=mounts,
-                    init=True,
-                )
+                ] + snapshots_mounts
+                # Containers with mounts specific to the job are not reused
+                pooled = self._reuse > 1 and not snapshots_mounts
+                if pooled:
+                    self.acquire_container(client, image, mounts)
+                else:
+                    self.container = client.containers.create(
+                        image,
+                        container_cmd,
+                        privileged=True,
+                        environment=environment,
+                        mounts=mounts,
+                        init=True,
+                    )
 
                 # copy-in hook
-                for src_in, dst_in in sorted(
-                    set(copy_in or []), key=lambda x: x[1]
-                ):
-                    self.copy_in(source_path=src_in, destination_dir=dst_in)
+                if copy_in:
+                    self.put_archive(sorted(set(copy_in), key=lambda x: x[1]))
 
                 self.log.debug(
                     f"Using executor {self._container_client}:{self.container.short_id} to run '{final_cmd}'."
@@ -233,13 +552,27 @@ class ContainerExecutor(Executor):
 
                 # FIXME: Use attach method when podman-py will implement.
                 #  It is for starting and streaming output directly with python.
-                cmd = [
-                    self._container_client,
-                    "start",
-                    "--attach",
-                    self.container.id,
-                ]
-                rc = self.execute(cmd)
+                if pooled:
+                    # Environment is passed by name to keep it out of the
+                    # command line
+                    exec_environment = {
+                        k: str(v) for k, v in (environment or {}).items()
+                    }
+                    cmd = [self._container_client, "exec"]
+                    for name in exec_environment:
+                        cmd += ["--env", name]
+                    cmd += [self.container.id] + container_cmd
+                    rc = self.execute(
+                        cmd, env={**os.environ, **exec_environment}
+                    )
+                else:
+                    cmd = [
+                        self._container_client,
+                        "start",
+                        "--attach",
+                        self.container.id,
+                    ]
+                    rc = self.execute(cmd)
                 if rc != 0:
                     msg = f"Failed to run '{final_cmd}' (status={rc})."
                     raise ExecutorError(msg, name=self.container.id)
@@ -271,7 +604,14 @@ class ContainerExecutor(Executor):
         except ExecutorError as e:
             if self.container and self._clean_on_error:
                 self.cleanup()
+            else:
+                self.keep_container()
             raise e
         else:
             if self.container and self._clean:
-                self.cleanup()
+                if self._container_uses is not None:
+                    self.release_container()
+                else:
+                    self.cleanup()
+            else:
+                self.keep_container()
@@ -16,6 +16,7 @@
 # with this program. If not, see <https://www.gnu.org/licenses/>.
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
+import fcntl
 import getpass
 import grp
 import os
@@ -28,6 +29,42 @@ from typing import List, Tuple
 
 from qubesbuilder.executors import Executor, ExecutorError
 
+# ioctl cloning a file into another one (linux/fs.h)
+FICLONE = 0x40049409
+
+COPY_STRATEGIES = ("copy", "reflink", "hardlink", "bind")
+
+
+def reflink_file(src: str, dst: str) -> str:
+    """
+    Copy a file sharing its data blocks if the filesystem supports it.
+    """
+    # Never write into an existing file, it may be linked elsewhere
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        return shutil.copy2(src, dst)
+    shutil.copystat(src, dst)
+    return dst
+
+
+def link_file(src: str, dst: str) -> str:
+    """
+    Hard link a file we own, reflink it otherwise or across filesystems.
+    """
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    if os.stat(src).st_uid == os.getuid():
+        try:
+            os.link(src, dst)
+            return dst
+        except OSError:
+            pass
+    return reflink_file(src, dst)
+
 
 class LocalExecutor(Executor):
     """
@@ -48,6 +85,13 @@ class LocalExecutor(Executor):
         )
         self._builder_dir = self._temporary_dir / "builder"
         self._builder_dir_exists = False
+        self._mounts: List[Path] = []
+
+        self._copy_strategy = self._kwargs.get("copy_strategy", "copy")
+        if self._copy_strategy not in COPY_STRATEGIES:
+            raise ExecutorError(
+                f"Unknown copy strategy '{self._copy_strategy}'."
+            )
 
     def get_directory(self):
         return self._directory
@@ -60,26 +104,137 @@ class LocalExecutor(Executor):
         group = grp.getgrgid(gid).gr_name
         return self._kwargs.get("group", group)
 
-    def copy_in(self, source_path: Path, destination_dir: Path, action="copy-in"):  # type: ignore
+    def get_copy_strategy(self, destination_dir: Path, action="copy-in"):
+        """
+        Only read-only inputs, the builder local repository and
+        dependencies, are linked or mounted. Other inputs may be modified
+        in place, e.g. by changing their owner, so at most reflinked.
+        Copied-out files are linked as the temporary directory is removed.
+        """
+        if self._copy_strategy == "copy":
+            return "copy"
+        if action == "copy-out":
+            return "reflink" if self._copy_strategy == "reflink" else "hardlink"
+        read_only_dirs = (
+            self.get_repository_dir(),
+            self.get_dependencies_dir(),
+        )
+        if any(
+            destination_dir == d or d in destination_dir.parents
+            for d in read_only_dirs
+        ):
+            return self._copy_strategy
+        return "reflink"
+
+    def copy_in(self, source_path: Path, destination_dir: Path, action="copy-in", strategy="copy"):  # type: ignore
         src = source_path.resolve()
         dst = destination_dir.resolve()
+        if strategy in ("hardlink", "bind"):
+            copy_function = link_file
+        elif strategy == "reflink":
+            copy_function = reflink_file
+        else:
+            copy_function = shutil.copy2
         try:
             if src.is_dir():
                 dst = dst / src.name
                 if dst.exists():
                     shutil.rmtree(str(dst))
-                shutil.copytree(str(src), str(dst), symlinks=True)
+                if strategy == "bind" and self._mount_overlay(src, dst):
+                    return
+                shutil.copytree(
+                    str(src),
+                    str(dst),
+                    symlinks=True,
+                    copy_function=copy_function,
+                )
             else:
                 dst.mkdir(parents=True, exist_ok=True)
-                shutil.copy2(str(src), str(dst))
-        except (shutil.Error, FileExistsError, FileNotFoundError) as e:
+                copy_function(str(src), str(dst / src.name))
+        except (shutil.Error, OSError) as e:
             msg = f"Failed to {action}: {e!s}"
             raise ExecutorError(msg) from e
 
-    def copy_out(self, source_path: Path, destination_dir: Path):  # type: ignore
-        self.copy_in(source_path, destination_dir, action="copy-out")
+    def copy_out(self, source_path: Path, destination_dir: Path, strategy="copy"):  # type: ignore
+        self.copy_in(
+            source_path, destination_dir, action="copy-out", strategy=strategy
+        )
+
+    def supports_snapshots(self) -> bool:
+        return True
+
+    def _mount_overlay(self, lower_dir: Path, target_dir: Path) -> bool:
+        overlay_dir = self._temporary_dir / "overlays" / str(uuid.uuid4())
+        (overlay_dir / "upper").mkdir(parents=True)
+        (overlay_dir / "work").mkdir()
+        target_dir.mkdir(parents=True)
+        options = f"lowerdir={lower_dir},upperdir={overlay_dir / 'upper'},workdir={overlay_dir / 'work'}"
+        # Without 'metacopy', changing owner of a file copies it entirely
+        # into the upper directory.
+        for extra_options in (",metacopy=on", ""):
+            cmd = [
+                "sudo",
+                "--non-interactive",
+                "mount",
+                "-t",
+                "overlay",
+                "overlay",
+                "-o",
+                options + extra_options,
+                str(target_dir),
+            ]
+            try:
+                subprocess.run(cmd, check=True, capture_output=True)
+            except (subprocess.CalledProcessError, OSError) as e:
+                self.log.debug(f"Cannot mount overlay: {str(e)}")
+                continue
+            self._mounts.append(target_dir)
+            return True
+        target_dir.rmdir()
+        return False
+
+    def _umount_snapshots(self):
+        while self._mounts:
+            mount = self._mounts.pop()
+            try:
+                subprocess.run(
+                    ["sudo", "--non-interactive", "umount", str(mount)],
+                    check=True,
+                    capture_output=True,
+                )
+            except subprocess.CalledProcessError as e:
+                raise ExecutorError(
+                    f"Failed to unmount '{mount}': {e.stderr.decode()}"
+                )
+
+    def snapshot_in(self, source_path: Path, destination_dir: Path):
+        """
+        Provide a chroot cache as a copy-on-write snapshot: a reflink copy
+        sharing data blocks with the cache if the filesystem supports it,
+        an overlay mount with the cache as lower directory otherwise. Fall
+        back to a plain copy.
+        """
+        src = source_path.resolve()
+        dst = destination_dir.resolve() / src.name
+        if dst.is_dir():
+            shutil.rmtree(dst)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        cmd = ["cp", "-a", "--reflink=always", "--", str(src), str(dst)]
+        try:
+            subprocess.run(cmd, check=True, capture_output=True)
+            return
+        except subprocess.CalledProcessError as e:
+            self.log.debug(f"Cannot reflink '{src}': {e.stderr.decode()}")
+            if dst.is_dir():
+                shutil.rmtree(dst)
+            elif dst.exists():
+                dst.unlink()
+        if src.is_dir() and self._mount_overlay(src, dst):
+            return
+        self.copy_in(source_path, destination_dir)
 
     def cleanup(self):
+        self._umount_snapshots()
         try:
             shutil.rmtree(self._temporary_dir)
         except PermissionError:
@@ -113,6 +268,7 @@ class LocalExecutor(Executor):
         files_inside_executor_with_placeholders: List[Path] = None,
         environment=None,
         no_fail_copy_out_allowed_patterns=None,
+        cache_copy_in: List[Tuple[Path, Path]] = None,
         **kwargs,
     ):
         # Create temporary builder directory. In an unlikely case of conflict,
@@ -127,13 +283,17 @@ class LocalExecutor(Executor):
                 f"Failed to create temporary builder directory: {str(e)}"
             )
 
+        copy_in, snapshots = self.split_cache_copy_in(copy_in, cache_copy_in)
         try:
             # copy-in hook
-            for src, dst in sorted(set(copy_in or []), key=lambda x: x[1]):
+            for src, dst in sorted(set(copy_in), key=lambda x: x[1]):
                 self.copy_in(
                     source_path=src,
                     destination_dir=dst,
+                    strategy=self.get_copy_strategy(dst),
                 )
+            for src, dst in snapshots:
+                self.snapshot_in(source_path=src, destination_dir=dst)
 
             # replace placeholders
             sed_cmd = ""
@@ -170,7 +330,11 @@ class LocalExecutor(Executor):
             # copy-out hook
             for src, dst in sorted(set(copy_out or []), key=lambda x: x[1]):
                 try:
-                    self.copy_out(source_path=src, destination_dir=dst)
+                    self.copy_out(
+                        source_path=src,
+                        destination_dir=dst,
+                        strategy=self.get_copy_strategy(dst, "copy-out"),
+                    )
                 except ExecutorError as e:
                     # Ignore copy-out failure if requested
                     if isinstance(
@@ -186,7 +350,12 @@ class LocalExecutor(Executor):
                         )
                         continue
                     raise e
+            self._umount_snapshots()
         except ExecutorError as e:
+            try:
+                self._umount_snapshots()
+            except ExecutorError as umount_error:
+                self.log.error(str(umount_error))
             if self._temporary_dir.exists() and self._clean_on_error:
                 self.cleanup()
             raise e
@@ -17,17 +17,22 @@
 # with this program. If not, see <https://www.gnu.org/licenses/>.
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
+import atexit
+import json
 import os
 import re
 import shutil
 import subprocess
+import sys
+import tempfile
+import threading
 from pathlib import Path, PurePath
 from shlex import quote
-from time import sleep
-from typing import List, Optional, Tuple, Union
+from time import monotonic, sleep
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 from qubesbuilder.common import sanitize_line, PROJECT_PATH
-from qubesbuilder.executors import Executor, ExecutorError
+from qubesbuilder.executors import Executor, ExecutorError, unpack
 from qubesbuilder.executors.qrexec import (
     create_dispvm,
     kill_vm,
@@ -69,6 +74,71 @@ def build_run_cmd_and_list(
     return ["/usr/bin/qvm-run-vm", "--", vm_name, quote_and_list(cmds)]
 
 
+# Payloads already compressed, not worth compressing again
+COMPRESSED_SUFFIXES = (
+    ".rpm",
+    ".deb",
+    ".gz",
+    ".tgz",
+    ".xz",
+    ".txz",
+    ".bz2",
+    ".zst",
+    ".lz4",
+    ".zip",
+)
+
+
+def is_compressed(name: str) -> bool:
+    return name.endswith(COMPRESSED_SUFFIXES)
+
+
+def get_size(path: Path) -> Tuple[int, int]:
+    """
+    Size of a file or directory content, and size of its already
+    compressed files.
+    """
+    if not path.is_dir() or path.is_symlink():
+        size = path.lstat().st_size
+        return size, size if is_compressed(path.name) else 0
+    size = compressed_size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            file_size = os.lstat(os.path.join(root, name)).st_size
+            size += file_size
+            if is_compressed(name):
+                compressed_size += file_size
+    return size, compressed_size
+
+
+def get_batches(
+    entries: List[Tuple], key: Optional[Callable[[Tuple], bool]] = None
+) -> List[List[Tuple]]:
+    """
+    Split copy entries, in order, into batches of sources having distinct
+    file names, as they are transferred into the same directory, and the
+    same 'key', e.g. whether they are compressed.
+    """
+    batches: List[List[Tuple]] = []
+    names: set = set()
+    batch_key = None
+    for entry in entries:
+        src = entry[0]
+        entry_key = key(entry) if key else None
+        if not batches or src.name in names or entry_key != batch_key:
+            batches.append([])
+            names = set()
+            batch_key = entry_key
+        batches[-1].append(entry)
+        names.add(src.name)
+    return batches
+
+
+def with_manifest(manifest: str, args: List[str]) -> List[str]:
+    # Send the manifest to the service ahead of the files
+    return ["/bin/sh", "-c", 'cat -- "$0" && exec "$@"', manifest, *args]
+
+
 class QubesExecutor(Executor):
     def __init__(self, dispvm: str = "dom0", **kwargs):
         super().__init__(**kwargs)
@@ -106,6 +176,39 @@ class QubesExecutor(Executor):
             args=args,
         )
 
+    @staticmethod
+    def get_unpacker_path() -> str:
+        old_unpacker_path = "/usr/lib/qubes/qfile-unpacker"
+        new_unpacker_path = "/usr/bin/qfile-unpacker"
+        if os.path.exists(new_unpacker_path):
+            return new_unpacker_path
+        return old_unpacker_path
+
+    @staticmethod
+    def remove_destination(dst_path: Path):
+        # Remove local file or directory if exists
+        if os.path.exists(dst_path):
+            if dst_path.is_dir():
+                shutil.rmtree(dst_path)
+            else:
+                os.remove(dst_path)
+
+    def dig_holes(self, dst_path: Path):
+        if dst_path.is_dir():
+            return
+        try:
+            self.log.debug("copy-out (detect zeroes and replace with holes)")
+            subprocess.run(
+                ["/usr/bin/fallocate", "-d", str(dst_path)], check=True
+            )
+        except subprocess.CalledProcessError as e:
+            if e.stderr is not None:
+                content = sanitize_line(e.stderr.rstrip(b"\n")).rstrip()
+            else:
+                content = str(e)
+            msg = f"Failed to dig holes in copy-out: {content}"
+            raise ExecutorError(msg, name=self.dispvm)
+
     def copy_out(
         self,
         source_path: PurePath,
@@ -116,22 +219,11 @@ class QubesExecutor(Executor):
         src = source_path
         dst = destination_dir.resolve()
 
-        # Remove local file or directory if exists
         dst_path = dst / src.name
-        if os.path.exists(dst_path):
-            if dst_path.is_dir():
-                shutil.rmtree(dst / src.name)
-            else:
-                os.remove(dst_path)
+        self.remove_destination(dst_path)
 
         dst.mkdir(parents=True, exist_ok=True)
 
-        old_unpacker_path = "/usr/lib/qubes/qfile-unpacker"
-        new_unpacker_path = "/usr/bin/qfile-unpacker"
-        if os.path.exists(new_unpacker_path):
-            unpacker_path = new_unpacker_path
-        else:
-            unpacker_path = old_unpacker_path
         encoded_src_path = encode_for_vmexec(str(src))
         qrexec_call(
             executor=self,
@@ -139,27 +231,14 @@ class QubesExecutor(Executor):
             vm=self.dispvm,
             service=f"{self.copy_out_service}+{encoded_src_path}",
             args=[
-                unpacker_path,
+                self.get_unpacker_path(),
                 str(os.getuid()),
                 str(dst),
             ],
         )
 
-        if dig_holes and not dst_path.is_dir():
-            try:
-                self.log.debug(
-                    "copy-out (detect zeroes and replace with holes)"
-                )
-                subprocess.run(
-                    ["/usr/bin/fallocate", "-d", str(dst_path)], check=True
-                )
-            except subprocess.CalledProcessError as e:
-                if e.stderr is not None:
-                    content = sanitize_line(e.stderr.rstrip(b"\n")).rstrip()
-                else:
-                    content = str(e)
-                msg = f"Failed to dig holes in copy-out: {content}"
-                raise ExecutorError(msg, name=self.dispvm)
+        if dig_holes:
+            self.dig_holes(dst_path)
 
     def copy_rpc_services(self):
         assert self.dispvm
@@ -193,6 +272,254 @@ class LinuxQubesExecutor(QubesExecutor):
         self, dispvm: str = "dom0", clean: Union[str, bool] = True, **kwargs
     ):
         super().__init__(dispvm=dispvm, clean=clean, **kwargs)
+        # Number of disposable qubes prepared ahead of jobs
+        self._pool_size = int(self._kwargs.get("pool_size", 0))
+        # Remove disposable qubes of succeeded jobs in background
+        self._async_cleanup = bool(self._kwargs.get("async_cleanup", True))
+        # zstd compression of copy-in and copy-out transfers, if level > 0
+        self._compression_level = int(self._kwargs.get("compression_level", 0))
+        self._compression_threads = int(
+            self._kwargs.get("compression_threads", 0)
+        )
+
+    def get_compression(self, compress: bool) -> Optional[Dict]:
+        if not compress or not self._compression_level:
+            return None
+        return {
+            "level": self._compression_level,
+            "threads": self._compression_threads,
+        }
+
+    def transfer(
+        self,
+        what: str,
+        service: str,
+        manifest: Dict,
+        args: List[str],
+    ) -> float:
+        """
+        Call the copy service with the manifest sent ahead of the files
+        and return the duration of the transfer.
+        """
+        assert self.dispvm
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as f:
+            f.write(json.dumps(manifest) + "\n")
+            f.flush()
+            start = monotonic()
+            qrexec_call(
+                executor=self,
+                what=what,
+                vm=self.dispvm,
+                service=f"{service}+batch",
+                args=with_manifest(f.name, args),
+            )
+            return monotonic() - start
+
+    def log_throughput(
+        self, what: str, size: int, elapsed: float, compression: Optional[Dict]
+    ):
+        size_mib = size / 1024**2
+        rate = size_mib / max(elapsed, 0.001)
+        suffix = f", zstd level {compression['level']}" if compression else ""
+        self.log.info(
+            f"{what}: {size_mib:.1f} MiB in {elapsed:.1f}s ({rate:.1f} MiB/s{suffix})."
+        )
+
+    def copy_in_batch(self, copy_in: List[Tuple[Path, PurePath]]):
+        """
+        Copy every source into its destination directory with one call
+        to the copy-in service per batch.
+        """
+        copy_in = [(src.expanduser().resolve(), dst) for src, dst in copy_in]
+        sizes = {src: get_size(src) for src, _ in copy_in}
+
+        def compress(entry):
+            # Sources being mostly already compressed are sent as they are
+            size, compressed_size = sizes[entry[0]]
+            return bool(self._compression_level) and compressed_size * 2 < size
+
+        for batch in get_batches(copy_in, key=compress):
+            compression = self.get_compression(compress(batch[0]))
+            manifest = {
+                "files": [[src.name, dst.as_posix()] for src, dst in batch],
+                "compression": compression,
+            }
+            if compression:
+                args = [
+                    "/bin/bash",
+                    "-o",
+                    "pipefail",
+                    "-c",
+                    f'tar -c -f - "$@" | zstd -q -c -{compression["level"]} -T{compression["threads"]}',
+                    "bash",
+                ]
+                for src, _ in batch:
+                    args += ["-C", str(src.parent), src.name]
+            else:
+                args = [
+                    "/usr/lib/qubes/qfile-agent",
+                    *[str(src) for src, _ in batch],
+                ]
+            elapsed = self.transfer(
+                "copy-in", self.copy_in_service, manifest, args
+            )
+            self.log_throughput(
+                "copy-in",
+                sum(sizes[src][0] for src, _ in batch),
+                elapsed,
+                compression,
+            )
+
+    def copy_out_batch(
+        self,
+        copy_out: List[Tuple[PurePath, Path]],
+        dig_holes: bool = False,
+        no_fail_copy_out_allowed_patterns=None,
+    ):
+        """
+        Copy every source out into its destination directory with one
+        call to the copy-out service per batch.
+        """
+        copy_out = [(src, dst.resolve()) for src, dst in copy_out]
+
+        def compress(entry):
+            return bool(self._compression_level) and not is_compressed(
+                entry[0].name
+            )
+
+        for batch in get_batches(copy_out, key=compress):
+            for src, dst in batch:
+                self.remove_destination(dst / src.name)
+                dst.mkdir(parents=True, exist_ok=True)
+            # Files are received next to their destinations
+            incoming_dir = Path(
+                tempfile.mkdtemp(
+                    prefix=".copy-out-",
+                    dir=os.path.commonpath([dst for _, dst in batch]),
+                )
+            )
+            try:
+                compression = self.get_compression(compress(batch[0]))
+                # Holes are kept by sending sparse files in a tar stream
+                manifest = {
+                    "files": [str(src) for src, _ in batch],
+                    "compression": compression,
+                    "sparse": dig_holes,
+                }
+                # Archives from the disposable qube are not trusted, their
+                # data must leave free space on the destination file system
+                usage = shutil.disk_usage(incoming_dir)
+                unpack_args = [
+                    sys.executable,
+                    "-I",
+                    unpack.__file__,
+                    str(incoming_dir),
+                    str(max(usage.free - usage.total // 20, 0)),
+                ]
+                if compression:
+                    args = [
+                        "/bin/bash",
+                        "-o",
+                        "pipefail",
+                        "-c",
+                        'zstd -q -d -c | "$@"',
+                        "unpack",
+                        *unpack_args,
+                    ]
+                elif dig_holes:
+                    args = unpack_args
+                else:
+                    args = [
+                        self.get_unpacker_path(),
+                        str(os.getuid()),
+                        str(incoming_dir),
+                    ]
+                elapsed = self.transfer(
+                    "copy-out", self.copy_out_service, manifest, args
+                )
+                self.log_throughput(
+                    "copy-out", get_size(incoming_dir)[0], elapsed, compression
+                )
+                for src, dst in batch:
+                    received = incoming_dir / src.name
+                    if not os.path.lexists(received):
+                        # Ignore copy-out failure if requested
+                        if isinstance(
+                            no_fail_copy_out_allowed_patterns, list
+                        ) and any(
+                            [
+                                p in src.name
+                                for p in no_fail_copy_out_allowed_patterns
+                            ]
+                        ):
+                            self.log.debug(
+                                f"File not found inside container: {src}."
+                            )
+                            continue
+                        raise ExecutorError(
+                            f"Failed to copy-out: '{src}' not found.",
+                            name=self.dispvm,
+                        )
+                    shutil.move(received, dst / src.name)
+            finally:
+                shutil.rmtree(incoming_dir, ignore_errors=True)
+
+    def start_dispvm(self):
+        """
+        Create and start a disposable qube, ready to run jobs.
+        """
+        self.dispvm = create_dispvm(self, self._dispvm_template)
+        start_vm(self, self.dispvm)
+        self.copy_rpc_services()
+
+        prep_cmd = build_run_cmd_and_list(
+            self.dispvm,
+            [
+                [
+                    "sudo",
+                    "mkdir",
+                    "-p",
+                    "--",
+                    str(self.get_builder_dir()),
+                    str(self.get_builder_dir() / "build"),
+                    str(self.get_builder_dir() / "plugins"),
+                    str(self.get_builder_dir() / "distfiles"),
+                    "/usr/local/etc/qubes-rpc",
+                ],
+                [
+                    "sudo",
+                    "mv",
+                    "-f",
+                    "--",
+                    f"/home/{self.get_user()}/QubesIncoming/{self.name}/qubesbuilder.FileCopyIn",
+                    f"/home/{self.get_user()}/QubesIncoming/{self.name}/qubesbuilder.FileCopyOut",
+                    "/usr/local/etc/qubes-rpc/",
+                ],
+                [
+                    "sudo",
+                    "chmod",
+                    "+x",
+                    "--",
+                    "/usr/local/etc/qubes-rpc/qubesbuilder.FileCopyIn",
+                    "/usr/local/etc/qubes-rpc/qubesbuilder.FileCopyOut",
+                ],
+                [
+                    "sudo",
+                    "bash",
+                    "-c",
+                    "if [ -x /usr/sbin/restorecon ]; then restorecon -R /usr/local/etc/qubes-rpc/; fi;",
+                ],
+                [
+                    "sudo",
+                    "chown",
+                    "-R",
+                    "--",
+                    f"{self.get_user()}:{self.get_group()}",
+                    str(self.get_builder_dir()),
+                ],
+            ],
+        )
+        subprocess.run(prep_cmd, stdin=subprocess.DEVNULL)
 
     def run(  # type: ignore
         self,
@@ -203,67 +530,22 @@ class LinuxQubesExecutor(QubesExecutor):
         environment: dict = None,
         no_fail_copy_out_allowed_patterns=None,
         dig_holes: bool = False,
+        cache_copy_in: List[Tuple[Path, PurePath]] = None,
     ):
+        # Chroot caches are copied into the disposable qube
+        copy_in, _ = self.split_cache_copy_in(copy_in, cache_copy_in)
         try:
-            self.dispvm = create_dispvm(self, self._dispvm_template)
-            start_vm(self, self.dispvm)
-            self.copy_rpc_services()
-
+            self.dispvm = None
+            if self._pool_size:
+                self.dispvm = DispVMPool.get(
+                    self._dispvm_template, self._pool_size
+                ).acquire()
+            if not self.dispvm:
+                self.start_dispvm()
             assert self.dispvm
-            prep_cmd = build_run_cmd_and_list(
-                self.dispvm,
-                [
-                    [
-                        "sudo",
-                        "mkdir",
-                        "-p",
-                        "--",
-                        str(self.get_builder_dir()),
-                        str(self.get_builder_dir() / "build"),
-                        str(self.get_builder_dir() / "plugins"),
-                        str(self.get_builder_dir() / "distfiles"),
-                        "/usr/local/etc/qubes-rpc",
-                    ],
-                    [
-                        "sudo",
-                        "mv",
-                        "-f",
-                        "--",
-                        f"/home/{self.get_user()}/QubesIncoming/{self.name}/qubesbuilder.FileCopyIn",
-                        f"/home/{self.get_user()}/QubesIncoming/{self.name}/qubesbuilder.FileCopyOut",
-                        "/usr/local/etc/qubes-rpc/",
-                    ],
-                    [
-                        "sudo",
-                        "chmod",
-                        "+x",
-                        "--",
-                        "/usr/local/etc/qubes-rpc/qubesbuilder.FileCopyIn",
-                        "/usr/local/etc/qubes-rpc/qubesbuilder.FileCopyOut",
-                    ],
-                    [
-                        "sudo",
-                        "bash",
-                        "-c",
-                        "if [ -x /usr/sbin/restorecon ]; then restorecon -R /usr/local/etc/qubes-rpc/; fi;",
-                    ],
-                    [
-                        "sudo",
-                        "chown",
-                        "-R",
-                        "--",
-                        f"{self.get_user()}:{self.get_group()}",
-                        str(self.get_builder_dir()),
-                    ],
-                ],
-            )
-            subprocess.run(prep_cmd, stdin=subprocess.DEVNULL)
 
             # copy-in hook
-            for src_in, dst_in in sorted(
-                set(copy_in or []), key=lambda x: x[1]
-            ):
-                self.copy_in(source_path=src_in, destination_dir=dst_in)
+            self.copy_in_batch(sorted(set(copy_in), key=lambda x: x[1]))
 
             # replace placeholders
             if files_inside_executor_with_placeholders and isinstance(
@@ -327,37 +609,217 @@ class LinuxQubesExecutor(QubesExecutor):
                 raise ExecutorError(msg, name=self.dispvm)
 
             # copy-out hook
-            for src_out, dst_out in sorted(
-                set(copy_out or []), key=lambda x: x[1]
-            ):
-                try:
-                    self.copy_out(
-                        source_path=src_out,
-                        destination_dir=dst_out,
-                        dig_holes=dig_holes,
-                    )
-                except ExecutorError as e:
-                    # Ignore copy-out failure if requested
-                    if isinstance(
-                        no_fail_copy_out_allowed_patterns, list
-                    ) and any(
-                        [
-                            p in src_out.name
-                            for p in no_fail_copy_out_allowed_patterns
-                        ]
-                    ):
-                        self.log.debug(
-                            f"File not found inside container: {src_out}."
-                        )
-                        continue
-                    raise e
+            self.copy_out_batch(
+                sorted(set(copy_out or []), key=lambda x: x[1]),
+                dig_holes=dig_holes,
+                no_fail_copy_out_allowed_patterns=no_fail_copy_out_allowed_patterns,
+            )
         except (subprocess.CalledProcessError, ExecutorError) as e:
             if self.dispvm and self._clean_on_error:
                 self.cleanup()
             raise e
         else:
             if self.dispvm and self._clean:
-                self.cleanup()
+                if self._async_cleanup:
+                    DispVMReaper.get().add(self, self.dispvm)
+                    self.dispvm = None
+                else:
+                    self.cleanup()
+
+
+class DispVMReaper:
+    """
+    Removal of disposable qubes in background, so that the next job does
+    not wait for the previous qube to be destroyed. Qubes queued while a
+    batch is being removed are removed together with the next batch.
+    Pending qubes are removed at exit.
+    """
+
+    _reaper: Optional["DispVMReaper"] = None
+    _reaper_lock = threading.Lock()
+
+    # Maximum time waited for pending qubes at exit, in seconds
+    DRAIN_TIMEOUT = 600
+
+    def __init__(self):
+        self.log = QubesExecutor.log.getChild("reaper")
+        self._queue: List[Tuple[QubesExecutor, str]] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def get(cls) -> "DispVMReaper":
+        with cls._reaper_lock:
+            if cls._reaper is None:
+                cls._reaper = cls()
+                atexit.register(cls.drain_all)
+        return cls._reaper
+
+    @classmethod
+    def drain_all(cls):
+        with cls._reaper_lock:
+            reaper = cls._reaper
+        if reaper and not reaper.drain(timeout=cls.DRAIN_TIMEOUT):
+            reaper.log.warning("Timeout while removing disposable qubes.")
+
+    def add(self, executor: QubesExecutor, dispvm: str):
+        with self._cond:
+            self._queue.append((executor, dispvm))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for every queued disposable qube to be removed, at most timeout
+        seconds if given. Return False if the timeout expired.
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._thread is None, timeout=timeout
+            )
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    batch, self._queue = self._queue, []
+                    if not batch:
+                        self._thread = None
+                        self._cond.notify_all()
+                        return
+                try:
+                    self._remove(batch)
+                except Exception as e:
+                    self.log.error(f"Failed to remove disposable qubes: {e}")
+        finally:
+            # Never leave waiters blocked, nor later qubes without a thread
+            with self._cond:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+                    self._cond.notify_all()
+
+    def _remove(self, batch: List[Tuple[QubesExecutor, str]]):
+        running = []
+        halted = []
+        for executor, dispvm in batch:
+            try:
+                if vm_state(executor, dispvm) != "Halted":
+                    running.append((executor, dispvm))
+                else:
+                    halted.append((executor, dispvm))
+            except Exception as e:
+                self.log.warning(f"Failed to remove '{dispvm}': {str(e)}")
+        self.log.debug(
+            f"Removing {len(running) + len(halted)} disposable qube(s)."
+        )
+        # Killed disposable qubes are removed by qubesd
+        for executor, dispvm in running:
+            try:
+                kill_vm(executor, dispvm)
+            except Exception as e:
+                self.log.warning(f"Failed to kill '{dispvm}': {str(e)}")
+        for executor, dispvm in halted:
+            try:
+                remove_vm(executor, dispvm)
+            except Exception as e:
+                self.log.warning(f"Failed to remove '{dispvm}': {str(e)}")
+
+
+class DispVMPool:
+    """
+    Disposable qubes created, started and provided with builder RPC
+    services ahead of jobs, per disposable template. Jobs take a ready
+    qube if there is one and the pool is filled again in background.
+    """
+
+    _pools: Dict[str, "DispVMPool"] = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, template: str, size: int):
+        self.template = template
+        self.size = size
+        self.log = QubesExecutor.log.getChild("pool")
+        self._ready: List[str] = []
+        self._pending = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    @classmethod
+    def get(cls, template: str, size: int) -> "DispVMPool":
+        with cls._pools_lock:
+            if not cls._pools:
+                atexit.register(cls.close_all)
+            pool = cls._pools.setdefault(template, cls(template, size))
+            pool.size = max(pool.size, size)
+        return pool
+
+    @classmethod
+    def close_all(cls):
+        with cls._pools_lock:
+            pools = list(cls._pools.values())
+            cls._pools = {}
+        for pool in pools:
+            pool.close()
+
+    def acquire(self) -> Optional[str]:
+        """
+        Take a ready disposable qube, if any.
+        """
+        with self._lock:
+            dispvm = self._ready.pop(0) if self._ready else None
+        self.fill()
+        return dispvm
+
+    def fill(self):
+        with self._lock:
+            if self._closed:
+                return
+            missing = self.size - len(self._ready) - self._pending
+            self._pending += max(missing, 0)
+            for _ in range(missing):
+                thread = threading.Thread(target=self._prepare, daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    def _prepare(self):
+        executor = LinuxQubesExecutor(dispvm=self.template)
+        try:
+            executor.start_dispvm()
+        except (subprocess.CalledProcessError, ExecutorError) as e:
+            self.log.warning(
+                f"Failed to prepare disposable qube from '{self.template}': {str(e)}"
+            )
+            if executor.dispvm:
+                executor.cleanup()
+            executor.dispvm = None
+        with self._lock:
+            self._pending -= 1
+            self._threads.remove(threading.current_thread())
+            if executor.dispvm and not self._closed:
+                self._ready.append(executor.dispvm)
+                return
+        if executor.dispvm:
+            executor.cleanup()
+
+    def close(self):
+        """
+        Stop filling the pool and remove its disposable qubes.
+        """
+        with self._lock:
+            self._closed = True
+            threads = list(self._threads)
+            ready, self._ready = self._ready, []
+        for thread in threads:
+            thread.join()
+        executor = LinuxQubesExecutor(dispvm=self.template)
+        for dispvm in ready:
+            executor.dispvm = dispvm
+            try:
+                executor.cleanup()
+            except ExecutorError as e:
+                self.log.warning(f"Failed to remove '{dispvm}': {str(e)}")
 
 
 class WindowsQubesExecutor(BaseWindowsExecutor, QubesExecutor):
@@ -0,0 +1,91 @@
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2026 agent <agent@local>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""
+Receiver of tar streams sent by disposable qubes, used in place of
+qfile-unpacker for compressed and sparse copy-out. Only depends on the
+standard library as it is run as a script by the copy-out call.
+"""
+
+import os
+import sys
+import tarfile
+from pathlib import Path
+from typing import BinaryIO
+
+
+def get_data_size(member: tarfile.TarInfo) -> int:
+    # Holes of sparse files are not written
+    if member.sparse is not None:
+        return sum(size for _, size in member.sparse)  # type: ignore
+    return member.size
+
+
+def unpack_archive(
+    fileobj: BinaryIO, destination_dir: Path, max_size: int
+) -> None:
+    """
+    Extract an untrusted tar stream into the destination directory. Only
+    regular files and directories inside of it are accepted, they are
+    owned by the current user without special permissions, and at most
+    max_size bytes of data are written.
+    """
+    destination = os.path.realpath(destination_dir)
+    written = 0
+    with tarfile.open(fileobj=fileobj, mode="r|") as tar:
+        for member in tar:
+            if not (member.isreg() or member.isdir()):
+                raise tarfile.TarError(
+                    f"Refusing link or special file '{member.name}'."
+                )
+            path = os.path.realpath(os.path.join(destination, member.name))
+            if (
+                os.path.isabs(member.name)
+                or ".." in Path(member.name).parts
+                or os.path.commonpath([destination, path]) != destination
+            ):
+                raise tarfile.TarError(
+                    f"Refusing '{member.name}' outside of '{destination_dir}'."
+                )
+            written += get_data_size(member)
+            if written > max_size:
+                raise tarfile.TarError(
+                    f"Refusing more than {max_size} bytes of data."
+                )
+            member.mode &= 0o755
+            member.uid, member.gid = os.getuid(), os.getgid()
+            member.uname, member.gname = "", ""
+            if hasattr(tarfile, "data_filter"):
+                tar.extract(member, destination, filter="data")
+            else:
+                tar.extract(member, destination)
+
+
+def main():
+    if len(sys.argv) != 3:
+        print("Usage: unpack.py DESTINATION_DIR MAX_SIZE", file=sys.stderr)
+        sys.exit(1)
+    try:
+        unpack_archive(sys.stdin.buffer, Path(sys.argv[1]), int(sys.argv[2]))
+    except (tarfile.TarError, OSError) as e:
+        print(f"Failed to unpack: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
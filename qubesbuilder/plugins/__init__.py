@@ -24,9 +24,11 @@ import dateutil.parser
 import yaml
 from dateutil.parser import parse as parsedate
 
+from qubesbuilder.cas import ArtifactsStore
 from qubesbuilder.component import QubesComponent
 from qubesbuilder.distribution import QubesDistribution
 from qubesbuilder.exc import QubesBuilderError
+from qubesbuilder.executors import Executor
 from qubesbuilder.log import QubesBuilderLogger
 from qubesbuilder.template import QubesTemplate
 
@@ -215,12 +217,20 @@ class Plugin:
         # Stage
         self.stage = stage
 
-        # Executor
-        self.executor = self.config.get_executor_from_config(stage, self)
+        # Executor, created on first use
+        self._executor: Optional[Executor] = None
 
         # Dependencies
         self.dependencies = []  # type: List[Dependency]
 
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = self.config.get_executor_from_config(
+                self.stage, self
+            )
+        return self._executor
+
     def get_artifact_context(self) -> dict:
         """
         Returns a dictionary of objects needed by ArtifactLocator.
@@ -351,6 +361,51 @@ class Plugin:
             msg = f"Failed to read info from '{artifacts_info}'."
             raise PluginError(msg) from e
 
+    def get_artifacts_store(self) -> Optional[ArtifactsStore]:
+        if not self.config.artifacts_cas:
+            return None
+        return ArtifactsStore(self.config.cas_dir)
+
+    def store_artifacts(self, info: dict, artifacts_dir: Path):
+        """
+        Move stage output files into the artifacts store and record their
+        digests in the info.
+        """
+        store = self.get_artifacts_store()
+        if not store:
+            # Do not keep digests of a previous stage info
+            info.pop("digests", None)
+            return
+        digests = {}
+        for file in info.get("files", []):
+            path = artifacts_dir / file
+            # Files of other directories, e.g. distfiles, are not stage output
+            if path.is_symlink() or not path.is_file():
+                continue
+            digests[file] = store.add(path)
+        info["digests"] = digests
+
+    def unshare_artifacts(self, paths: List[Path]):
+        """
+        Detach files from the artifacts store before modifying them in place.
+        """
+        if self.get_artifacts_store():
+            for path in paths:
+                ArtifactsStore.unshare(path)
+
+    def update_artifacts_digests(
+        self, stage: str, basename: str, artifacts_dir: Path
+    ):
+        """
+        Store again output files of a stage modified in place, e.g. signed,
+        and record their new digests.
+        """
+        if not self.get_artifacts_store():
+            return
+        info = self.get_artifacts_info(stage, basename, artifacts_dir)
+        if info:
+            self.save_artifacts_info(stage, basename, info, artifacts_dir)
+
     def save_artifacts_info(
         self,
         stage: str,
@@ -359,6 +414,7 @@ class Plugin:
         artifacts_dir: Path,
     ):
         artifacts_dir.mkdir(parents=True, exist_ok=True)
+        self.store_artifacts(info, artifacts_dir)
         try:
             with open(
                 artifacts_dir
@@ -17,15 +17,30 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import hashlib
+import os
+import struct
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+from qubesbuilder.buildcache import (
+    BuildCache,
+    get_build_cache,
+    get_build_fingerprint,
+    get_directory_digest,
+)
+from qubesbuilder.cas import get_file_digest
 from qubesbuilder.component import QubesComponent
 from qubesbuilder.config import Config
 from qubesbuilder.distribution import QubesDistribution
-from qubesbuilder.exc import ComponentError
+from qubesbuilder.exc import ComponentError, ConfigError
 from qubesbuilder.plugins import (
     DistributionComponentPlugin,
     PluginError,
     JobDependency,
     JobReference,
+    get_artifacts_path,
+    get_relative_artifacts_path,
 )
 
 
@@ -33,6 +48,43 @@ class BuildError(PluginError):
     pass
 
 
+# Suffixes of package files provided by the builder local repository
+LOCAL_PACKAGE_SUFFIXES = (".rpm", ".deb", ".pkg.tar.zst", ".pkg.tar.xz")
+
+# Digests of local repository packages by path, along with the metadata of
+# the file they were computed from
+_packages_digests: Dict[str, Tuple[tuple, str]] = {}
+
+
+def get_package_digest(path: Path) -> str:
+    """
+    Digest of a package content. RPM signatures are stored in a header
+    of their own which is skipped: signing a package does not change it.
+    """
+    st = path.stat()
+    key = (st.st_size, st.st_mtime_ns, st.st_ino)
+    cached = _packages_digests.get(str(path), None)
+    if cached and cached[0] == key:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        if path.name.endswith(".rpm"):
+            # Lead, then signature header: magic, reserved, number of
+            # index entries and data size, padded to 8 bytes.
+            f.seek(96)
+            header = f.read(16)
+            if len(header) == 16 and header[:3] == b"\x8e\xad\xe8":
+                nindex, hsize = struct.unpack(">II", header[8:16])
+                size = 16 + 16 * nindex + hsize
+                f.seek(96 + size + (8 - size % 8) % 8)
+            else:
+                f.seek(0)
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    _packages_digests[str(path)] = (key, digest.hexdigest())
+    return _packages_digests[str(path)][1]
+
+
 class BuildPlugin(DistributionComponentPlugin):
     """
     BuildPlugin manages generic distribution build.
@@ -60,6 +112,9 @@ class BuildPlugin(DistributionComponentPlugin):
             stage=stage,
         )
 
+        # Build cache key, computed before building
+        self._build_cache_key: Optional[str] = None
+
         try:
             if self.has_component_packages(stage="build"):
                 for build in self.get_parameters(stage="build").get(
@@ -87,3 +142,179 @@ class BuildPlugin(DistributionComponentPlugin):
         if component and not component.has_packages:
             return None
         return super().from_args(**kwargs)
+
+    def get_local_repository_digests(self) -> Dict[str, str]:
+        """
+        Digests of the packages of other components in the builder local
+        repository, by path relative to it.
+        """
+        repository_dir = self.config.repository_dir / self.dist.distribution
+        digests: Dict[str, str] = {}
+        if not repository_dir.exists():
+            return digests
+        for component_dir in sorted(repository_dir.iterdir()):
+            if not component_dir.is_dir() or component_dir.name.startswith(
+                f"{self.component.name}_"
+            ):
+                continue
+            for path in sorted(component_dir.iterdir()):
+                if path.name.endswith(LOCAL_PACKAGE_SUFFIXES):
+                    digests[f"{component_dir.name}/{path.name}"] = (
+                        get_package_digest(path)
+                    )
+        return digests
+
+    @staticmethod
+    def get_consumed_digests(
+        digests: Dict[str, str], is_consumed: Optional[Callable[[str], bool]]
+    ) -> Dict[str, str]:
+        """
+        Keep digests of packages consumed by a build, or all of them when
+        it cannot be determined.
+        """
+        if not is_consumed:
+            return digests
+        return {
+            path: digest
+            for path, digest in digests.items()
+            if is_consumed(os.path.basename(path))
+        }
+
+    def is_build_up_to_date(self, build) -> bool:
+        """
+        Whether sources and dependency packages consumed from the builder
+        local repository are the same as for the previous build.
+        """
+        info = self.get_dist_artifacts_info(self.stage, build.mangle())
+        if self.component.get_source_hash() != info.get("source-hash", None):
+            return False
+        dependencies = info.get("dependencies", {})
+        if not dependencies:
+            return True
+        repository_dir = self.config.repository_dir / self.dist.distribution
+        for path, digest in dependencies.items():
+            try:
+                current_digest = get_package_digest(repository_dir / path)
+            except OSError:
+                current_digest = None
+            if current_digest != digest:
+                self.log.info(
+                    f"{self.component}:{self.dist}:{build}: Dependency '{path}' has changed."
+                )
+                return False
+        return True
+
+    def get_build_cache(self) -> Optional[BuildCache]:
+        return get_build_cache(self.config.build_cache)
+
+    def get_build_inputs(self) -> Dict:
+        """
+        Everything a build depends on, identifying it in the build cache.
+        """
+        plugins = {self.name}
+        components = {}
+        dependencies = {}
+        for dependency in self.dependencies:
+            if dependency.builder_object == "plugin":
+                plugins.add(dependency.reference)
+            elif dependency.builder_object == "component":
+                try:
+                    component = self.config.get_component(dependency.reference)
+                except ConfigError:
+                    component = None
+                components[dependency.reference] = (
+                    component.get_source_hash(force_update=False)
+                    if component
+                    else get_directory_digest(
+                        self.config.sources_dir / dependency.reference
+                    )
+                )
+            elif dependency.builder_object == "job":
+                job_ref = dependency.reference
+                # Artifacts of previous stages of the component are derived
+                # from its sources. They are not reproducible bit for bit and
+                # would prevent sharing the cache between builders.
+                if job_ref.component == self.component or job_ref.build is None:
+                    continue
+                artifacts_path = get_artifacts_path(self.config, job_ref)
+                info = self._get_artifacts_info(artifacts_path)
+                digests = info.get("digests", {})
+                # Relative path, artifacts directories differ by builder
+                dependencies[str(get_relative_artifacts_path(job_ref))] = {
+                    file: digests.get(file, None)
+                    or get_file_digest(artifacts_path.parent / file)
+                    for file in info.get("files", [])
+                }
+
+        chroot_dir = self.config.cache_dir / "chroot" / self.dist.distribution
+        return {
+            "component": self.component.name,
+            "version": self.component.get_version_release(),
+            "source-hash": self.component.get_source_hash(),
+            "build": [
+                str(build) for build in self.get_parameters("build")["build"]
+            ],
+            "distribution": self.dist.distribution,
+            "architecture": self.dist.architecture,
+            "increment-devel-versions": self.config.increment_devel_versions,
+            "use-qubes-repo": self.config.use_qubes_repo,
+            "plugins": {
+                name: get_directory_digest(
+                    self.manager.entities[name].directory
+                )
+                for name in sorted(plugins)
+            },
+            "components": components,
+            "dependencies": dependencies,
+            # Packages of other components the build may consume
+            "local-repository": self.get_local_repository_digests(),
+            # Chroot caches are identified by their packages, not by when
+            # they were created
+            "chroot": {
+                str(path.relative_to(chroot_dir)): self._get_artifacts_info(
+                    path
+                ).get("packages", [])
+                for path in sorted(chroot_dir.glob("**/*.init-cache.yml"))
+            },
+        }
+
+    def restore_from_build_cache(self, artifacts_dir: Path) -> bool:
+        """
+        Get build artifacts of a build with the same inputs from the build
+        cache, possibly from another builder.
+        """
+        cache = self.get_build_cache()
+        if not cache:
+            return False
+        self._build_cache_key = get_build_fingerprint(self.get_build_inputs())
+        if not cache.get(self._build_cache_key, artifacts_dir):
+            return False
+        # Consumed dependencies are recorded as found in the local
+        # repository of this builder, not of the one that built them
+        repository_digests = self.get_local_repository_digests()
+        for build in self.get_parameters(self.stage).get("build", []):
+            info = self.get_artifacts_info(
+                self.stage, build.mangle(), artifacts_dir
+            )
+            if not info:
+                continue
+            info["dependencies"] = {
+                path: repository_digests.get(path, None)
+                for path in info.get("dependencies", {})
+            }
+            self.save_artifacts_info(
+                self.stage, build.mangle(), info, artifacts_dir
+            )
+        self.log.info(
+            f"{self.component}:{self.dist}: Using packages built with the same inputs from build cache."
+        )
+        return True
+
+    def save_to_build_cache(self, artifacts_dir: Path):
+        cache = self.get_build_cache()
+        if not cache:
+            return
+        key = self._build_cache_key or get_build_fingerprint(
+            self.get_build_inputs()
+        )
+        cache.put(key, artifacts_dir)
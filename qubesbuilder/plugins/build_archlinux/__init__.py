@@ -185,16 +185,12 @@ class ArchlinuxBuildPlugin(ArchlinuxDistributionPlugin, BuildPlugin):
 
         qubes_repo_version = self.config.use_qubes_repo.get("version", None)
 
-        # Compare previous artifacts hash with current source hash
+        # Compare previous artifacts hash and dependencies with current ones
         if all(
-            self.component.get_source_hash()
-            == self.get_dist_artifacts_info(self.stage, build.mangle()).get(
-                "source-hash", None
-            )
-            for build in parameters["build"]
+            self.is_build_up_to_date(build) for build in parameters["build"]
         ):
             self.log.info(
-                f"{self.component}:{self.dist}: Source hash is the same than already built source. Skipping."
+                f"{self.component}:{self.dist}: Source hash and dependencies are the same than already built source. Skipping."
             )
             return
 
@@ -218,6 +214,23 @@ class ArchlinuxBuildPlugin(ArchlinuxDistributionPlugin, BuildPlugin):
             self.log, repository_dir, self.component, self.dist, True
         )
 
+        if self.restore_from_build_cache(artifacts_dir):
+            for build in parameters["build"]:
+                info = self.get_dist_artifacts_info(self.stage, build.mangle())
+                provision_local_repository(
+                    log=self.log,
+                    build=build,
+                    component=self.component,
+                    dist=self.dist,
+                    repository_dir=repository_dir,
+                    packages_list=info["packages"],
+                    build_artifacts_dir=artifacts_dir,
+                )
+            return
+
+        # Packages of other components the builds may consume
+        repository_digests = self.get_local_repository_digests()
+
         for build in parameters["build"]:
             # spec file basename will be used as prefix for some artifacts
             build_bn = build.mangle()
@@ -402,6 +415,11 @@ class ArchlinuxBuildPlugin(ArchlinuxDistributionPlugin, BuildPlugin):
                     "packages": packages_list,
                     "source-hash": self.component.get_source_hash(),
                     "files": packages_list,
+                    # Packages installed by makepkg are not known: consider
+                    # every package of the local repository.
+                    "dependencies": self.get_consumed_digests(
+                        repository_digests, None
+                    ),
                 }
             )
 
@@ -421,5 +439,7 @@ class ArchlinuxBuildPlugin(ArchlinuxDistributionPlugin, BuildPlugin):
                 stage=self.stage, basename=build_bn, info=info
             )
 
+        self.save_to_build_cache(artifacts_dir)
+
 
 PLUGINS = [ArchlinuxBuildPlugin]
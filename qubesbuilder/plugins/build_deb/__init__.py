@@ -32,6 +32,32 @@ from qubesbuilder.plugins import DEBDistributionPlugin, PluginDependency
 from qubesbuilder.plugins.build import BuildPlugin, BuildError
 
 
+def get_build_depends(dsc: Path) -> List[str]:
+    """
+    Names of the packages listed in build dependencies of a source package.
+    """
+    fields = {}
+    field = None
+    for line in dsc.read_text(errors="replace").splitlines():
+        if line.startswith((" ", "\t")) and field:
+            fields[field] += " " + line.strip()
+        elif ":" in line:
+            field, value = line.split(":", 1)
+            fields[field] = value.strip()
+        else:
+            field = None
+    names = []
+    for field in ["Build-Depends", "Build-Depends-Arch", "Build-Depends-Indep"]:
+        for dependency in fields.get(field, "").split(","):
+            for alternative in dependency.split("|"):
+                # Drop version, architecture and build profile restrictions
+                name = alternative.strip().split(" ")[0].split("(")[0]
+                name = name.split("[")[0].split("<")[0].split(":")[0]
+                if name:
+                    names.append(name)
+    return names
+
+
 def provision_local_repository(
     log: logging.Logger,
     debian_directory: str,
@@ -129,16 +155,13 @@ class DEBBuildPlugin(DEBDistributionPlugin, BuildPlugin):
         parameters = self.get_parameters(self.stage)
         artifacts_dir = self.get_dist_component_artifacts_dir(self.stage)
 
-        # Compare previous artifacts hash with current source hash
+        # Compare previous artifacts hash and dependencies with current ones
         if all(
-            self.component.get_source_hash()
-            == self.get_dist_artifacts_info(
-                stage=self.stage, basename=directory.mangle()
-            ).get("source-hash", None)
+            self.is_build_up_to_date(directory)
             for directory in parameters["build"]
         ):
             self.log.info(
-                f"{self.component}:{self.dist}: Source hash is the same than already built source. Skipping."
+                f"{self.component}:{self.dist}: Source hash and dependencies are the same than already built source. Skipping."
             )
             return
 
@@ -157,6 +180,26 @@ class DEBBuildPlugin(DEBDistributionPlugin, BuildPlugin):
         for build in repository_dir.glob(f"{self.component.name}_*"):
             shutil.rmtree(build.as_posix())
 
+        if self.restore_from_build_cache(artifacts_dir):
+            for directory in parameters["build"]:
+                info = self.get_dist_artifacts_info(
+                    stage=self.stage, basename=directory.mangle()
+                )
+                provision_local_repository(
+                    log=self.log,
+                    debian_directory=directory,
+                    component=self.component,
+                    dist=self.dist,
+                    repository_dir=repository_dir,
+                    source_info=info,
+                    packages_list=info["packages"],
+                    build_artifacts_dir=artifacts_dir,
+                )
+            return
+
+        # Packages of other components the builds may consume
+        repository_digests = self.get_local_repository_digests()
+
         for directory in parameters["build"]:
             # directory basename will be used as prefix for some artifacts
             directory_bn = directory.mangle()
@@ -180,6 +223,9 @@ class DEBBuildPlugin(DEBDistributionPlugin, BuildPlugin):
             for src in debian_source_files:
                 if not source_info.get(src, None):
                     raise BuildError(f"Cannot find sources for '{directory}'")
+            build_depends = set(
+                get_build_depends(prep_artifacts_dir / source_info["dsc"])
+            )
 
             # Copy-in plugin, repository and sources
             copy_in = self.default_copy_in(
@@ -280,13 +326,14 @@ class DEBBuildPlugin(DEBDistributionPlugin, BuildPlugin):
             pbuilder_dir = chroot_dir / self.dist.nva / "pbuilder"
             aptcache_dir = pbuilder_dir / "aptcache"
             base_tgz = pbuilder_dir / "base.tgz"
+            cache_copy_in = []
             if aptcache_dir.exists():
-                copy_in += [(
+                cache_copy_in += [(
                     pbuilder_dir / "aptcache",
                     self.executor.get_cache_dir(),
                 )]
             if base_tgz.exists():
-                copy_in += [
+                cache_copy_in += [
                     (base_tgz, self.executor.get_builder_dir() / "pbuilder")
                 ]
                 cmd += [
@@ -327,6 +374,7 @@ class DEBBuildPlugin(DEBDistributionPlugin, BuildPlugin):
                     copy_in,
                     copy_out,
                     environment=self.environment,
+                    cache_copy_in=cache_copy_in,
                     no_fail_copy_out_allowed_patterns=["-dbgsym_"],
                     files_inside_executor_with_placeholders=files_inside_executor_with_placeholders,
                 )
@@ -355,9 +403,15 @@ class DEBBuildPlugin(DEBDistributionPlugin, BuildPlugin):
             files = [
                 prep_artifacts_dir / source_info[f] for f in debian_source_files
             ]
+            store = self.get_artifacts_store()
+            prep_digests = source_info.get("digests", {})
             for file in files:
                 target_path = artifacts_dir / file.name
-                shutil.copy2(file, target_path)
+                digest = prep_digests.get(file.name, None)
+                if store and digest and store.contains(digest):
+                    store.link(digest, target_path)
+                else:
+                    shutil.copy2(file, target_path)
 
             # Provision builder local repository
             provision_local_repository(
@@ -382,11 +436,19 @@ class DEBBuildPlugin(DEBDistributionPlugin, BuildPlugin):
                     ],
                     "packages": packages_list,
                     "source-hash": self.component.get_source_hash(),
+                    "dependencies": self.get_consumed_digests(
+                        repository_digests,
+                        # Dependencies of build dependencies are covered by
+                        # rebuilding their own component first.
+                        lambda deb: deb.split("_")[0] in build_depends,
+                    ),
                 }
             )
             self.save_dist_artifacts_info(
                 stage=self.stage, basename=directory_bn, info=info
             )
 
+        self.save_to_build_cache(artifacts_dir)
+
 
 PLUGINS = [DEBBuildPlugin]
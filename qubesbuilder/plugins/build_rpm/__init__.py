@@ -21,7 +21,7 @@ import os.path
 import re
 import shutil
 from pathlib import Path
-from typing import List
+from typing import Callable, List, Optional
 
 from qubesbuilder.common import extract_lines_before
 from qubesbuilder.component import QubesComponent
@@ -59,6 +59,30 @@ def clean_local_repository(
             shutil.rmtree(target_dir.as_posix())
 
 
+def get_installed_packages_filter(
+    installed_pkgs_log: Path,
+) -> Optional[Callable[[str], bool]]:
+    """
+    Filter of RPM file names installed in the mock buildroot, as listed in
+    'installed_pkgs.log'. The log is removed as it is only valid for one
+    build.
+    """
+    if not installed_pkgs_log.exists():
+        return None
+    installed = set()
+    for line in installed_pkgs_log.read_text().splitlines():
+        if not line.strip():
+            continue
+        nevra = line.split()[0]
+        if ":" in nevra:
+            # Epoch is not part of file names: 'name-epoch:version-...'
+            prefix, rest = nevra.split(":", 1)
+            nevra = f"{prefix.rsplit('-', 1)[0]}-{rest}"
+        installed.add(f"{nevra}.rpm")
+    installed_pkgs_log.unlink()
+    return lambda rpm: rpm in installed
+
+
 def provision_local_repository(
     log: logging.Logger,
     build: str,
@@ -184,16 +208,12 @@ class RPMBuildPlugin(RPMDistributionPlugin, BuildPlugin):
         parameters = self.get_parameters(self.stage)
         artifacts_dir = self.get_dist_component_artifacts_dir(self.stage)
 
-        # Compare previous artifacts hash with current source hash
+        # Compare previous artifacts hash and dependencies with current ones
         if all(
-            self.component.get_source_hash()
-            == self.get_dist_artifacts_info(self.stage, build.mangle()).get(
-                "source-hash", None
-            )
-            for build in parameters["build"]
+            self.is_build_up_to_date(build) for build in parameters["build"]
         ):
             self.log.info(
-                f"{self.component}:{self.dist}: Source hash is the same than already built source. Skipping."
+                f"{self.component}:{self.dist}: Source hash and dependencies are the same than already built source. Skipping."
             )
             return
 
@@ -217,6 +237,25 @@ class RPMBuildPlugin(RPMDistributionPlugin, BuildPlugin):
             self.log, repository_dir, self.component, self.dist, True
         )
 
+        if self.restore_from_build_cache(artifacts_dir):
+            for build in parameters["build"]:
+                info = self.get_dist_artifacts_info(self.stage, build.mangle())
+                provision_local_repository(
+                    log=self.log,
+                    build=build,
+                    component=self.component,
+                    dist=self.dist,
+                    repository_dir=repository_dir,
+                    source_info=info,
+                    packages_list=info["rpms"],
+                    prep_artifacts_dir=prep_artifacts_dir,
+                    build_artifacts_dir=artifacts_dir,
+                )
+            return
+
+        # Packages of other components the builds may consume
+        repository_digests = self.get_local_repository_digests()
+
         for build in parameters["build"]:
             # spec file basename will be used as prefix for some artifacts
             build_bn = build.mangle()
@@ -261,7 +300,12 @@ class RPMBuildPlugin(RPMDistributionPlugin, BuildPlugin):
                 (
                     self.executor.get_build_dir() / buildinfo_file,
                     artifacts_dir / "rpm",
-                )
+                ),
+                # Packages installed in the buildroot, written by mock
+                (
+                    self.executor.get_build_dir() / "installed_pkgs.log",
+                    artifacts_dir,
+                ),
             ]
 
             # Createrepo of local builder repository and ensure 'mock' group can access
@@ -279,8 +323,9 @@ class RPMBuildPlugin(RPMDistributionPlugin, BuildPlugin):
                 self.config.cache_dir / "chroot" / self.dist.distribution
             )
             chroot_cache = chroot_cache_topdir / mock_conf.replace(".cfg", "")
+            cache_copy_in = []
             if chroot_cache.exists():
-                copy_in += [
+                cache_copy_in += [
                     (chroot_cache, self.executor.get_cache_dir() / "mock")
                 ]
                 cmd += [
@@ -353,9 +398,11 @@ class RPMBuildPlugin(RPMDistributionPlugin, BuildPlugin):
                     copy_in,
                     copy_out,
                     environment=self.environment,
+                    cache_copy_in=cache_copy_in,
                     no_fail_copy_out_allowed_patterns=[
                         "-debugsource",
                         "-debuginfo",
+                        "installed_pkgs",
                     ],
                     files_inside_executor_with_placeholders=files_inside_executor_with_placeholders,
                 )
@@ -386,6 +433,12 @@ class RPMBuildPlugin(RPMDistributionPlugin, BuildPlugin):
                 "rpms": packages_list,
                 "buildinfo": buildinfo_file,
                 "source-hash": self.component.get_source_hash(),
+                "dependencies": self.get_consumed_digests(
+                    repository_digests,
+                    get_installed_packages_filter(
+                        artifacts_dir / "installed_pkgs.log"
+                    ),
+                ),
                 "files": [
                     f"rpm/{f}"
                     for f in source_info["rpms"]
@@ -411,5 +464,7 @@ class RPMBuildPlugin(RPMDistributionPlugin, BuildPlugin):
                 stage=self.stage, basename=build_bn, info=info
             )
 
+        self.save_to_build_cache(artifacts_dir)
+
 
 PLUGINS = [RPMBuildPlugin]
@@ -17,6 +17,9 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import datetime
+from typing import List, Tuple
+
 from qubesbuilder.config import Config
 from qubesbuilder.distribution import QubesDistribution
 from qubesbuilder.plugins import (
@@ -35,3 +38,63 @@ class ChrootPlugin(DistributionPlugin):
     """
 
     name = "chroot"
+
+    def get_cache_options(self) -> dict:
+        return self.config.get("cache", {}).get(self.dist.distribution, {})
+
+    def is_cache_too_old(self, artifacts_info: dict) -> bool:
+        max_age_days = self.get_cache_options().get("max-age-days", None)
+        if not max_age_days or not artifacts_info.get("timestamp", None):
+            return False
+        created = datetime.datetime.strptime(
+            artifacts_info["timestamp"] + "Z", "%Y%m%d%H%M%z"
+        )
+        return created < datetime.datetime.now(
+            datetime.UTC
+        ) - datetime.timedelta(days=max_age_days)
+
+    def get_cache_update(
+        self, artifacts_info: dict, packages: List[str], force: bool
+    ) -> Tuple[str, List[str]]:
+        """
+        How to bring the chroot cache to the requested packages set and the
+        packages to download for that:
+            - create: create the chroot and download every package,
+            - reuse: nothing to do,
+            - update: only download the added packages,
+            - reset: clean downloaded packages and download them again,
+              as it is not known which files belong to removed packages.
+        The chroot itself is only created again when forced or too old.
+        """
+        if not artifacts_info:
+            return "create", packages
+        existing_packages = artifacts_info.get("packages", [])
+        if force:
+            msg = f"{self.dist}: Forcing cache recreation..."
+            action = "create"
+        elif self.is_cache_too_old(artifacts_info):
+            msg = f"{self.dist}: Existing cache is too old. Recreating cache..."
+            action = "create"
+        elif set(packages) == set(existing_packages):
+            msg = f"{self.dist}: Re-using existing cache. Use --force to force cleanup and recreation."
+            action = "reuse"
+        elif set(existing_packages).issubset(packages):
+            msg = f"{self.dist}: Adding requested packages to existing cache..."
+            action = "update"
+            packages = [p for p in packages if p not in existing_packages]
+        else:
+            msg = f"{self.dist}: Existing packages in cache differ from requested ones. Downloading them again into existing cache..."
+            action = "reset"
+        self.log.info(msg)
+        return action, packages
+
+    def get_cache_info(
+        self, artifacts_info: dict, action: str, packages: List[str]
+    ) -> dict:
+        if action == "create" or not artifacts_info.get("timestamp", None):
+            timestamp = datetime.datetime.now(datetime.UTC).strftime(
+                "%Y%m%d%H%M"
+            )
+        else:
+            timestamp = artifacts_info["timestamp"]
+        return {"packages": packages, "timestamp": timestamp}
@@ -61,38 +61,17 @@ class DEBChrootPlugin(DEBDistributionPlugin, ChrootPlugin):
             artifacts_dir=chroot_dir / self.dist.nva,
         )
 
-        existing_packages = artifacts_info.get("packages", [])
+        additional_packages = self.get_cache_options().get("packages", [])
 
-        additional_packages = (
-            self.config.get("cache", {})
-            .get(self.dist.distribution, {})
-            .get("packages", [])
+        action, packages = self.get_cache_update(
+            artifacts_info, additional_packages, force
         )
-
-        # Delete previous chroot if forced or package sets differ
-        if artifacts_info:
-            if force:
-                msg = f"{self.dist}: Forcing cache recreation..."
-                recreate = True
-            elif set(additional_packages) != set(existing_packages):
-                msg = (
-                    f"{self.dist}: Existing packages in cache differ from requested ones. "
-                    f"Recreating cache..."
-                )
-                recreate = True
-            else:
-                msg = (
-                    f"{self.dist}: Re-using existing cache. "
-                    f"Use --force to force cleanup and recreation."
-                )
-                recreate = False
-
-            self.log.info(msg)
-
-            if not recreate:
-                return
-
+        if action == "reuse":
+            return
+        if action == "create" and pbuilder_dir.exists():
             shutil.rmtree(pbuilder_dir)
+        if action == "reset" and (pbuilder_dir / "aptcache").exists():
+            shutil.rmtree(pbuilder_dir / "aptcache")
 
         # Create chroot cache dir
         pbuilder_dir.mkdir(exist_ok=True, parents=True)
@@ -101,47 +80,48 @@ class DEBChrootPlugin(DEBDistributionPlugin, ChrootPlugin):
             "@PLUGINS_DIR@/chroot_deb/pbuilder/pbuilderrc"
         ]
 
-        # Create a first cage to generate the base.tgz
-        copy_in = self.default_copy_in(
-            self.executor.get_plugins_dir(), self.executor.get_sources_dir()
-        )
-        copy_out = [
-            (
-                self.executor.get_builder_dir() / "pbuilder/base.tgz",
-                pbuilder_dir,
+        if action == "create":
+            # Create a first cage to generate the base.tgz
+            copy_in = self.default_copy_in(
+                self.executor.get_plugins_dir(), self.executor.get_sources_dir()
             )
-        ]
-        cmd = [
-            f"sed -i '/qubes-deb/d' {self.executor.get_plugins_dir()}/chroot_deb/pbuilder/pbuilderrc",
-            f"mkdir -p {self.executor.get_cache_dir()}/aptcache",
-        ]
-        # If provided, use the first mirror given in builder configuration mirrors list
-        mirrors = self.config.get("mirrors", {}).get(
-            self.dist.distribution, []
-        ) or self.config.get("mirrors", {}).get(self.dist.fullname, [])
-        if mirrors:
-            cmd += [
-                f"sed -i 's@MIRRORSITE=https://deb.debian.org/debian@MIRRORSITE={mirrors[0]}@' {self.executor.get_plugins_dir()}/chroot_deb/pbuilder/pbuilderrc"
+            copy_out = [
+                (
+                    self.executor.get_builder_dir() / "pbuilder/base.tgz",
+                    pbuilder_dir,
+                )
             ]
-        pbuilder_cmd = [
-            f"sudo -E pbuilder create --distribution {self.dist.name}",
-            f"--configfile {self.executor.get_plugins_dir()}/chroot_deb/pbuilder/pbuilderrc",
-        ]
-        cmd.append(" ".join(pbuilder_cmd))
-        try:
-            self.executor.run(
-                cmd,
-                copy_in,
-                copy_out,
-                environment=self.environment,
-                files_inside_executor_with_placeholders=files_inside_executor_with_placeholders,
-            )
-        except ExecutorError as e:
-            msg = f"{self.dist}: Failed to generate chroot: {str(e)}."
-            raise ChrootError(msg) from e
+            cmd = [
+                f"sed -i '/qubes-deb/d' {self.executor.get_plugins_dir()}/chroot_deb/pbuilder/pbuilderrc",
+                f"mkdir -p {self.executor.get_cache_dir()}/aptcache",
+            ]
+            # If provided, use the first mirror given in builder configuration mirrors list
+            mirrors = self.config.get("mirrors", {}).get(
+                self.dist.distribution, []
+            ) or self.config.get("mirrors", {}).get(self.dist.fullname, [])
+            if mirrors:
+                cmd += [
+                    f"sed -i 's@MIRRORSITE=https://deb.debian.org/debian@MIRRORSITE={mirrors[0]}@' {self.executor.get_plugins_dir()}/chroot_deb/pbuilder/pbuilderrc"
+                ]
+            pbuilder_cmd = [
+                f"sudo -E pbuilder create --distribution {self.dist.name}",
+                f"--configfile {self.executor.get_plugins_dir()}/chroot_deb/pbuilder/pbuilderrc",
+            ]
+            cmd.append(" ".join(pbuilder_cmd))
+            try:
+                self.executor.run(
+                    cmd,
+                    copy_in,
+                    copy_out,
+                    environment=self.environment,
+                    files_inside_executor_with_placeholders=files_inside_executor_with_placeholders,
+                )
+            except ExecutorError as e:
+                msg = f"{self.dist}: Failed to generate chroot: {str(e)}."
+                raise ChrootError(msg) from e
 
         # Create a second cage for downloading the packages
-        if additional_packages:
+        if packages:
             copy_in = self.default_copy_in(
                 self.executor.get_plugins_dir(), self.executor.get_sources_dir()
             ) + [
@@ -150,6 +130,11 @@ class DEBChrootPlugin(DEBDistributionPlugin, ChrootPlugin):
                     self.executor.get_builder_dir() / "pbuilder",
                 )
             ]
+            if action == "update" and (pbuilder_dir / "aptcache").exists():
+                # Keep previously downloaded packages
+                copy_in += [
+                    (pbuilder_dir / "aptcache", self.executor.get_cache_dir())
+                ]
             copy_out = [
                 (
                     self.executor.get_cache_dir() / "aptcache",
@@ -164,7 +149,7 @@ class DEBChrootPlugin(DEBDistributionPlugin, ChrootPlugin):
                 f"sudo -E pbuilder execute --distribution {self.dist.name}",
                 f"--configfile {self.executor.get_plugins_dir()}/chroot_deb/pbuilder/pbuilderrc",
                 f"--bindmounts {self.executor.get_cache_dir()}/aptcache:/tmp/aptcache",
-                f"-- {self.executor.get_plugins_dir()}/chroot_deb/scripts/apt-download-packages {' '.join(additional_packages)}",
+                f"-- {self.executor.get_plugins_dir()}/chroot_deb/scripts/apt-download-packages {' '.join(packages)}",
             ]
             cmd.append(" ".join(pbuilder_cmd))
             try:
@@ -182,9 +167,7 @@ class DEBChrootPlugin(DEBDistributionPlugin, ChrootPlugin):
                 raise ChrootError(msg) from e
 
         # Save packages info into artifacts file
-        info = {
-            "packages": additional_packages,
-        }
+        info = self.get_cache_info(artifacts_info, action, additional_packages)
         self.save_artifacts_info(
             stage=self.stage,
             basename=self.dist.nva,
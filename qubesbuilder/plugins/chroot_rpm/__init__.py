@@ -61,31 +61,14 @@ class RPMChrootPlugin(RPMDistributionPlugin, ChrootPlugin):
             artifacts_dir=chroot_dir / self.dist.nva,
         )
 
-        existing_packages = artifacts_info.get("packages", [])
+        additional_packages = self.get_cache_options().get("packages", [])
 
-        additional_packages = (
-            self.config.get("cache", {})
-            .get(self.dist.distribution, {})
-            .get("packages", [])
+        action, packages = self.get_cache_update(
+            artifacts_info, additional_packages, force
         )
-
-        # Delete previous chroot if forced to do it or if packages set differs
-        if artifacts_info:
-            if force:
-                msg = f"{self.dist}: Forcing cache recreation..."
-                recreate = True
-            elif set(additional_packages) != set(existing_packages):
-                msg = f"{self.dist}: Existing packages in cache differs from requested ones. Recreating cache..."
-                recreate = True
-            else:
-                msg = f"{self.dist}: Re-using existing cache. Use --force to force cleanup and recreation."
-                recreate = False
-
-            self.log.info(msg)
-
-            if not recreate:
-                return
-
+        if action == "reuse":
+            return
+        if action == "create" and (chroot_dir / self.dist.nva).exists():
             shutil.rmtree(chroot_dir / self.dist.nva)
 
         # Create chroot cache dir
@@ -120,33 +103,41 @@ class RPMChrootPlugin(RPMDistributionPlugin, ChrootPlugin):
         if self.config.verbose:
             mock_cmd.append("--verbose")
 
-        # Create a first cage to generate the mock chroot
-        copy_in = self.default_copy_in(
-            self.executor.get_plugins_dir(), self.executor.get_sources_dir()
-        )
-        copy_out = [
-            (
-                self.executor.get_cache_dir() / f"mock/{self.dist.nva}",
-                chroot_dir,
-            )
-        ]
-        cmd = [" ".join(mock_cmd + ["--init"])]
-        try:
-            self.executor.run(
-                cmd,
-                copy_in,
-                copy_out,
-                environment=self.environment,
-                files_inside_executor_with_placeholders=files_inside_executor_with_placeholders,
+        if action == "create":
+            # Create a first cage to generate the mock chroot
+            copy_in = self.default_copy_in(
+                self.executor.get_plugins_dir(), self.executor.get_sources_dir()
             )
-        except ExecutorError as e:
-            msg = f"{self.dist}: Failed to generate chroot: {str(e)}."
-            raise ChrootError(msg) from e
+            copy_out = [
+                (
+                    self.executor.get_cache_dir() / f"mock/{self.dist.nva}",
+                    chroot_dir,
+                )
+            ]
+            cmd = [" ".join(mock_cmd + ["--init"])]
+            try:
+                self.executor.run(
+                    cmd,
+                    copy_in,
+                    copy_out,
+                    environment=self.environment,
+                    files_inside_executor_with_placeholders=files_inside_executor_with_placeholders,
+                )
+            except ExecutorError as e:
+                msg = f"{self.dist}: Failed to generate chroot: {str(e)}."
+                raise ChrootError(msg) from e
+        else:
+            # Restore the existing chroot from its cache
+            mock_cmd.append("--plugin-option=root_cache:age_check=False")
+            cmd = [" ".join(mock_cmd + ["--init"])]
 
         # Create a second cage for downloading the packages
-        if additional_packages:
-            # Remove dnf_cache
-            if (chroot_dir / self.dist.nva / "dnf_cache").exists():
+        if packages:
+            # Remove dnf_cache, unless only adding packages to it
+            if (
+                action != "update"
+                and (chroot_dir / self.dist.nva / "dnf_cache").exists()
+            ):
                 shutil.rmtree(chroot_dir / self.dist.nva / "dnf_cache")
             copy_in = self.default_copy_in(
                 self.executor.get_plugins_dir(), self.executor.get_sources_dir()
@@ -163,7 +154,7 @@ class RPMChrootPlugin(RPMDistributionPlugin, ChrootPlugin):
                     chroot_dir / self.dist.nva,
                 )
             ]
-            for package in additional_packages:
+            for package in packages:
                 mock_cmd += ["--install", f"'{package}'"]
             cmd.append(" ".join(mock_cmd))
             try:
@@ -179,11 +170,13 @@ class RPMChrootPlugin(RPMDistributionPlugin, ChrootPlugin):
                     f"{self.dist}: Failed to download extra packages: {str(e)}."
                 )
                 raise ChrootError(msg) from e
+        elif action == "reset":
+            # All requested packages have been removed
+            if (chroot_dir / self.dist.nva / "dnf_cache").exists():
+                shutil.rmtree(chroot_dir / self.dist.nva / "dnf_cache")
 
         # Save packages info into artifacts file
-        info = {
-            "packages": additional_packages,
-        }
+        info = self.get_cache_info(artifacts_info, action, additional_packages)
         self.save_artifacts_info(
             stage=self.stage,
             basename=self.dist.nva,
@@ -137,6 +137,14 @@ class DEBSignPlugin(DEBDistributionPlugin, SignPlugin):
                     f"{self.component}:{self.dist}:{directory}: Nothing to sign."
                 )
                 continue
+            # debsign updates .dsc and .buildinfo files referenced in .changes
+            self.unshare_artifacts(
+                [
+                    build_artifacts_dir / build_info[f]
+                    for f in ["changes", "buildinfo", "dsc"]
+                    if build_info.get(f, None)
+                ]
+            )
             try:
                 self.log.info(
                     f"{self.component}:{self.dist}:{directory}: Signing from '{build_info['changes']}' info."
@@ -149,6 +157,11 @@ class DEBSignPlugin(DEBDistributionPlugin, SignPlugin):
                 msg = f"{self.component}:{self.dist}:{directory}: Failed to sign Debian packages."
                 raise SignError(msg) from e
 
+            # Signed files are new content for the artifacts store
+            self.update_artifacts_digests(
+                "build", directory_bn, build_artifacts_dir
+            )
+
             # Re-provision builder local repository with signatures
             repository_dir = self.config.repository_dir / self.dist.distribution
             try:
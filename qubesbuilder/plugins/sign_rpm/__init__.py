@@ -147,6 +147,10 @@ class RPMSignPlugin(RPMDistributionPlugin, SignPlugin):
                 build_artifacts_dir / "rpm" / rpm for rpm in build_info["rpms"]
             ]
             packages_list += [prep_artifacts_dir / build_info["srpm"]]
+            buildinfo_file = (
+                build_artifacts_dir / "rpm" / build_info["buildinfo"]
+            )
+            self.unshare_artifacts(packages_list + [buildinfo_file])
 
             try:
                 for rpm in packages_list:
@@ -162,10 +166,6 @@ class RPMSignPlugin(RPMDistributionPlugin, SignPlugin):
                 msg = f"{self.component}:{self.dist}:{build}: Failed to sign RPMs."
                 raise SignError(msg) from e
 
-            buildinfo_file = (
-                build_artifacts_dir / "rpm" / build_info["buildinfo"]
-            )
-
             try:
                 self.log.info(
                     f"{self.component}:{self.dist}:{build}: Signing '{buildinfo_file.name}'."
@@ -178,6 +178,12 @@ class RPMSignPlugin(RPMDistributionPlugin, SignPlugin):
                 msg = f"{self.component}:{self.dist}:{build}: Failed to sign buildinfo file."
                 raise SignError(msg) from e
 
+            # Signed files are new content for the artifacts store
+            self.update_artifacts_digests("prep", build_bn, prep_artifacts_dir)
+            self.update_artifacts_digests(
+                "build", build_bn, build_artifacts_dir
+            )
+
             # Re-provision builder local repository with signatures
             try:
                 provision_local_repository(
@@ -0,0 +1,407 @@
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2026 agent <agent@local>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+import asyncio
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from graphlib import TopologicalSorter
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import yaml
+
+from qubesbuilder.exc import QubesBuilderError
+from qubesbuilder.log import QubesBuilderLogger
+from qubesbuilder.plugins import Plugin
+
+JobResult = namedtuple("JobResult", ["job", "status", "duration", "error"])
+
+# A job uses 'amount' of the resource 'name' that cannot be used by more
+# than 'capacity' at the same time.
+JobResource = namedtuple("JobResource", ["name", "amount", "capacity"])
+
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_SKIPPED = "skipped"
+
+
+def get_job_key(job: Plugin) -> str:
+    """
+    Identify a job by its component, distribution or template and stage.
+    """
+    component = getattr(job, "component", None)
+    dist = getattr(job, "dist", None)
+    template = getattr(job, "template", None)
+    parts = []
+    if component is not None:
+        parts.append(component.name)
+    if template is not None:
+        parts.append(template.name)
+    elif dist is not None:
+        parts.append(dist.distribution)
+    parts.append(job.stage)
+    return ":".join(parts)
+
+
+def get_job_name(job: Plugin) -> str:
+    return f"{job.name}:{get_job_key(job)}"
+
+
+class JobsHistory:
+    """
+    Wall-clock durations of previously run jobs stored in a YAML file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._durations: Dict[str, float] = {}
+        self.log = QubesBuilderLogger.getChild("scheduler")
+        if self.path.exists():
+            try:
+                with open(self.path) as f:
+                    durations = yaml.safe_load(f.read()) or {}
+                self._durations = {
+                    str(key): float(value) for key, value in durations.items()
+                }
+            except (OSError, yaml.YAMLError, AttributeError, ValueError) as e:
+                self.log.warning(
+                    f"Ignoring invalid jobs history '{self.path}': {str(e)}"
+                )
+
+    def get(self, job: Plugin) -> Optional[float]:
+        return self._durations.get(get_job_key(job), None)
+
+    def get_average(self) -> float:
+        if not self._durations:
+            return 0.0
+        return sum(self._durations.values()) / len(self._durations)
+
+    def update(self, results: List[JobResult]):
+        for result in results:
+            if result.status != JOB_SUCCEEDED:
+                continue
+            key = get_job_key(result.job)
+            # A job skipped because nothing changed is much shorter than a
+            # real run: only let the previous duration decay slowly.
+            previous = self._durations.get(key, 0.0)
+            self._durations[key] = round(max(result.duration, previous / 2), 1)
+
+    def save(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "w") as f:
+                f.write(yaml.safe_dump(self._durations))
+        except OSError as e:
+            self.log.warning(
+                f"Failed to save jobs history '{self.path}': {str(e)}"
+            )
+
+
+class JobScheduler:
+    """
+    Run jobs of a dependency graph as returned by Config.get_jobs_graph.
+
+    With a single worker, jobs are run one after the other in the same
+    order as Config.get_jobs and the first failure is raised immediately.
+    With more workers, every job whose dependencies are done is handed
+    to a thread pool as soon as the resources it requires are available,
+    the ones with the longest remaining critical path first.
+    A failed job does not stop independent jobs but every job depending
+    on it, directly or not, is skipped. The first failure is raised once
+    all the other jobs are finished.
+
+    Once a job succeeded, 'on_job_done' may return a graph of new jobs to
+    run. It allows planning jobs that can only be instantiated after some
+    other ones are done.
+    """
+
+    def __init__(
+        self,
+        graph: Dict[Plugin, List[Plugin]],
+        jobs: int = 1,
+        on_job_start: Optional[Callable[[Plugin], None]] = None,
+        get_job_resources: Optional[
+            Callable[[Plugin], List[JobResource]]
+        ] = None,
+        history: Optional[JobsHistory] = None,
+        on_job_done: Optional[
+            Callable[[Plugin], Dict[Plugin, List[Plugin]]]
+        ] = None,
+    ):
+        self._history = history
+        self._jobs = max(1, jobs)
+        self._on_job_start = on_job_start
+        self._on_job_done = on_job_done
+        self._get_job_resources = get_job_resources
+        self._resources: Dict[Plugin, List[JobResource]] = {}
+        self._usage: Dict[str, int] = {}
+        self.results: List[JobResult] = []
+        self.log = QubesBuilderLogger.getChild("scheduler")
+
+        self._graph: Dict[Plugin, List[Plugin]] = {}
+        # Number of dependencies not yet done per job
+        self._pending: Dict[Plugin, int] = {}
+        self._dependents: Dict[Plugin, List[Plugin]] = {}
+        self._status: Dict[Plugin, str] = {}
+        # Jobs whose dependencies are done, in the order they became ready
+        self._waiting: List[Plugin] = []
+        self._priorities: Dict[Plugin, float] = {}
+        # Estimated duration of jobs not in the history
+        self._default_duration = history.get_average() if history else 0.0
+
+        # Detect dependency cycles before running anything
+        TopologicalSorter(graph).prepare()
+        self.add_jobs(graph)
+
+    def _check_dependencies(self, graph: Dict[Plugin, List[Plugin]]):
+        # A job depending on a job never run would never be ready
+        for job, deps in graph.items():
+            for dep in deps:
+                if dep not in graph and dep not in self._graph:
+                    raise QubesBuilderError(
+                        f"{get_job_name(job)}: Cannot depend on "
+                        f"{get_job_name(dep)} which is not planned."
+                    )
+
+    def add_jobs(self, graph: Dict[Plugin, List[Plugin]]):
+        self._check_dependencies(graph)
+        new_jobs = [job for job in graph if job not in self._graph]
+        for job in new_jobs:
+            self._graph[job] = list(graph[job])
+            self._dependents.setdefault(job, [])
+        for job in new_jobs:
+            for dep in self._graph[job]:
+                self._dependents.setdefault(dep, []).append(job)
+            self._pending[job] = len(
+                [dep for dep in self._graph[job] if dep not in self._status]
+            )
+        for job in new_jobs:
+            if not self._pending[job]:
+                self._set_ready(job)
+        if self._jobs > 1:
+            self._update_priorities(new_jobs)
+
+    def _set_ready(self, job: Plugin):
+        if any(
+            self._status.get(dep, None) in (JOB_FAILED, JOB_SKIPPED)
+            for dep in self._graph[job]
+        ):
+            self.log.warning(
+                f"{get_job_name(job)}: Skipping because a job it depends on has failed."
+            )
+            self._finish(JobResult(job, JOB_SKIPPED, 0.0, None))
+        else:
+            self._waiting.append(job)
+
+    def _finish(self, result: JobResult):
+        self.results.append(result)
+        self._status[result.job] = result.status
+        for dependent in self._dependents[result.job]:
+            self._pending[dependent] -= 1
+            if not self._pending[dependent]:
+                self._set_ready(dependent)
+
+    def _complete(self, job: Plugin, duration: float, error=None):
+        new_jobs = {}
+        if not error and self._on_job_done:
+            try:
+                new_jobs = self._on_job_done(job)
+                self._check_dependencies(new_jobs)
+            except Exception as e:
+                error = e
+        if error:
+            self._finish(JobResult(job, JOB_FAILED, duration, error))
+        else:
+            self._finish(JobResult(job, JOB_SUCCEEDED, duration, None))
+            self.add_jobs(new_jobs)
+        return error
+
+    def _start_job(self, job: Plugin):
+        if self._on_job_start:
+            self._on_job_start(job)
+
+    def run(self, **kwargs):
+        try:
+            if self._jobs == 1:
+                self._run_sequential(**kwargs)
+                return
+
+            try:
+                loop = asyncio.get_event_loop()
+            except RuntimeError:
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+            loop.run_until_complete(self._run_parallel(**kwargs))
+        finally:
+            if self._history:
+                self._history.update(self.results)
+                self._history.save()
+            self.report()
+
+        for result in self.results:
+            if result.status == JOB_FAILED:
+                raise result.error
+
+    def _check_all_done(self):
+        remaining = [job for job in self._graph if job not in self._status]
+        if remaining:
+            raise QubesBuilderError(
+                f"Cannot run jobs with circular dependencies: "
+                f"{', '.join(get_job_name(job) for job in remaining)}."
+            )
+
+    def _run_sequential(self, **kwargs):
+        while self._waiting:
+            job = self._waiting.pop(0)
+            self._start_job(job)
+            start = time.monotonic()
+            error: Optional[Exception] = None
+            try:
+                job.run(**kwargs)
+            except Exception as e:
+                error = e
+            error = self._complete(job, time.monotonic() - start, error)
+            if error:
+                raise error
+        self._check_all_done()
+
+    @staticmethod
+    def _timed_run(job: Plugin, **kwargs) -> float:
+        start = time.monotonic()
+        job.run(**kwargs)
+        return time.monotonic() - start
+
+    def get_priorities(self) -> Dict[Plugin, float]:
+        """
+        Duration of the longest chain of jobs starting with each job,
+        i.e. the remaining critical path, based on jobs history. Unknown
+        durations are estimated as the average duration of the history.
+        """
+        return dict(self._priorities)
+
+    def _get_priority(self, job: Plugin) -> float:
+        duration = self._history.get(job) if self._history else None
+        return (
+            duration if duration is not None else self._default_duration
+        ) + max(
+            (self._priorities[d] for d in self._dependents.get(job, [])),
+            default=0.0,
+        )
+
+    def _update_priorities(self, new_jobs: List[Plugin]):
+        # Already planned jobs never depend on new ones: only new jobs and
+        # the jobs they depend on, directly or not, need to be updated.
+        jobs = set(new_jobs)
+        queue = list(new_jobs)
+        while queue:
+            for dep in self._graph[queue.pop()]:
+                if dep not in jobs:
+                    jobs.add(dep)
+                    queue.append(dep)
+        graph = {
+            job: [d for d in self._graph[job] if d in jobs] for job in jobs
+        }
+        for job in reversed(list(TopologicalSorter(graph).static_order())):
+            self._priorities[job] = self._get_priority(job)
+
+    def _get_resources(self, job: Plugin) -> List[JobResource]:
+        if job not in self._resources:
+            self._resources[job] = (
+                self._get_job_resources(job) if self._get_job_resources else []
+            )
+        return self._resources[job]
+
+    def _resources_available(self, job: Plugin) -> bool:
+        for resource in self._get_resources(job):
+            usage = self._usage.get(resource.name, 0)
+            # A job requesting more than the capacity can still run alone.
+            if usage and usage + resource.amount > resource.capacity:
+                return False
+        return True
+
+    def _acquire_resources(self, job: Plugin):
+        for resource in self._get_resources(job):
+            self._usage.setdefault(resource.name, 0)
+            self._usage[resource.name] += resource.amount
+
+    def _release_resources(self, job: Plugin):
+        for resource in self._get_resources(job):
+            self._usage[resource.name] -= resource.amount
+
+    async def _run_parallel(self, **kwargs):
+        loop = asyncio.get_running_loop()
+        running: Dict[asyncio.Future, Plugin] = {}
+        started: Dict[Plugin, float] = {}
+
+        pool = ThreadPoolExecutor(
+            max_workers=self._jobs, thread_name_prefix="qb-job"
+        )
+        try:
+            while self._waiting or running:
+                # Start first jobs on the longest remaining critical path.
+                self._waiting.sort(
+                    key=lambda j: self._priorities.get(j, 0.0), reverse=True
+                )
+                for job in list(self._waiting):
+                    if len(running) >= self._jobs:
+                        break
+                    if not self._resources_available(job):
+                        continue
+                    self._waiting.remove(job)
+                    self._acquire_resources(job)
+                    self._start_job(job)
+                    started[job] = time.monotonic()
+                    future = loop.run_in_executor(
+                        pool, partial(self._timed_run, job, **kwargs)
+                    )
+                    running[future] = job
+
+                done, _ = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    job = running.pop(future)
+                    self._release_resources(job)
+                    error = future.exception()
+                    if error:
+                        duration = time.monotonic() - started[job]
+                    else:
+                        duration = future.result()
+                    error = self._complete(job, duration, error)
+                    if error:
+                        self.log.error(f"{get_job_name(job)}: {str(error)}")
+        finally:
+            # On interruption, do not start queued jobs. Running ones are
+            # stopped by the executors cleanup callbacks.
+            pool.shutdown(wait=not running, cancel_futures=True)
+        self._check_all_done()
+
+    def report(self):
+        if not self.results:
+            return
+        self.log.info("Jobs summary:")
+        for result in self.results:
+            msg = f"  {get_job_name(result.job)}: {result.status}"
+            if result.status != JOB_SKIPPED:
+                msg += f" ({result.duration:.1f}s)"
+            if result.status == JOB_SUCCEEDED:
+                self.log.info(msg)
+            else:
+                self.log.error(msg)
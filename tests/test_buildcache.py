@@ -0,0 +1,185 @@
+import io
+import os
+import shutil
+import tarfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from qubesbuilder.buildcache import (
+    BuildCacheError,
+    DirectoryBuildCache,
+    HTTPBuildCache,
+    get_build_cache,
+    get_build_fingerprint,
+)
+from qubesbuilder.component import QubesComponent
+from qubesbuilder.config import Config
+from qubesbuilder.distribution import QubesDistribution
+from qubesbuilder.plugins.build import BuildPlugin, get_package_digest
+
+
+def _create_artifacts(artifacts_dir):
+    (artifacts_dir / "rpm").mkdir(parents=True)
+    (artifacts_dir / "rpm" / "package.rpm").write_bytes(b"package")
+    (artifacts_dir / "rpm" / "package.src.rpm").write_bytes(b"source")
+    # Build artifacts are hard linked to each other
+    os.link(
+        artifacts_dir / "rpm" / "package.src.rpm",
+        artifacts_dir / "package.src.rpm",
+    )
+    (artifacts_dir / "rpm_spec.build.yml").write_text("rpms: [package.rpm]\n")
+
+
+def _check_artifacts(artifacts_dir):
+    assert (artifacts_dir / "rpm" / "package.rpm").read_bytes() == b"package"
+    assert (artifacts_dir / "package.src.rpm").read_bytes() == b"source"
+    assert (
+        artifacts_dir / "rpm_spec.build.yml"
+    ).read_text() == "rpms: [package.rpm]\n"
+
+
+class BuildCacheHandler(BaseHTTPRequestHandler):
+    archives: dict = {}
+
+    def do_GET(self):
+        content = self.archives.get(self.path, None)
+        if content is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_PUT(self):
+        length = int(self.headers["Content-Length"])
+        self.archives[self.path] = self.rfile.read(length)
+        self.send_response(201)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def build_cache_server():
+    BuildCacheHandler.archives = {}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BuildCacheHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/cache"
+    server.shutdown()
+    server.server_close()
+
+
+def test_build_cache_fingerprint():
+    inputs = {"source-hash": "abc", "plugins": {"a": "1", "b": "2"}}
+    same_inputs = {"plugins": {"b": "2", "a": "1"}, "source-hash": "abc"}
+    assert get_build_fingerprint(inputs) == get_build_fingerprint(same_inputs)
+    inputs["plugins"]["b"] = "3"
+    assert get_build_fingerprint(inputs) != get_build_fingerprint(same_inputs)
+
+
+def test_build_cache_directory(tmp_path):
+    cache = get_build_cache({"directory": str(tmp_path / "cache")})
+    assert isinstance(cache, DirectoryBuildCache)
+
+    artifacts_dir = tmp_path / "builder1" / "build"
+    _create_artifacts(artifacts_dir)
+    restored_dir = tmp_path / "builder2" / "build"
+    assert not cache.get("key", restored_dir)
+
+    cache.put("key", artifacts_dir)
+    assert (tmp_path / "cache" / "key.tar").exists()
+    assert cache.get("key", restored_dir)
+    _check_artifacts(restored_dir)
+
+    # Read-only caches are not updated
+    cache = get_build_cache(
+        {"directory": str(tmp_path / "cache"), "read-only": True}
+    )
+    cache.put("other", artifacts_dir)
+    assert not (tmp_path / "cache" / "other.tar").exists()
+
+
+def test_build_cache_http(tmp_path, build_cache_server):
+    cache = get_build_cache({"url": build_cache_server})
+    assert isinstance(cache, HTTPBuildCache)
+
+    artifacts_dir = tmp_path / "builder1" / "build"
+    _create_artifacts(artifacts_dir)
+    restored_dir = tmp_path / "builder2" / "build"
+    assert not cache.get("key", restored_dir)
+
+    cache.put("key", artifacts_dir)
+    assert "/cache/key.tar" in BuildCacheHandler.archives
+    assert cache.get("key", restored_dir)
+    _check_artifacts(restored_dir)
+
+
+def test_build_cache_invalid_archive(tmp_path):
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        info = tarfile.TarInfo("../outside")
+        info.size = 4
+        tar.addfile(info, io.BytesIO(b"evil"))
+    (tmp_path / "cache").mkdir()
+    (tmp_path / "cache" / "key.tar").write_bytes(archive.getvalue())
+
+    cache = DirectoryBuildCache(tmp_path / "cache")
+    assert not cache.get("key", tmp_path / "artifacts" / "build")
+    assert not (tmp_path / "artifacts").exists()
+    assert not (tmp_path / "outside").exists()
+
+
+def test_build_cache_options():
+    assert get_build_cache({}) is None
+    with pytest.raises(BuildCacheError):
+        get_build_cache({"read-only": True})
+
+
+def test_build_cache_local_repository(tmp_path):
+    source_dir = tmp_path / "sources" / "foo"
+    source_dir.mkdir(parents=True)
+    (source_dir / "version").write_text("1.0\n")
+    (source_dir / "rel").write_text("1\n")
+    (source_dir / ".qubesbuilder").write_text(
+        "host:\n  rpm:\n    build:\n    - rpm/foo.spec\n"
+    )
+    config_file = tmp_path / "builder.yml"
+    config_file.write_text(
+        f"artifacts-dir: {tmp_path / 'artifacts'}\n"
+        f"executor:\n  type: local\n"
+        f"build-cache:\n  directory: {tmp_path / 'cache'}\n"
+    )
+    config = Config(config_file)
+    plugin = BuildPlugin(
+        component=QubesComponent(source_dir),
+        dist=QubesDistribution("host-fc42"),
+        config=config,
+        stage="build",
+    )
+    key = get_build_fingerprint(plugin.get_build_inputs())
+
+    # Packages of other components built locally are build inputs
+    package = config.repository_dir / "host-fc42" / "bar_1.0-1" / "bar.rpm"
+    package.parent.mkdir(parents=True)
+    package.write_bytes(b"bar")
+    assert get_build_fingerprint(plugin.get_build_inputs()) != key
+
+    # Consumed dependencies are recorded again when restoring artifacts
+    # built by another builder
+    artifacts_dir = plugin.get_dist_component_artifacts_dir("build")
+    basename = plugin.get_parameters("build")["build"][0].mangle()
+    plugin.save_dist_artifacts_info(
+        "build", basename, {"dependencies": {"bar_1.0-1/bar.rpm": "other"}}
+    )
+    plugin.save_to_build_cache(artifacts_dir)
+    shutil.rmtree(artifacts_dir)
+    assert plugin.restore_from_build_cache(artifacts_dir)
+    assert plugin.get_dist_artifacts_info("build", basename)[
+        "dependencies"
+    ] == {"bar_1.0-1/bar.rpm": get_package_digest(package)}
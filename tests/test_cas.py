@@ -0,0 +1,71 @@
+import hashlib
+
+from qubesbuilder.cas import ArtifactsStore
+from qubesbuilder.config import Config
+from qubesbuilder.plugins import Plugin
+
+
+def test_cas_add(tmp_path):
+    store = ArtifactsStore(tmp_path / "cas")
+    first = tmp_path / "1" / "package.rpm"
+    second = tmp_path / "2" / "package.rpm"
+    for path in (first, second):
+        path.parent.mkdir()
+        path.write_bytes(b"content")
+
+    digest = store.add(first)
+    assert digest == hashlib.sha256(b"content").hexdigest()
+    assert store.contains(digest)
+    assert first.samefile(store.get_path(digest))
+
+    # The same content is stored only once
+    assert store.add(second) == digest
+    assert second.samefile(first)
+    assert store.get_path(digest).stat().st_nlink == 3
+    assert list(store.path.iterdir()) == [store.get_path(digest)]
+
+    # Files modified in place must be unshared first
+    ArtifactsStore.unshare(second)
+    second.write_bytes(b"signed content")
+    assert store.get_path(digest).read_bytes() == b"content"
+    assert first.read_bytes() == b"content"
+
+
+def test_cas_save_artifacts_info(tmp_path):
+    config_file = tmp_path / "builder.yml"
+    config_file.write_text(
+        f"artifacts-dir: {tmp_path / 'artifacts'}\nartifacts-cas: true\n"
+    )
+    config = Config(config_file)
+    plugin = Plugin(config=config, stage="build")
+
+    artifacts_dir = config.artifacts_dir / "components" / "build"
+    (artifacts_dir / "rpm").mkdir(parents=True)
+    (artifacts_dir / "rpm" / "package.rpm").write_bytes(b"package")
+    info = {"files": ["rpm/package.rpm", "distfile.tar.gz"]}
+    plugin.save_artifacts_info("build", "rpm_spec", info, artifacts_dir)
+
+    saved_info = plugin.get_artifacts_info("build", "rpm_spec", artifacts_dir)
+    digest = hashlib.sha256(b"package").hexdigest()
+    assert saved_info["digests"] == {"rpm/package.rpm": digest}
+    assert (artifacts_dir / "rpm" / "package.rpm").samefile(
+        config.cas_dir / digest
+    )
+
+    # Files signed in place are stored again
+    ArtifactsStore.unshare(artifacts_dir / "rpm" / "package.rpm")
+    (artifacts_dir / "rpm" / "package.rpm").write_bytes(b"signed package")
+    plugin.update_artifacts_digests("build", "rpm_spec", artifacts_dir)
+    saved_info = plugin.get_artifacts_info("build", "rpm_spec", artifacts_dir)
+    digest = hashlib.sha256(b"signed package").hexdigest()
+    assert saved_info["digests"] == {"rpm/package.rpm": digest}
+    assert (artifacts_dir / "rpm" / "package.rpm").samefile(
+        config.cas_dir / digest
+    )
+
+    # Without store, digests of a previous stage are not kept
+    config.set("artifacts-cas", False)
+    plugin.save_artifacts_info("build", "rpm_spec", saved_info, artifacts_dir)
+    assert "digests" not in plugin.get_artifacts_info(
+        "build", "rpm_spec", artifacts_dir
+    )
@@ -1,15 +1,31 @@
+import io
+import json
 import os.path
 import subprocess
+import sys
+import tarfile
 import tempfile
+import threading
 from pathlib import Path, PurePath
 
 import pytest
 
 from qubesbuilder.exc import QubesBuilderError
-from qubesbuilder.executors import Executor, ExecutorError
-from qubesbuilder.executors.container import ContainerExecutor
+from qubesbuilder.executors import Executor, ExecutorError, unpack
+from qubesbuilder.executors.container import (
+    ContainerExecutor,
+    ContainerPool,
+    extract_archive,
+    write_archive,
+)
 from qubesbuilder.executors.local import LocalExecutor
-from qubesbuilder.executors.qubes import LinuxQubesExecutor
+from qubesbuilder.executors.qubes import (
+    DispVMPool,
+    DispVMReaper,
+    LinuxQubesExecutor,
+    get_batches,
+)
+from qubesbuilder.executors.unpack import unpack_archive
 
 
 class MockExecutor(Executor):
@@ -255,17 +271,20 @@ def test_copy_out_error_ignored(executor):
 
 
 def test_container_not_running():
+    # The container client is only reached on first use
+    executor = ContainerExecutor(
+        "docker", "fedora:latest", base_url="tcp://127.0.0.1:1234"
+    )
     with pytest.raises(ExecutorError) as e:
-        ContainerExecutor(
-            "docker", "fedora:latest", base_url="tcp://127.0.0.1:1234"
-        )
+        executor.run(["true"])
     msg = "Cannot connect to container client."
     assert str(e.value) == msg
 
 
 def test_container_unknown_image():
+    executor = ContainerExecutor("docker", "fedora-unknown:latest")
     with pytest.raises(ExecutorError) as e:
-        ContainerExecutor("docker", "fedora-unknown:latest")
+        executor.run(["true"])
     msg = "Cannot find fedora-unknown:latest."
     assert str(e.value) == msg
 
@@ -309,6 +328,152 @@ def test_container_on_error_noclean():
     executor.cleanup()
 
 
+class DummyContainer:
+    def __init__(self, reset_exit_code=0):
+        self.id = "dummy"
+        self.commands = []
+        self.removed = False
+        self.stopped = False
+        self.reset_exit_code = reset_exit_code
+
+    def exec_run(self, cmd):
+        self.commands.append(cmd)
+        return self.reset_exit_code, b""
+
+    def remove(self, force=False):
+        self.removed = True
+
+    def stop(self):
+        self.stopped = True
+
+
+def test_container_pool():
+    pool = ContainerPool()
+    key = ("podman", "image", "{}")
+    assert pool.acquire(key) is None
+    container = DummyContainer()
+    pool.release(key, container, 1)
+    assert pool.acquire(("docker", "image", "{}")) is None
+    assert pool.acquire(key) == (container, 1)
+    assert pool.acquire(key) is None
+
+    pool.release(key, container, 1)
+    pool.close()
+    assert container.removed
+    assert pool.acquire(key) is None
+
+
+def test_container_release(monkeypatch):
+    pool = ContainerPool()
+    monkeypatch.setattr(ContainerExecutor, "_pool", pool)
+    executor = ContainerExecutor("podman", "fedora:latest", reuse=2)
+    monkeypatch.setattr(executor, "get_image_id", lambda: "image")
+
+    # The builder directory is removed before reusing the container
+    container = DummyContainer()
+    executor.container, executor._container_uses = container, 0
+    executor.release_container()
+    assert "rm -rf --one-file-system -- /builder" in container.commands[0][-1]
+    assert not container.removed
+    assert executor.container is None
+
+    # Containers are removed once they reach the reuse limit
+    executor.container, executor._container_uses = pool.acquire(
+        executor._get_pool_key()
+    )
+    executor.release_container()
+    assert container.removed
+    assert pool.acquire(executor._get_pool_key()) is None
+
+    # or when they cannot be reset
+    container = DummyContainer(reset_exit_code=1)
+    executor.container, executor._container_uses = container, 0
+    executor.release_container()
+    assert container.removed
+
+    # Containers kept for inspection are stopped instead of left running
+    container = DummyContainer()
+    executor.container, executor._container_uses = container, 0
+    executor.keep_container()
+    assert container.stopped and not container.removed
+    assert pool.acquire(executor._get_pool_key()) is None
+
+
+def test_container_archive(tmp_path):
+    (tmp_path / "plugins" / "build_rpm").mkdir(parents=True)
+    (tmp_path / "plugins" / "build_rpm" / "script").write_text("script\n")
+    (tmp_path / "package.src.rpm").write_bytes(b"source")
+
+    archive = io.BytesIO()
+    write_archive(
+        archive,
+        [
+            (tmp_path / "plugins", PurePath("/builder")),
+            (tmp_path / "package.src.rpm", PurePath("/builder/build")),
+        ],
+    )
+    archive.seek(0)
+    with tarfile.open(fileobj=archive) as tar:
+        names = tar.getnames()
+        assert all(member.uid == 0 for member in tar.getmembers())
+    # Parent directories are created before their content
+    assert names == [
+        "builder",
+        "builder/plugins",
+        "builder/plugins/build_rpm",
+        "builder/plugins/build_rpm/script",
+        "builder/build",
+        "builder/build/package.src.rpm",
+    ]
+
+    # Archives are received as chunks
+    data = archive.getvalue()
+    chunks = (data[i : i + 1000] for i in range(0, len(data), 1000))
+    extract_archive(chunks, tmp_path / "out")
+    assert (
+        tmp_path / "out/builder/plugins/build_rpm/script"
+    ).read_text() == "script\n"
+    assert (tmp_path / "out/builder/build/package.src.rpm").read_bytes() == (
+        b"source"
+    )
+
+
+def test_container_archive_outside_destination(tmp_path):
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        info = tarfile.TarInfo("../outside")
+        info.size = 4
+        tar.addfile(info, io.BytesIO(b"evil"))
+    with pytest.raises(tarfile.TarError):
+        extract_archive(iter([archive.getvalue()]), tmp_path / "out")
+    assert not (tmp_path / "outside").exists()
+
+
+@pytest.mark.parametrize(
+    "name, linkname",
+    [("../outside", None), ("/outside", None), ("link", "../outside")],
+)
+def test_container_archive_outside_destination_no_filter(
+    tmp_path, monkeypatch, name, linkname
+):
+    # Extraction filters are missing before Python 3.11.4
+    monkeypatch.delattr(tarfile, "data_filter", raising=False)
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        info = tarfile.TarInfo(name)
+        if linkname:
+            info.type = tarfile.SYMTYPE
+            info.linkname = linkname
+            tar.addfile(info)
+        else:
+            info.size = 4
+            tar.addfile(info, io.BytesIO(b"evil"))
+    with pytest.raises(tarfile.TarError):
+        extract_archive(iter([archive.getvalue()]), tmp_path / "out")
+    assert not (tmp_path / "outside").exists()
+    assert not (tmp_path / "out" / "link").exists()
+
+
 def test_local_clean_on_error():
     executor = LocalExecutor()
     cmd = "this_command_does_not_exist"
@@ -328,6 +493,356 @@ def test_local_on_error_noclean():
     executor.cleanup()
 
 
+def test_executor_unknown_chroot_cache():
+    with pytest.raises(ExecutorError):
+        LocalExecutor(chroot_cache="unknown")
+
+
+@pytest.mark.parametrize("chroot_cache", ["copy", "snapshot"])
+def test_local_chroot_cache(tmp_path, chroot_cache):
+    cache = tmp_path / "cache" / "fedora-42-x86_64"
+    (cache / "root_cache").mkdir(parents=True)
+    (cache / "root_cache" / "cache.tar.gz").write_text("chroot\n")
+    (tmp_path / "out").mkdir()
+
+    executor = LocalExecutor(chroot_cache=chroot_cache)
+    cached_file = executor.get_cache_dir() / "mock" / cache.name
+    cached_file /= "root_cache/cache.tar.gz"
+    executor.run(
+        [f"echo modified >> {cached_file}"],
+        copy_out=[(cached_file, tmp_path / "out")],
+        cache_copy_in=[(cache, executor.get_cache_dir() / "mock")],
+    )
+
+    # The cache is available inside the executor but never modified
+    assert (tmp_path / "out" / "cache.tar.gz").read_text() == (
+        "chroot\nmodified\n"
+    )
+    assert (cache / "root_cache" / "cache.tar.gz").read_text() == "chroot\n"
+    assert not executor._temporary_dir.exists()
+
+
+def test_local_unknown_copy_strategy():
+    with pytest.raises(ExecutorError):
+        LocalExecutor(copy_strategy="unknown")
+
+
+@pytest.mark.parametrize("strategy", ["copy", "reflink", "hardlink", "bind"])
+def test_local_copy_strategy(tmp_path, strategy):
+    repository = tmp_path / "repository"
+    repository.mkdir()
+    (repository / "package.rpm").write_text("package\n")
+    source = tmp_path / "source.txt"
+    source.write_text("source\n")
+    (tmp_path / "out").mkdir()
+
+    executor = LocalExecutor(copy_strategy=strategy, clean=False)
+    build_dir = executor.get_build_dir()
+    repository_dir = executor.get_repository_dir()
+    executor.run(
+        [
+            f"cat {repository_dir}/repository/package.rpm >> {build_dir}/source.txt",
+            f"cp {build_dir}/source.txt {build_dir}/result.txt",
+        ],
+        copy_in=[(repository, repository_dir), (source, build_dir)],
+        copy_out=[(build_dir / "result.txt", tmp_path / "out")],
+    )
+    assert source.read_text() == "source\n"
+    result = tmp_path / "out" / "result.txt"
+    assert result.read_text() == "source\npackage\n"
+    # Only read-only inputs and outputs are linked. With 'bind', inputs
+    # are linked only when they cannot be mounted.
+    if strategy != "bind":
+        assert (repository_dir / "repository" / "package.rpm").samefile(
+            repository / "package.rpm"
+        ) == (strategy == "hardlink")
+    assert result.samefile(build_dir / "result.txt") == (
+        strategy in ("hardlink", "bind")
+    )
+    executor.cleanup()
+
+
+def test_qubes_dispvm_pool(monkeypatch):
+    started = []
+    removed = []
+    lock = threading.Lock()
+
+    def start_dispvm(self):
+        with lock:
+            self.dispvm = f"disp{len(started)}"
+            started.append(self.dispvm)
+
+    monkeypatch.setattr(LinuxQubesExecutor, "start_dispvm", start_dispvm)
+    monkeypatch.setattr(
+        LinuxQubesExecutor, "cleanup", lambda self: removed.append(self.dispvm)
+    )
+
+    pool = DispVMPool("builder-dvm", 2)
+    # Nothing is ready yet, the pool starts filling
+    assert pool.acquire() is None
+    for thread in list(pool._threads):
+        thread.join()
+    assert len(started) == 2
+
+    dispvm = pool.acquire()
+    assert dispvm in started
+    for thread in list(pool._threads):
+        thread.join()
+    assert len(started) == 3
+
+    pool.close()
+    assert dispvm not in removed
+    assert sorted(removed) == sorted(set(started) - {dispvm})
+    assert pool.acquire() is None
+    assert len(started) == 3
+
+
+def test_qubes_dispvm_reaper(monkeypatch):
+    calls = []
+    removing = threading.Event()
+    resume = threading.Event()
+
+    def vm_state(executor, vm):
+        calls.append(("state", vm))
+        if vm == "disp0":
+            removing.set()
+            resume.wait(timeout=5)
+        return "Halted" if vm == "disp2" else "Running"
+
+    monkeypatch.setattr("qubesbuilder.executors.qubes.vm_state", vm_state)
+    monkeypatch.setattr(
+        "qubesbuilder.executors.qubes.kill_vm",
+        lambda executor, vm: calls.append(("kill", vm)),
+    )
+    monkeypatch.setattr(
+        "qubesbuilder.executors.qubes.remove_vm",
+        lambda executor, vm: calls.append(("remove", vm)),
+    )
+
+    executor = LinuxQubesExecutor("builder-dvm")
+    reaper = DispVMReaper()
+    reaper.add(executor, "disp0")
+    assert removing.wait(timeout=5)
+    # Queued while the first qube is being removed
+    reaper.add(executor, "disp1")
+    reaper.add(executor, "disp2")
+    resume.set()
+    reaper.drain()
+    assert calls == [
+        ("state", "disp0"),
+        ("kill", "disp0"),
+        ("state", "disp1"),
+        ("state", "disp2"),
+        ("kill", "disp1"),
+        ("remove", "disp2"),
+    ]
+
+    # Nothing left to remove
+    reaper.drain()
+    assert len(calls) == 6
+
+
+def test_qubes_dispvm_reaper_errors(monkeypatch):
+    calls = []
+
+    def vm_state(executor, vm):
+        if vm == "disp0":
+            raise RuntimeError("unexpected")
+        return "Halted" if vm == "disp2" else "Running"
+
+    def kill_vm(executor, vm):
+        raise OSError("unexpected")
+
+    monkeypatch.setattr("qubesbuilder.executors.qubes.vm_state", vm_state)
+    monkeypatch.setattr("qubesbuilder.executors.qubes.kill_vm", kill_vm)
+    monkeypatch.setattr(
+        "qubesbuilder.executors.qubes.remove_vm",
+        lambda executor, vm: calls.append(("remove", vm)),
+    )
+
+    # Failures are reported per qube, others are still removed
+    executor = LinuxQubesExecutor("builder-dvm")
+    reaper = DispVMReaper()
+    for dispvm in ("disp0", "disp1", "disp2"):
+        reaper.add(executor, dispvm)
+    assert reaper.drain(timeout=5)
+    assert calls == [("remove", "disp2")]
+
+    # A failing batch neither stops later removals nor blocks waiters
+    def remove(batch):
+        raise RuntimeError("unexpected")
+
+    reaper._remove = remove
+    reaper.add(executor, "disp3")
+    assert reaper.drain(timeout=5)
+    del reaper._remove
+    reaper.add(executor, "disp2")
+    assert reaper.drain(timeout=5)
+    assert calls == [("remove", "disp2"), ("remove", "disp2")]
+
+
+def test_qubes_copy_batches():
+    entries = [
+        (Path("/a/plugins"), PurePath("/builder")),
+        (Path("/a/sources"), PurePath("/builder/plugins/x")),
+        (Path("/b/plugins"), PurePath("/builder/y")),
+        (Path("/b/repository"), PurePath("/builder")),
+    ]
+    # Files having the same name cannot be in the same batch, order is kept
+    assert get_batches(entries) == [entries[:2], entries[2:]]
+    assert get_batches([]) == []
+
+
+def test_qubes_copy_out_batch(monkeypatch, tmp_path):
+    calls = []
+
+    def qrexec_call(executor, what, vm, service, args, **kwargs):
+        manifest = json.loads(Path(args[3]).read_text())
+        calls.append((service, manifest))
+        incoming_dir = next(Path(arg) for arg in args if ".copy-out-" in arg)
+        for src in manifest["files"]:
+            if "missing" not in src:
+                (incoming_dir / PurePath(src).name).write_text(src)
+
+    monkeypatch.setattr("qubesbuilder.executors.qubes.qrexec_call", qrexec_call)
+
+    executor = LinuxQubesExecutor("builder-dvm")
+    executor.dispvm = "disp1"
+    (tmp_path / "rpm").mkdir()
+    (tmp_path / "rpm" / "package.rpm").write_text("old")
+    builder_dir = executor.get_builder_dir()
+    executor.copy_out_batch(
+        [
+            (builder_dir / "build/package.rpm", tmp_path / "rpm"),
+            (builder_dir / "build/package.src.rpm", tmp_path / "rpm"),
+            (builder_dir / "build/build.log", tmp_path / "logs"),
+            (builder_dir / "build/missing.log", tmp_path / "logs"),
+        ],
+        no_fail_copy_out_allowed_patterns=["missing"],
+    )
+    # Every file is copied out with a single call
+    assert len(calls) == 1
+    assert calls[0][0] == "qubesbuilder.FileCopyOut+batch"
+    assert (tmp_path / "rpm" / "package.rpm").read_text() == str(
+        builder_dir / "build/package.rpm"
+    )
+    assert (tmp_path / "rpm" / "package.src.rpm").exists()
+    assert (tmp_path / "logs" / "build.log").exists()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["logs", "rpm"]
+
+    with pytest.raises(ExecutorError):
+        executor.copy_out_batch(
+            [(builder_dir / "build/missing.log", tmp_path / "logs")]
+        )
+
+    # Already compressed files are transferred without compression
+    calls.clear()
+    executor = LinuxQubesExecutor("builder-dvm", compression_level=3)
+    executor.dispvm = "disp1"
+    executor.copy_out_batch(
+        [
+            (builder_dir / "build/package.rpm", tmp_path / "rpm"),
+            (builder_dir / "build/build.log", tmp_path / "logs"),
+        ]
+    )
+    assert [manifest["compression"] for _, manifest in calls] == [
+        None,
+        {"level": 3, "threads": 0},
+    ]
+
+    # Holes of images are kept during the transfer
+    calls.clear()
+    executor.copy_out_batch(
+        [(builder_dir / "build/root.img", tmp_path / "qubeized_images")],
+        dig_holes=True,
+    )
+    assert calls[0][1]["sparse"]
+    assert (tmp_path / "qubeized_images" / "root.img").exists()
+
+
+def get_tar_stream(members):
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        for info, content in members:
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    archive.seek(0)
+    return archive
+
+
+def test_qubes_unpack_archive(tmp_path):
+    directory = tarfile.TarInfo("build")
+    directory.type = tarfile.DIRTYPE
+    script = tarfile.TarInfo("build/script")
+    script.mode = 0o4777
+    script.uid = 1234
+    archive = get_tar_stream([(directory, b""), (script, b"script")])
+    unpack_archive(archive, tmp_path, max_size=6)
+    assert (tmp_path / "build" / "script").read_bytes() == b"script"
+    assert (tmp_path / "build" / "script").stat().st_mode & 0o7777 == 0o755
+    assert (tmp_path / "build" / "script").stat().st_uid == os.getuid()
+
+    # The same file is received by the script run by the copy-out call
+    archive.seek(0)
+    unpack_cmd = [sys.executable, "-I", unpack.__file__]
+    subprocess.run(
+        unpack_cmd + [str(tmp_path / "script"), "6"],
+        input=archive.read(),
+        check=True,
+    )
+    assert (tmp_path / "script" / "build" / "script").exists()
+    archive.seek(0)
+    result = subprocess.run(
+        unpack_cmd + [str(tmp_path / "limit"), "5"],
+        input=archive.read(),
+        capture_output=True,
+    )
+    assert result.returncode == 1
+    assert b"Refusing more than 5 bytes" in result.stderr
+
+
+@pytest.mark.parametrize(
+    "name, member_type, linkname",
+    [
+        ("../outside", tarfile.REGTYPE, ""),
+        ("/outside", tarfile.REGTYPE, ""),
+        ("link", tarfile.SYMTYPE, "file"),
+        ("link", tarfile.LNKTYPE, "file"),
+        ("fifo", tarfile.FIFOTYPE, ""),
+        ("device", tarfile.CHRTYPE, ""),
+    ],
+)
+def test_qubes_unpack_archive_refused(tmp_path, name, member_type, linkname):
+    (tmp_path / "out").mkdir()
+    member = tarfile.TarInfo(name)
+    member.type = member_type
+    member.linkname = linkname
+    archive = get_tar_stream([(tarfile.TarInfo("file"), b""), (member, b"")])
+    with pytest.raises(tarfile.TarError):
+        unpack_archive(archive, tmp_path / "out", max_size=1024)
+    assert sorted(os.listdir(tmp_path)) == ["out"]
+    assert os.listdir(tmp_path / "out") == ["file"]
+
+
+def test_qubes_unpack_archive_sparse(tmp_path):
+    image = tmp_path / "root.img"
+    with open(image, "wb") as f:
+        f.truncate(64 * 1024**2)
+        f.seek(32 * 1024**2)
+        f.write(b"data")
+    archive = subprocess.run(
+        ["tar", "-c", "-f", "-", "--sparse", "-C", str(tmp_path), "root.img"],
+        capture_output=True,
+        check=True,
+    ).stdout
+    # Only data is counted against the limit and holes are kept
+    (tmp_path / "out").mkdir()
+    unpack_archive(io.BytesIO(archive), tmp_path / "out", max_size=1024**2)
+    received = tmp_path / "out" / "root.img"
+    assert received.read_bytes() == image.read_bytes()
+    assert received.stat().st_blocks * 512 < 1024**2
+
+
 def test_qubes_clean_on_error():
     executor = LinuxQubesExecutor(
         os.environ.get("QUBES_EXECUTOR_DISPVM", "builder-dvm")
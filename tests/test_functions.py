@@ -10,6 +10,9 @@ from qubesbuilder.common import (
     sed,
     get_archive_name,
 )
+from qubesbuilder.plugins.build import get_package_digest
+from qubesbuilder.plugins.build_deb import get_build_depends
+from qubesbuilder.plugins.build_rpm import get_installed_packages_filter
 
 
 def test_filename():
@@ -326,3 +329,76 @@ def test_get_archive_name_git_url():
     }
     fn = get_archive_name(file)
     assert fn == "repo-2.0.0.tar"
+
+
+def _rpm_with_signature(signature: bytes, content: bytes) -> bytes:
+    lead = b"\xed\xab\xee\xdb" + b"\0" * 92
+    # Signature header with one index entry, padded to 8 bytes
+    header = b"\x8e\xad\xe8\x01" + b"\0" * 4 + (1).to_bytes(4, "big")
+    header += len(signature).to_bytes(4, "big") + b"\0" * 16 + signature
+    return lead + header + b"\0" * ((8 - len(header) % 8) % 8) + content
+
+
+def test_get_package_digest(tmp_path):
+    unsigned = tmp_path / "unsigned" / "package-1.0-1.fc42.x86_64.rpm"
+    signed = tmp_path / "signed" / "package-1.0-1.fc42.x86_64.rpm"
+    other = tmp_path / "other" / "package-1.0-1.fc42.x86_64.rpm"
+    for path, signature, content in [
+        (unsigned, b"sha256", b"header and payload"),
+        (signed, b"sha256 and gpg signature", b"header and payload"),
+        (other, b"sha256", b"other header and payload"),
+    ]:
+        path.parent.mkdir()
+        path.write_bytes(_rpm_with_signature(signature, content))
+    # Signing a package does not change its digest, its content does
+    assert get_package_digest(unsigned) == get_package_digest(signed)
+    assert get_package_digest(unsigned) != get_package_digest(other)
+
+    deb = tmp_path / "package_1.0-1_amd64.deb"
+    deb.write_bytes(b"deb")
+    digest = get_package_digest(deb)
+    deb.write_bytes(b"new deb")
+    assert get_package_digest(deb) != digest
+
+
+def test_get_build_depends(tmp_path):
+    dsc = tmp_path / "package_1.0-1.dsc"
+    dsc.write_text(
+        """-----BEGIN PGP SIGNED MESSAGE-----
+Hash: SHA512
+
+Format: 3.0 (quilt)
+Source: qubes-core-qubesdb
+Build-Depends: debhelper (>= 9), libvchan-xen-dev,
+ python3-dev | python-dev, libsystemd-dev [linux-any],
+ dh-python <!nopython>, pkg-config:native
+Build-Depends-Indep: python3-sphinx
+Checksums-Sha256:
+ 0123 42 qubes-core-qubesdb_1.0.orig.tar.gz
+"""
+    )
+    assert get_build_depends(dsc) == [
+        "debhelper",
+        "libvchan-xen-dev",
+        "python3-dev",
+        "python-dev",
+        "libsystemd-dev",
+        "dh-python",
+        "pkg-config",
+        "python3-sphinx",
+    ]
+
+
+def test_get_installed_packages_filter(tmp_path):
+    log = tmp_path / "installed_pkgs.log"
+    assert get_installed_packages_filter(log) is None
+    log.write_text(
+        "qubes-libvchan-xen-4.2.3-1.fc42.x86_64 1700000000 1234\n"
+        "bash-5.2.26-3.fc42.x86_64 1700000000 1234\n"
+        "xen-libs-2001:4.19.1-1.fc42.x86_64 1700000000 1234\n"
+    )
+    is_installed = get_installed_packages_filter(log)
+    assert is_installed("xen-libs-4.19.1-1.fc42.x86_64.rpm")
+    assert is_installed("qubes-libvchan-xen-4.2.3-1.fc42.x86_64.rpm")
+    assert not is_installed("qubes-libvchan-xen-devel-4.2.3-1.fc42.x86_64.rpm")
+    assert not log.exists()
@@ -1,5 +1,8 @@
+import hashlib
+import json
 import os
 import shutil
+import subprocess
 import tempfile
 from pathlib import Path
 
@@ -11,8 +14,9 @@ from qubesbuilder.config import Config
 from qubesbuilder.distribution import QubesDistribution
 from qubesbuilder.exc import ComponentError, DistributionError, ConfigError
 from qubesbuilder.executors.container import ContainerExecutor
-from qubesbuilder.pluginmanager import PluginManager
+from qubesbuilder.pluginmanager import PluginEntity, PluginManager
 from qubesbuilder.plugins import DistributionComponentPlugin
+from qubesbuilder.plugins.chroot import ChrootPlugin
 from qubesbuilder.template import QubesTemplate, TemplateError
 
 
@@ -239,6 +243,287 @@ vm:
         assert not plugin.has_component_packages(stage="prep")
 
 
+def _create_source_tree(source_dir):
+    (source_dir / "sub" / "deeper").mkdir(parents=True)
+    (source_dir / ".git").mkdir()
+    (source_dir / ".git" / "HEAD").write_text("ref: refs/heads/main")
+    (source_dir / ".gitignore").write_text("*.o\n")
+    (source_dir / "version").write_text("1.2.3")
+    (source_dir / "Makefile").write_text("all:\n")
+    (source_dir / "main.o").write_bytes(b"\0" * 10)
+    (source_dir / "sub" / "file.c").write_text("int main;\n")
+    (source_dir / "sub" / "deeper" / "data").write_bytes(os.urandom(10000))
+
+
+def _get_reference_source_hash(source_dir):
+    # Digest of the whole tree computed without any cache
+    component = QubesComponent(source_dir)
+    return component._update_hash_from_dir(
+        source_dir, hashlib.sha512()
+    ).hexdigest()
+
+
+def test_component_source_hash_cache(tmp_path):
+    source_dir = tmp_path / "component"
+    cache = tmp_path / "cache" / "component.json"
+    _create_source_tree(source_dir)
+
+    component = QubesComponent(source_dir, source_hash_cache=cache)
+    source_hash = component.get_source_hash()
+    assert source_hash == _get_reference_source_hash(source_dir)
+    assert cache.exists()
+
+    # Unchanged files are not read again: the cached digest is used
+    signature = json.loads(cache.read_text())["signature"]
+    cache.write_text(json.dumps({"signature": signature, "hash": "cached"}))
+    component = QubesComponent(source_dir, source_hash_cache=cache)
+    assert component.get_source_hash() == "cached"
+
+    # Any change is detected
+    (source_dir / "sub" / "file.c").write_text("int main();\n")
+    new_hash = component.get_source_hash()
+    assert new_hash == _get_reference_source_hash(source_dir)
+    assert new_hash != source_hash
+
+    (source_dir / "sub" / "new").write_text("")
+    assert component.get_source_hash() != new_hash
+
+    # Ignored files do not change the digest
+    (source_dir / "other.o").write_text("")
+    assert component.get_source_hash() == _get_reference_source_hash(
+        source_dir
+    )
+
+
+def test_component_source_hash_gitignore(tmp_path, monkeypatch):
+    source_dir = tmp_path / "component"
+    for path in [
+        "main.o",
+        "keep.o",
+        "local.tmp",
+        "pkgs/package.rpm",
+        "src/main.c",
+        "src/build.log",
+        "src/gen/generated.c",
+        "src/pkgs/file",
+        "doc/figure.o",
+    ]:
+        (source_dir / path).parent.mkdir(parents=True, exist_ok=True)
+        (source_dir / path).write_text(path)
+    (source_dir / ".git" / "info").mkdir(parents=True)
+    (source_dir / ".git" / "info" / "exclude").write_text("*.tmp\n")
+    (source_dir / ".gitignore").write_text("*.o\n!keep.o\n/pkgs/\n")
+    (source_dir / "src" / ".gitignore").write_text("gen/\n*.log\n")
+    (source_dir / "doc" / ".gitignore").write_text("!figure.o\n")
+
+    scanned = []
+    scandir = os.scandir
+
+    def _scandir(path):
+        scanned.append(os.path.relpath(path, source_dir))
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", _scandir)
+    component = QubesComponent(source_dir)
+    walked = [
+        os.path.relpath(path, source_dir)
+        for path, _, _ in component._walk_source_dir(source_dir)
+    ]
+    assert walked == [
+        ".gitignore",
+        "doc",
+        "doc/.gitignore",
+        "doc/figure.o",
+        "keep.o",
+        "src",
+        "src/.gitignore",
+        "src/main.c",
+        "src/pkgs",
+        "src/pkgs/file",
+    ]
+    # Ignored directories are not even listed
+    assert sorted(scanned) == [".", "doc", "src", "src/pkgs"]
+
+    source_hash = component.get_source_hash()
+    (source_dir / "src" / "gen" / "generated.c").write_text("changed")
+    (source_dir / "pkgs" / "other.rpm").write_text("")
+    assert component.get_source_hash() == source_hash
+
+
+def test_component_source_hash_git(tmp_path):
+    source_dir = tmp_path / "component"
+    _create_source_tree(source_dir)
+    shutil.rmtree(source_dir / ".git")
+
+    # Not a git checkout: fallback to walking the tree
+    component = QubesComponent(source_dir, source_hash_mode="git")
+    assert component.get_source_hash() == _get_reference_source_hash(
+        source_dir
+    )
+
+    def git(*args):
+        subprocess.run(
+            [
+                "git",
+                "-C",
+                str(source_dir),
+                "-c",
+                "user.name=test",
+                "-c",
+                "user.email=test@localhost",
+                *args,
+            ],
+            check=True,
+            capture_output=True,
+        )
+
+    git("init", "-q")
+    git("add", ".")
+    git("commit", "-q", "-m", "init")
+    clean_hash = component.get_source_hash()
+    assert clean_hash != _get_reference_source_hash(source_dir)
+
+    # Ignored files do not change the fingerprint
+    (source_dir / "other.o").write_text("")
+    assert component.get_source_hash() == clean_hash
+
+    # Modified and untracked files do
+    (source_dir / "Makefile").write_text("all: build\n")
+    modified_hash = component.get_source_hash()
+    assert modified_hash != clean_hash
+    (source_dir / "sub" / "new").write_text("")
+    assert component.get_source_hash() not in (clean_hash, modified_hash)
+
+    # Committing does not change the content of the tree
+    git("add", ".")
+    untracked_hash = component.get_source_hash()
+    git("commit", "-q", "-m", "update")
+    assert component.get_source_hash() == untracked_hash
+
+    (source_dir / "sub" / "new").unlink()
+    (source_dir / "Makefile").write_text("all:\n")
+    git("commit", "-q", "-a", "-m", "revert")
+    assert component.get_source_hash() == clean_hash
+
+    # Not its own checkout but in an enclosing one: walk the tree
+    outer_dir = tmp_path / "outer"
+    source_dir = outer_dir / "component"
+    _create_source_tree(source_dir)
+    shutil.rmtree(source_dir / ".git")
+    (outer_dir / ".gitignore").write_text("component/\n")
+    subprocess.run(["git", "-C", str(outer_dir), "init", "-q"], check=True)
+    component = QubesComponent(source_dir, source_hash_mode="git")
+    assert component.get_source_hash() == _get_reference_source_hash(
+        source_dir
+    )
+
+
+def test_component_source_hash_parallel(tmp_path):
+    source_dir = tmp_path / "component"
+    cache = tmp_path / "cache" / "component.json"
+    _create_source_tree(source_dir)
+    (source_dir / "big").write_bytes(os.urandom(3 * 1024 * 1024 + 1))
+
+    component = QubesComponent(
+        source_dir, source_hash_cache=cache, source_hash_mode="parallel"
+    )
+    source_hash = component.get_source_hash()
+    # Digests of files are combined instead of their content
+    assert source_hash != _get_reference_source_hash(source_dir)
+    assert set(json.loads(cache.read_text())["files"]) == {
+        ".gitignore",
+        "version",
+        "Makefile",
+        "big",
+        "sub/file.c",
+        "sub/deeper/data",
+    }
+
+    # The result does not depend on the cache
+    assert (
+        QubesComponent(
+            source_dir, source_hash_mode="parallel"
+        ).get_source_hash()
+        == source_hash
+    )
+
+    # Only files whose metadata changed are hashed again
+    content = json.loads(cache.read_text())
+    content["signature"] = "outdated"
+    for stat in content["files"].values():
+        stat[-1] = "cached"
+    cache.write_text(json.dumps(content))
+    (source_dir / "sub" / "file.c").write_text("int main();\n")
+    component = QubesComponent(
+        source_dir, source_hash_cache=cache, source_hash_mode="parallel"
+    )
+    component.get_source_hash()
+    digests = {
+        path: stat[-1]
+        for path, stat in json.loads(cache.read_text())["files"].items()
+    }
+    assert digests.pop("sub/file.c") != "cached"
+    assert set(digests.values()) == {"cached"}
+
+    # Switching mode does not reuse the digest of the other mode
+    component = QubesComponent(source_dir, source_hash_cache=cache)
+    assert component.get_source_hash() == _get_reference_source_hash(
+        source_dir
+    )
+
+
+def test_component_source_hash_incremental(tmp_path, monkeypatch):
+    source_dir = tmp_path / "component"
+    for i in range(20):
+        (source_dir / f"dir{i}").mkdir(parents=True)
+        for j in range(20):
+            (source_dir / f"dir{i}" / f"file{j}").write_bytes(os.urandom(64))
+
+    read = []
+    update_hash_from_file = QubesComponent._update_hash_from_file
+
+    def _update_hash_from_file(path, source_hash):
+        read.append(Path(path))
+        return update_hash_from_file(path, source_hash)
+
+    monkeypatch.setattr(
+        QubesComponent,
+        "_update_hash_from_file",
+        staticmethod(_update_hash_from_file),
+    )
+
+    hashes = {}
+    for mode in ("walk", "parallel"):
+        component = QubesComponent(
+            source_dir,
+            source_hash_cache=tmp_path / f"{mode}.json",
+            source_hash_mode=mode,
+        )
+        hashes[mode] = component.get_source_hash()
+        assert len(read) == 400
+        read.clear()
+        # Unchanged files are not read again
+        assert component.get_source_hash() == hashes[mode]
+        assert read == []
+
+    (source_dir / "dir12" / "file12").write_bytes(os.urandom(64))
+    component = QubesComponent(
+        source_dir,
+        source_hash_cache=tmp_path / "parallel.json",
+        source_hash_mode="parallel",
+    )
+    incremental_hash = component.get_source_hash()
+    # Only the modified file is read again
+    assert read == [source_dir / "dir12" / "file12"]
+    assert incremental_hash != hashes["parallel"]
+    assert (
+        QubesComponent(
+            source_dir, source_hash_mode="parallel"
+        ).get_source_hash()
+        == incremental_hash
+    )
+
+
 #
 # QubesDistribution
 #
@@ -311,6 +596,37 @@ def test_dist_family():
     assert not QubesDistribution("host-centos-stream9").is_deb()
 
 
+def test_dist_chroot_cache_update(tmp_path):
+    config_file = tmp_path / "builder.yml"
+    config_file.write_text(
+        "cache:\n  vm-fc42:\n    packages: [a, b]\n    max-age-days: 7\n"
+    )
+    plugin = ChrootPlugin(
+        dist=QubesDistribution("vm-fc42"),
+        config=Config(config_file),
+        stage="init-cache",
+    )
+    packages = ["a", "b", "c"]
+    assert plugin.get_cache_update({}, packages, False) == ("create", packages)
+
+    info = plugin.get_cache_info({}, "create", ["a", "b"])
+    assert plugin.get_cache_update(info, ["b", "a"], False)[0] == "reuse"
+    assert plugin.get_cache_update(info, packages, False) == ("update", ["c"])
+    assert plugin.get_cache_update(info, ["a"], False) == ("reset", ["a"])
+    assert plugin.get_cache_update(info, ["a", "b"], True)[0] == "create"
+
+    # Creation time is kept on updates
+    info["timestamp"] = "202001010000"
+    assert plugin.get_cache_info(info, "update", packages) == {
+        "packages": packages,
+        "timestamp": "202001010000",
+    }
+    assert plugin.get_cache_update(info, ["a", "b"], False)[0] == "create"
+    assert plugin.get_cache_info(info, "create", packages)["timestamp"] > (
+        "202001010000"
+    )
+
+
 #
 # QubesTemplate
 #
@@ -595,9 +911,25 @@ def test_config_distributions_filter():
             "vm-fc40",
             "host-fc37",
         ]
+        # Configuration order is kept
+        assert [
+            d.distribution
+            for d in config.get_distributions(["host-fc37", "vm-fc40"])
+        ] == [
+            "vm-fc40",
+            "host-fc37",
+        ]
         with pytest.raises(ConfigError):
             config.get_distributions(["vm-fc42"])
 
+        # Distributions are looked up in the new value once set
+        config.set("distributions", ["vm-fc42"])
+        assert [
+            d.distribution for d in config.get_distributions(["vm-fc42"])
+        ] == ["vm-fc42"]
+        with pytest.raises(ConfigError):
+            config.get_distributions(["vm-fc40"])
+
 
 def test_config_templates_filter():
     with tempfile.NamedTemporaryFile("w") as config_file:
@@ -633,9 +965,25 @@ def test_config_templates_filter():
             "fedora-40-xfce",
             "debian-11",
         ]
+        # Requested order is kept
+        assert [
+            t.name
+            for t in config.get_templates(["debian-11", "fedora-40-xfce"])
+        ] == [
+            "debian-11",
+            "fedora-40-xfce",
+        ]
         with pytest.raises(ConfigError):
             config.get_templates(["fedora-42"])
 
+        # Templates are looked up in the new value once set
+        config.set("templates", [{"fedora-42": {"dist": "fc42"}}])
+        assert [t.name for t in config.get_templates(["fedora-42"])] == [
+            "fedora-42"
+        ]
+        with pytest.raises(ConfigError):
+            config.get_templates(["debian-11"])
+
 
 def test_config_options():
     with tempfile.NamedTemporaryFile("w") as config_file:
@@ -849,6 +1197,39 @@ executor:
             assert isinstance(executor, ContainerExecutor)
 
 
+def test_config_jobs_executor_lazy(temp_config_dir):
+    config_file = temp_config_dir / "builder.yml"
+    config_file.write_text(
+        """
+distributions:
+  - vm-fc42
+
+components:
+  - core-qrexec
+
+executor:
+  type: docker
+  options:
+    image: "qubes-builder-fedora:latest"
+"""
+    )
+    config = Config(config_file)
+    jobs = config.get_jobs(
+        components=config.get_components(),
+        distributions=config.get_distributions(),
+        templates=[],
+        stages=["fetch", "upload"],
+    )
+    # Planning jobs does not create executors
+    assert jobs
+    assert all(job._executor is None for job in jobs)
+
+    # Neither does creating it: the container client is reached on run
+    executor = jobs[0].executor
+    assert isinstance(executor, ContainerExecutor)
+    assert jobs[0].executor is executor
+
+
 CONFIG_WITH_PER_DIST_COMPONENT_STAGES = """
 executor:
   type: qubes
@@ -978,6 +1359,24 @@ def test_config_executor():
                 },
             }
 
+            # Resolved options are cached until configuration changes
+            build_options["type"] = "local"
+            build_options["options"]["image"] = "debian:latest"
+            assert config.get_executor_options_from_config(
+                "build", plugin
+            ) == {
+                "type": "docker",
+                "options": {
+                    "clean": False,
+                    "dispvm": "qubes-builder-debian-dvm",
+                    "image": "fedora:latest",
+                },
+            }
+            config.set("executor", {"type": "local"})
+            assert config.get_executor_options_from_config(
+                "fetch", plugin
+            ) == {"type": "local"}
+
 
 def test_config_executor_include_dist_no_dict():
     with (
@@ -1120,6 +1519,56 @@ def test_config_executor_include_dist_dict():
             }
 
 
+def test_config_job_resources():
+    with tempfile.NamedTemporaryFile("w") as config_file:
+        config_file.write(
+            """
+executor:
+  type: qubes
+  options:
+    dispvm: "@dispvm"
+    max-concurrent: 4
+
+concurrency:
+  stages:
+    build: 2
+  resources:
+    memory: 64
+
+distributions:
+  - vm-fc42
+
+components:
+  - linux-kernel:
+      weights:
+        memory: 16
+  - core-qrexec
+"""
+        )
+        config_file.flush()
+        config = Config(config_file.name)
+
+        dist = config.get_distributions()[0]
+        kernel, qrexec = config.get_components()
+
+        class Job:
+            def __init__(self, component, stage):
+                self.component = component
+                self.dist = dist
+                self.stage = stage
+
+        assert config.get_job_resources(Job(kernel, "build")) == [
+            ("executor:qubes", 1, 4),
+            ("stage:build", 1, 2),
+            ("resource:memory", 16, 64),
+        ]
+        assert config.get_job_resources(Job(qrexec, "publish")) == [
+            ("executor:qubes", 1, 4),
+            ("resource:memory", 1, 64),
+            ("repository:rpm", 1, 1),
+        ]
+
+
 def test_config_path_from_config_with_dot_slash(config, temp_config_dir):
     config_path_str = "./relative/path"
     result = config.get_absolute_path_from_config(config_path_str)
@@ -1153,3 +1602,94 @@ def test_config_path_from_config_with_home_relative_path(config):
     result = config.get_absolute_path_from_config(config_path_str)
     expected = Path(config_path_str).expanduser().resolve()
     assert result == expected
+
+
+def test_config_plugin_manager_cached(config, temp_config_dir):
+    manager = config.get_plugin_manager()
+    assert config.get_plugin_manager() is manager
+
+    # Changing plugins directories reloads plugins
+    plugins_dir = temp_config_dir / "plugins"
+    config.set("plugins-dirs", [str(plugins_dir)])
+    new_manager = config.get_plugin_manager()
+    assert new_manager is not manager
+    assert config.get_plugin_manager() is new_manager
+
+    # Same when a plugins directory appears, e.g. a fetched plugin component
+    plugins_dir.mkdir()
+    assert config.get_plugin_manager() is not new_manager
+
+
+def _get_jobs_plugins_loads(
+    temp_config_dir, monkeypatch, count, incremental=False
+):
+    managers = []
+    entities = []
+
+    class CountingPluginManager(PluginManager):
+        def __init__(self, *args, **kwargs):
+            managers.append(self)
+            super().__init__(*args, **kwargs)
+
+    entity_init = PluginEntity.__init__
+
+    def counting_entity_init(self, path):
+        entities.append(path)
+        entity_init(self, path)
+
+    monkeypatch.setattr(
+        "qubesbuilder.config.PluginManager", CountingPluginManager
+    )
+    monkeypatch.setattr(PluginEntity, "__init__", counting_entity_init)
+
+    config_file = temp_config_dir / f"config-{count}.yml"
+    components = "\n".join(f"  - component-{i}" for i in range(count))
+    config_file.write_text(
+        f"""
+distributions:
+  - host-fc42
+  - vm-fc42
+  - vm-trixie
+
+components:
+{components}
+
+executor:
+  type: local
+"""
+    )
+    config = Config(config_file)
+    if incremental:
+        # Like parallel package stages, plan jobs component by component
+        jobs_by_ref = {}
+        jobs = []
+        for component in config.get_components():
+            jobs += config.get_jobs_graph(
+                components=[component],
+                distributions=config.get_distributions(),
+                templates=[],
+                stages=["fetch", "upload"],
+                jobs_by_ref=jobs_by_ref,
+            )
+    else:
+        jobs = config.get_jobs(
+            components=config.get_components(),
+            distributions=config.get_distributions(),
+            templates=[],
+            stages=["fetch", "upload"],
+        )
+    assert len(jobs) == count + 3
+    return len(managers), len(entities)
+
+
+def test_config_get_jobs_plugins_loaded_once(temp_config_dir, monkeypatch):
+    # Plugins are loaded once per configuration, whatever the number of
+    # jobs and the number of times jobs are collected.
+    small = _get_jobs_plugins_loads(temp_config_dir, monkeypatch, 20)
+    large = _get_jobs_plugins_loads(temp_config_dir, monkeypatch, 200)
+    large_incremental = _get_jobs_plugins_loads(
+        temp_config_dir, monkeypatch, 200, incremental=True
+    )
+    assert small[0] == large[0] == large_incremental[0] == 1
+    assert small[1] > 0
+    assert small[1] == large[1] == large_incremental[1]
@@ -0,0 +1,306 @@
+import threading
+import time
+
+import pytest
+
+from qubesbuilder.exc import QubesBuilderError
+from qubesbuilder.scheduler import (
+    JobResource,
+    JobScheduler,
+    JobsHistory,
+    JOB_FAILED,
+    JOB_SKIPPED,
+    JOB_SUCCEEDED,
+)
+
+
+class DummyJob:
+    def __init__(self, name, events, barrier=None, fail=False, delay=0):
+        self.name = name
+        self.stage = "build"
+        self.events = events
+        self.barrier = barrier
+        self.fail = fail
+        self.delay = delay
+
+    def run(self, **kwargs):
+        self.events.append(("start", self.name))
+        if self.barrier:
+            self.barrier.wait(timeout=5)
+        time.sleep(self.delay)
+        if self.fail:
+            raise QubesBuilderError(f"{self.name} failed")
+        self.events.append(("end", self.name))
+
+
+def get_status(scheduler):
+    return {r.job.name: r.status for r in scheduler.results}
+
+
+def test_scheduler_sequential():
+    events = []
+    a = DummyJob("a", events)
+    b = DummyJob("b", events)
+    c = DummyJob("c", events)
+    scheduler = JobScheduler({a: [], b: [a], c: [b]}, jobs=1)
+    scheduler.run()
+    assert [name for event, name in events if event == "end"] == [
+        "a",
+        "b",
+        "c",
+    ]
+
+
+def test_scheduler_sequential_stops_on_error():
+    events = []
+    a = DummyJob("a", events, fail=True)
+    b = DummyJob("b", events)
+    scheduler = JobScheduler({a: [], b: []}, jobs=1)
+    with pytest.raises(QubesBuilderError, match="a failed"):
+        scheduler.run()
+    assert ("start", "b") not in events
+    assert get_status(scheduler) == {"a": JOB_FAILED}
+
+
+def test_scheduler_sequential_error_reported(tmp_path, monkeypatch):
+    events = []
+    a = DummyJob("a", events)
+    b = DummyJob("b", events, fail=True)
+    history = JobsHistory(tmp_path / "jobs-history.yml")
+    scheduler = JobScheduler({a: [], b: [a]}, jobs=1, history=history)
+    reported = []
+    monkeypatch.setattr(scheduler, "report", lambda: reported.append(True))
+    with pytest.raises(QubesBuilderError, match="b failed"):
+        scheduler.run()
+    assert get_status(scheduler) == {"a": JOB_SUCCEEDED, "b": JOB_FAILED}
+    assert reported
+    assert JobsHistory(tmp_path / "jobs-history.yml").get(a) is not None
+
+
+def test_scheduler_parallel():
+    events = []
+    barrier = threading.Barrier(2)
+    a = DummyJob("a", events, barrier=barrier)
+    b = DummyJob("b", events, barrier=barrier)
+    c = DummyJob("c", events)
+    scheduler = JobScheduler({a: [], b: [], c: [a, b]}, jobs=2)
+    scheduler.run()
+    # 'a' and 'b' can only pass the barrier if they run concurrently
+    assert get_status(scheduler) == {
+        "a": JOB_SUCCEEDED,
+        "b": JOB_SUCCEEDED,
+        "c": JOB_SUCCEEDED,
+    }
+    assert events.index(("start", "c")) > events.index(("end", "a"))
+    assert events.index(("start", "c")) > events.index(("end", "b"))
+
+
+def test_scheduler_parallel_failure_isolated():
+    events = []
+    a = DummyJob("a", events, fail=True)
+    b = DummyJob("b", events, delay=0.1)
+    c = DummyJob("c", events)
+    d = DummyJob("d", events)
+    scheduler = JobScheduler({a: [], b: [], c: [a], d: [c]}, jobs=2)
+    with pytest.raises(QubesBuilderError, match="a failed"):
+        scheduler.run()
+    assert get_status(scheduler) == {
+        "a": JOB_FAILED,
+        "b": JOB_SUCCEEDED,
+        "c": JOB_SKIPPED,
+        "d": JOB_SKIPPED,
+    }
+    assert ("start", "c") not in events
+    assert ("start", "d") not in events
+
+
+def test_scheduler_parallel_resources():
+    events = []
+    a = DummyJob("a", events, delay=0.1)
+    b = DummyJob("b", events, delay=0.1)
+    c = DummyJob("c", events, delay=0.1)
+
+    def get_job_resources(job):
+        if job in (a, b):
+            return [JobResource("executor:qubes", 1, 1)]
+        return []
+
+    scheduler = JobScheduler(
+        {a: [], b: [], c: []}, jobs=3, get_job_resources=get_job_resources
+    )
+    scheduler.run()
+    # 'a' and 'b' share a resource with a capacity of one
+    first, second = sorted(
+        [a.name, b.name], key=lambda n: events.index(("start", n))
+    )
+    assert events.index(("start", second)) > events.index(("end", first))
+    # 'c' does not need to wait
+    assert events.index(("start", "c")) < events.index(("end", first))
+
+
+def test_scheduler_parallel_resources_over_capacity():
+    events = []
+    a = DummyJob("a", events)
+    scheduler = JobScheduler(
+        {a: []},
+        jobs=2,
+        get_job_resources=lambda job: [JobResource("resource:memory", 8, 4)],
+    )
+    scheduler.run()
+    assert get_status(scheduler) == {"a": JOB_SUCCEEDED}
+
+
+def test_scheduler_history(tmp_path):
+    events = []
+    a = DummyJob("a", events, delay=0.1)
+    b = DummyJob("b", events)
+    history = JobsHistory(tmp_path / "jobs-history.yml")
+    scheduler = JobScheduler({a: [], b: [a]}, jobs=2, history=history)
+    scheduler.run()
+
+    history = JobsHistory(tmp_path / "jobs-history.yml")
+    assert history.get(a) >= 0.1
+    assert history.get(b) is not None
+
+
+def test_scheduler_critical_path_first(tmp_path):
+    events = []
+    short = DummyJob("short", events)
+    long = DummyJob("long", events)
+    long_child = DummyJob("long_child", events)
+    unknown = DummyJob("unknown", events)
+    # Jobs are only identified by their stage here
+    short.stage = "short"
+    long.stage = "long"
+    long_child.stage = "long_child"
+    unknown.stage = "unknown"
+
+    history_file = tmp_path / "jobs-history.yml"
+    history_file.write_text("short: 10\nlong: 100\nlong_child: 50\n")
+    scheduler = JobScheduler(
+        {short: [], long: [], long_child: [long], unknown: []},
+        jobs=2,
+        # Run one job at a time to check the order
+        get_job_resources=lambda job: [JobResource("test", 1, 1)],
+        history=JobsHistory(history_file),
+    )
+    priorities = scheduler.get_priorities()
+    assert priorities[long] == 150
+    assert priorities[long_child] == 50
+    assert priorities[short] == 10
+    # average of known durations
+    assert priorities[unknown] == pytest.approx(160 / 3)
+
+    scheduler.run()
+    started = [name for event, name in events if event == "start"]
+    assert started == ["long", "unknown", "long_child", "short"]
+
+
+def test_scheduler_add_jobs_priorities(tmp_path, monkeypatch):
+    events = []
+    a = DummyJob("a", events)
+    b = DummyJob("b", events)
+    other = DummyJob("other", events)
+    new = DummyJob("new", events)
+    for job in (a, b, other, new):
+        job.stage = job.name
+    history_file = tmp_path / "jobs-history.yml"
+    history_file.write_text("a: 10\nb: 20\nother: 30\nnew: 40\n")
+    scheduler = JobScheduler(
+        {a: [], b: [a], other: []},
+        jobs=2,
+        history=JobsHistory(history_file),
+    )
+    assert scheduler.get_priorities() == {a: 30, b: 20, other: 30}
+
+    # Only new jobs and the ones they depend on are updated
+    updated = []
+    get_priority = scheduler._get_priority
+    monkeypatch.setattr(
+        scheduler,
+        "_get_priority",
+        lambda job: updated.append(job.name) or get_priority(job),
+    )
+    scheduler.add_jobs({new: [b]})
+    assert updated == ["new", "b", "a"]
+    assert scheduler.get_priorities() == {a: 70, b: 60, other: 30, new: 40}
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_scheduler_add_jobs_when_done(jobs):
+    events = []
+    fetch_a = DummyJob("fetch_a", events)
+    fetch_b = DummyJob("fetch_b", events, delay=0.2)
+    build_a = DummyJob("build_a", events)
+    build_b = DummyJob("build_b", events)
+
+    def on_job_done(job):
+        if job is fetch_a:
+            return {build_a: [fetch_a]}
+        if job is fetch_b:
+            return {build_b: [fetch_b, build_a]}
+        return {}
+
+    scheduler = JobScheduler(
+        {fetch_a: [], fetch_b: []}, jobs=jobs, on_job_done=on_job_done
+    )
+    scheduler.run()
+    assert set(get_status(scheduler).values()) == {JOB_SUCCEEDED}
+    assert len(scheduler.results) == 4
+    assert events.index(("start", "build_b")) > events.index(("end", "build_a"))
+    if jobs > 1:
+        # 'build_a' does not wait for the slow 'fetch_b'
+        assert events.index(("end", "build_a")) < events.index(
+            ("end", "fetch_b")
+        )
+
+
+def test_scheduler_add_jobs_depending_on_failed_job():
+    events = []
+    a = DummyJob("a", events, fail=True, delay=0.1)
+    b = DummyJob("b", events)
+    c = DummyJob("c", events)
+    scheduler = JobScheduler(
+        {a: [], b: []},
+        jobs=2,
+        on_job_done=lambda job: {c: [a, b]} if job is b else {},
+    )
+    with pytest.raises(QubesBuilderError, match="a failed"):
+        scheduler.run()
+    assert get_status(scheduler) == {
+        "a": JOB_FAILED,
+        "b": JOB_SUCCEEDED,
+        "c": JOB_SKIPPED,
+    }
+
+
+def test_scheduler_planning_error():
+    events = []
+    a = DummyJob("a", events)
+
+    def on_job_done(job):
+        raise QubesBuilderError("cannot plan")
+
+    scheduler = JobScheduler({a: []}, jobs=2, on_job_done=on_job_done)
+    with pytest.raises(QubesBuilderError, match="cannot plan"):
+        scheduler.run()
+    assert get_status(scheduler) == {"a": JOB_FAILED}
+
+
+def test_scheduler_unknown_dependency():
+    events = []
+    a = DummyJob("a", events)
+    b = DummyJob("b", events)
+    c = DummyJob("c", events)
+    with pytest.raises(QubesBuilderError, match="not planned"):
+        JobScheduler({b: [a]}, jobs=2)
+
+    # Jobs planned once a job is done are checked the same way
+    scheduler = JobScheduler(
+        {a: []},
+        jobs=2,
+        on_job_done=lambda job: {c: [b]} if job is a else {},
+    )
+    with pytest.raises(QubesBuilderError, match="not planned"):
+        scheduler.run()
+    assert get_status(scheduler) == {"a": JOB_FAILED}
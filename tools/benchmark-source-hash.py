@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2026 agent <agent@local>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""
+Time component source hash modes on a synthetic source tree: walk and
+parallel, without cache and with every file cached, then parallel after
+modifying a single file. Not run by the test suite.
+"""
+
+import argparse
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.fspath(pathlib.Path(__file__).resolve().parents[1]))
+
+from qubesbuilder.component import QubesComponent
+
+
+def get_source_hash(source_dir, cache, mode):
+    component = QubesComponent(
+        source_dir, source_hash_cache=cache, source_hash_mode=mode
+    )
+    start = time.monotonic()
+    source_hash = component.get_source_hash()
+    return source_hash, time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dirs", type=int, default=500)
+    parser.add_argument("--files-per-dir", type=int, default=100)
+    parser.add_argument("--file-size", type=int, default=64)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source_dir = pathlib.Path(tmp_dir) / "component"
+        for i in range(args.dirs):
+            (source_dir / f"dir{i}").mkdir(parents=True)
+            for j in range(args.files_per_dir):
+                (source_dir / f"dir{i}" / f"file{j}").write_bytes(
+                    os.urandom(args.file_size)
+                )
+        print(f"{args.dirs * args.files_per_dir} files in {source_dir}")
+
+        # Digests of both modes differ, each one must be stable
+        hashes = {}
+        for mode in ("walk", "parallel"):
+            cache = pathlib.Path(tmp_dir) / f"{mode}.json"
+            for run in ("cold", "cached"):
+                source_hash, elapsed = get_source_hash(source_dir, cache, mode)
+                hashes.setdefault(mode, set()).add(source_hash)
+                print(f"{mode} ({run}): {elapsed:.2f}s")
+
+        (source_dir / "dir0" / "file0").write_bytes(os.urandom(args.file_size))
+        source_hash, elapsed = get_source_hash(
+            source_dir, pathlib.Path(tmp_dir) / "parallel.json", "parallel"
+        )
+        print(f"parallel (one file modified): {elapsed:.2f}s")
+
+        if any(len(h) != 1 for h in hashes.values()) or (
+            source_hash in hashes["parallel"]
+        ):
+            print("Source hashes are inconsistent!", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()